@@ -0,0 +1,51 @@
+import time
+import statistics
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, total_time=None, errors=0):
+    """
+        latencies - время каждого запроса (в секундах)
+        total_time - общее время прогона (для requests/sec)
+    """
+    total_time = total_time if total_time is not None else sum(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'total_s': round(total_time, 4),
+        'rps': round(len(latencies) / total_time, 1) if total_time else 0.0,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def measure(func, repeat=100, warmup=5):
+    """
+        Вызывает func() repeat раз (после warmup прогревочных вызовов)
+        и возвращает статистику summarize()
+    """
+    for _ in range(warmup):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def format_row(name, stats):
+    return (
+        f'{name:<30} {stats["requests"]:>7} req  {stats["rps"]:>9} req/s  '
+        f'p50 {stats["p50_ms"]:>8} ms  p95 {stats["p95_ms"]:>8} ms  p99 {stats["p99_ms"]:>8} ms'
+    )
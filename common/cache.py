@@ -0,0 +1,180 @@
+"""
+Общие помощники для работы с кэшем.
+
+Версии (get_version / bump_version) - счётчики в кэше, которые входят
+в ключи закэшированных данных. Вместо удаления всех ключей, зависящих
+от объекта, достаточно увеличить его версию: старые ключи перестают
+использоваться и сами вытесняются по таймауту.
+
+get_or_compute - чтение дорогих данных с защитой от "лавины" (cache stampede):
+когда ключ пропадает, пересчитывает его только один запрос (тот, кто взял
+блокировку), остальные ждут результат или получают устаревшее значение.
+"""
+
+import math
+import time
+import uuid
+import random
+
+from django.core.cache import cache
+
+VERSION_TIMEOUT = None  # версии храним бессрочно
+
+
+def version_key(name):
+    return f'version:{name}'
+
+
+def _initial_version():
+    # если версия пропала из кэша (рестарт memcached, вытеснение), новая версия
+    # не должна совпасть со старой, иначе снова найдутся устаревшие данные
+    return int(time.time() * 1000)
+
+
+class UncachedVersion(int):
+    """
+        Версия, которой нет в кэше и которую не удалось туда положить (memcached недоступен).
+        Каждый раз новая - ни с чем закэшированным (в том числе в бд) не совпадёт,
+        а то, что под ней посчитано, сохранять не нужно
+    """
+
+
+def is_cached_version(version):
+    return not isinstance(version, UncachedVersion)
+
+
+def get_versions(names):
+    """{name: version} для нескольких версий одним запросом к кэшу"""
+    names = list(names)
+    keys = {version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    versions = {keys[key]: value for key, value in found.items()}
+    for name in names:
+        if name not in versions:
+            cache.add(version_key(name), _initial_version(), VERSION_TIMEOUT)
+            version = cache.get(version_key(name))
+            versions[name] = UncachedVersion(_initial_version()) if version is None else version
+    return versions
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+def bump_version(name):
+    try:
+        return cache.incr(version_key(name))
+    except ValueError:  # версии ещё нет в кэше
+        version = _initial_version()
+        cache.set(version_key(name), version, VERSION_TIMEOUT)
+        return version
+
+
+def bump_versions(names):
+    for name in set(names):
+        bump_version(name)
+
+
+# ------------------------------- get_or_compute
+
+def _lock_key(key):
+    return f'{key}:lock'
+
+
+def _acquire_lock(key, timeout):
+    token = uuid.uuid4().hex
+    if cache.add(_lock_key(key), token, timeout):
+        return token
+    return None
+
+
+def _release_lock(key, token):
+    if cache.get(_lock_key(key)) == token:
+        cache.delete(_lock_key(key))
+
+
+def set_computed(key, value, timeout, delta=0.0, stale_timeout=None):
+    """
+        Кладёт в кэш значение вместе со сроком свежести и временем расчёта (delta).
+        В кэше запись живёт timeout + stale_timeout секунд: после timeout
+        она считается устаревшей, но её ещё можно отдавать, пока идёт пересчёт.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+    envelope = (value, time.time() + timeout, delta)
+    cache.set(key, envelope, timeout + stale_timeout)
+    return value
+
+
+def recompute(key, compute, timeout, stale_timeout=None):
+    """Считает compute() и кладёт в кэш в формате get_or_compute"""
+    started = time.monotonic()
+    value = compute()
+    return set_computed(key, value, timeout, time.monotonic() - started, stale_timeout)
+
+
+def is_fresh(envelope, beta=1.0):
+    """
+        Вероятностное досрочное истечение (XFetch): чем ближе срок и чем дольше
+        считается значение, тем выше шанс, что его пересчитают заранее -
+        до того, как оно истечёт у всех воркеров одновременно
+    """
+    _, expires, delta = envelope
+    return time.time() - delta * beta * math.log(1.0 - random.random()) < expires
+
+
+def unwrap(envelope):
+    return envelope[0]
+
+
+def get_or_compute(key, compute, timeout, stale_timeout=None,
+                   beta=1.0, lock_timeout=30, wait_timeout=10, poll_interval=0.05):
+    """
+        Значение key из кэша или результат compute(), посчитанный одним запросом.
+
+        timeout - сколько секунд значение считается свежим
+        stale_timeout - сколько ещё секунд после этого можно отдавать устаревшее
+                        значение, пока другой запрос его пересчитывает
+        beta - коэффициент досрочного пересчёта (0 - выключен)
+        lock_timeout - на сколько берётся блокировка на пересчёт
+        wait_timeout - сколько ждать чужого пересчёта, если в кэше ничего нет,
+                       после этого считаем сами
+    """
+    envelope = cache.get(key)
+    if envelope is not None:
+        if is_fresh(envelope, beta):
+            return unwrap(envelope)
+        token = _acquire_lock(key, lock_timeout)
+        if token is None:
+            # пересчитывает кто-то другой - отдаём то, что есть
+            return unwrap(envelope)
+        try:
+            return recompute(key, compute, timeout, stale_timeout)
+        finally:
+            _release_lock(key, token)
+
+    deadline = time.monotonic() + wait_timeout
+    while True:
+        token = _acquire_lock(key, lock_timeout)
+        if token is not None:
+            try:
+                # пока мы ждали, значение мог положить тот, кто держал блокировку
+                envelope = cache.get(key)
+                if envelope is not None:
+                    return unwrap(envelope)
+                return recompute(key, compute, timeout, stale_timeout)
+            finally:
+                _release_lock(key, token)
+        if cache.get(_lock_key(key)) is None:
+            # add не прошёл, а блокировки нет: либо держатель только что её отпустил
+            # (значение уже в кэше), либо кэш ничего не хранит (memcached недоступен) - ждать некого
+            envelope = cache.get(key)
+            if envelope is not None:
+                return unwrap(envelope)
+            return recompute(key, compute, timeout, stale_timeout)
+        time.sleep(poll_interval)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return unwrap(envelope)
+        if time.monotonic() >= deadline:
+            return recompute(key, compute, timeout, stale_timeout)
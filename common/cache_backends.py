@@ -0,0 +1,360 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса (L1) перед общим кэшем (L2, memcached).
+
+Горячие ключи (предметы каталога, версии, фрагменты шаблонов, HTML контента)
+читаются из L1 без похода по сети. Все записи идут в L2, а L1 других воркеров
+узнаёт о них через журнал изменений в том же L2:
+    two_tier:generation - номер последнего изменения (incr при каждой записи)
+    two_tier:changed:<n> - ключи, изменённые n-й записью (None - clear())
+Раз в CHECK_INTERVAL секунд воркер читает generation и выкидывает из L1
+ключи из пропущенных записей журнала. Если журнал не полон (вытеснен,
+memcached перезапущен) или отстали слишком сильно - L1 очищается целиком.
+Т.е. другой воркер видит запись не позже, чем через CHECK_INTERVAL секунд.
+В журнал попадают только перезаписи и удаления: add (блокировки get_or_compute)
+и set нового ключа (ключи с версиями - страницы, HTML, снимки курсов) идут
+в L2 через add, и если ключа там не было, то и в L1 других воркеров его нет -
+публиковать нечего. Исключение - ключ, вытесненный из L2, пока его копия
+жила в чужом L1: она устареет не позже чем через L1_TIMEOUT.
+Журнал держится на атомарном incr номера, поэтому L2 - только кэш с атомарными
+incr/add (memcached, redis, locmem). У FileBasedCache incr - это get + set: две записи
+получили бы один номер, и одна из них пропала бы из журнала.
+
+Настройки (CACHES):
+    'default': {
+        'BACKEND': 'common.cache_backends.TwoTierCache',
+        'LOCATION': 'default',  # имя L1, как у LocMemCache - один L1 на процесс
+        'OPTIONS': {
+            'SHARED': 'shared',  # алиас L2 в CACHES
+            'MAX_SIZE': 4096,  # записей в L1
+            'L1_TIMEOUT': 60,  # сколько секунд запись живёт в L1
+            'CHECK_INTERVAL': 1,  # как часто сверяться с журналом (0 - при каждом обращении)
+        },
+    }
+Счётчики попаданий/промахов по уровням видны на главной странице админки
+(memcache_status), см. TwoTierStats; итог get (L1 или L2 / промах) ещё
+попадает в замер запроса (common/profiling.py).
+"""
+
+import os
+import time
+import pickle
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+
+from common.lru import LRUCache
+from common.profiling import record_cache
+
+GENERATION_KEY = 'two_tier:generation'
+CHANGE_LOG_TIMEOUT = 60 * 10
+# если пропущено больше записей журнала - L1 очищается целиком. Догнать журнал -
+# один get_many на MAX_LOG_GAP маленьких ключей раз в CHECK_INTERVAL, это дешевле,
+# чем терять весь L1 при каждой проверке, когда кластер пишет больше 100 раз в секунду
+MAX_LOG_GAP = 1000
+# L2 с атомарными incr и add
+ATOMIC_SHARED_BACKENDS = (
+    'django.core.cache.backends.memcached.',
+    'django.core.cache.backends.redis.',
+    'django.core.cache.backends.locmem.',
+)
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+_missing = object()
+
+
+def _change_key(generation):
+    return f'two_tier:changed:{generation}'
+
+
+class LocalTier:
+    """
+        L1 одного процесса: сам LRU, последний прочитанный номер журнала
+        и счётчики. Общий для всех потоков (caches[...] в django свой у каждого потока)
+    """
+
+    def __init__(self, max_size, timeout):
+        self.data = LRUCache(max_size=max_size, timeout=timeout)
+        self.generation = None
+        self.published = set()  # свои записи журнала - их применять к L1 не нужно
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.counters = {
+            'l1_hits': 0,
+            'l1_misses': 0,
+            'l2_hits': 0,
+            'l2_misses': 0,
+            'invalidations': 0,
+            'flushes': 0,
+        }
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+
+def get_local_tier(name, max_size, timeout):
+    with _tiers_lock:
+        if name not in _tiers:
+            _tiers[name] = LocalTier(max_size, timeout)
+        return _tiers[name]
+
+
+class TwoTierStats:
+    """
+        memcache_status берёт статистику из cache._cache.get_stats() в формате
+        python-memcached: [(адрес, {показатель: значение}), ...].
+        cmd_get и get_misses нужны шаблону для "Miss Ratio"
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_stats(self):
+        tier = self.backend.local
+        with tier.lock:
+            counters = dict(tier.counters)
+        l1_gets = counters['l1_hits'] + counters['l1_misses']
+        l2_gets = counters['l2_hits'] + counters['l2_misses']
+        return [
+            (f'L1 (pid {os.getpid()})', {
+                'cmd_get': l1_gets,
+                'get_hits': counters['l1_hits'],
+                'get_misses': counters['l1_misses'],
+                'curr_items': len(tier.data),
+                'limit_maxitems': tier.data.max_size,
+                'generation': tier.generation,
+                'invalidations': counters['invalidations'],
+                'flushes': counters['flushes'],
+            }),
+            (f'L2 ({self.backend.shared_alias})', {
+                'cmd_get': l2_gets,
+                'get_hits': counters['l2_hits'],
+                'get_misses': counters['l2_misses'],
+            }),
+        ]
+
+
+class TwoTierCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        shared_backend = settings.CACHES.get(self.shared_alias, {}).get('BACKEND', '')
+        if not shared_backend.startswith(ATOMIC_SHARED_BACKENDS):
+            raise ImproperlyConfigured(
+                f'TwoTierCache: L2 {self.shared_alias!r} ({shared_backend}) без атомарного incr - '
+                f'нужен memcached, redis или locmem'
+            )
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self.check_interval = options.get('CHECK_INTERVAL', 1)
+        self.local = get_local_tier(
+            location or 'default',
+            options.get('MAX_SIZE', 4096),
+            self.l1_timeout
+        )
+        self._cache = TwoTierStats(self)
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    # ---------------------------------------------------- журнал изменений
+
+    def _next_generation(self):
+        shared = self.shared
+        try:
+            return shared.incr(GENERATION_KEY)
+        except ValueError:
+            # номера нет (первый запуск, memcached перезапущен). Начинаем с
+            # метки времени, чтобы не совпасть с номерами, которые видели воркеры
+            generation = int(time.time() * 1000)
+            if shared.add(GENERATION_KEY, generation, None):
+                return generation
+            try:
+                return shared.incr(GENERATION_KEY)
+            except ValueError:  # L2 недоступен
+                return None
+
+    def _publish(self, keys):
+        """сообщает другим воркерам, что keys (None - все) изменились"""
+        generation = self._next_generation()
+        if generation is None:
+            return None
+        self.shared.set(_change_key(generation), keys, CHANGE_LOG_TIMEOUT)
+        tier = self.local
+        with tier.lock:
+            if tier.generation is not None and generation == tier.generation + 1:
+                # между нашими записями никто не писал - журнал читать незачем
+                tier.generation = generation
+            else:
+                tier.published.add(generation)
+        return generation
+
+    def _flush_local(self):
+        self.local.data.clear()
+        self.local.count('flushes')
+
+    def _sync(self):
+        tier = self.local
+        now = time.monotonic()
+        if now - tier.checked < self.check_interval:
+            return
+        tier.checked = now
+        shared = self.shared
+        current = shared.get(GENERATION_KEY)
+        with tier.lock:
+            known, tier.generation = tier.generation, current
+            published, tier.published = tier.published, set()
+        if current == known:
+            return
+        if current is None or known is None or not 0 < current - known <= MAX_LOG_GAP:
+            self._flush_local()
+            return
+        missed = [n for n in range(known + 1, current + 1) if n not in published]
+        changes = shared.get_many([_change_key(n) for n in missed])
+        if len(changes) != len(missed) or any(keys is None for keys in changes.values()):
+            self._flush_local()
+            return
+        for keys in changes.values():
+            for key in keys:
+                tier.data.delete(key)
+        self.local.count('invalidations', len(changes))
+
+    # ---------------------------------------------------- L1
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _local_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self._local_timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            self.local.data.delete(key)
+            return
+        # в L1 лежит pickle, как в LocMemCache - чтобы изменение полученного
+        # объекта не портило закэшированное значение
+        self.local.data.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), timeout=timeout)
+
+    def _local_get(self, key):
+        pickled = self.local.data.get(key, _missing)
+        if pickled is _missing:
+            return _missing
+        return pickle.loads(pickled)
+
+    # ---------------------------------------------------- API кэша
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        self._sync()
+        value = self._local_get(local_key)
+        if value is not _missing:
+            self.local.count('l1_hits')
+            record_cache(hits=1)
+            return value
+        self.local.count('l1_misses')
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            self.local.count('l2_misses')
+            record_cache(misses=1)
+            return default
+        self.local.count('l2_hits')
+        record_cache(hits=1)
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        rest = []
+        for key in keys:
+            value = self._local_get(self.make_key(key, version))
+            if value is _missing:
+                rest.append(key)
+            else:
+                found[key] = value
+        self.local.count('l1_hits', len(found))
+        shared_found = {}
+        if rest:
+            self.local.count('l1_misses', len(rest))
+            shared_found = self.shared.get_many(rest, version=version)
+            self.local.count('l2_hits', len(shared_found))
+            self.local.count('l2_misses', len(rest) - len(shared_found))
+            for key, value in shared_found.items():
+                self._local_set(self.make_key(key, version), value)
+            found.update(shared_found)
+        record_cache(hits=len(found), misses=len(rest) - len(shared_found))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_key(key, version)
+        # новый ключ (add прошёл) ни у кого в L1 быть не может - в журнал не пишем;
+        # timeout <= 0 - это удаление, его публикуем всегда
+        if timeout is DEFAULT_TIMEOUT or timeout is None or timeout > 0:
+            added = self.shared.add(key, value, timeout, version=version)
+        else:
+            added = False
+        if not added:
+            self.shared.set(key, value, timeout, version=version)
+            self._publish([local_key])
+        self._local_set(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self._publish([self.make_key(key, version) for key in data])
+        for key, value in data.items():
+            if key not in failed:
+                self._local_set(self.make_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # add - это блокировки (common/cache.py), решать должен L2.
+        # Ключа в L2 не было - других воркеров оповещать не о чем
+        local_key = self.make_key(key, version)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._local_set(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self.make_key(key, version)
+        value = self.shared.incr(key, delta, version=version)
+        self._publish([local_key])
+        self.local.data.delete(local_key)
+        return value
+
+    def delete(self, key, version=None):
+        local_key = self.make_key(key, version)
+        deleted = self.shared.delete(key, version=version)
+        self._publish([local_key])
+        self.local.data.delete(local_key)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version=version)
+        self._publish([self.make_key(key, version) for key in keys])
+        for key in keys:
+            self.local.data.delete(self.make_key(key, version))
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        self.shared.clear()
+        generation = self._publish(None)
+        self._flush_local()
+        with self.local.lock:
+            self.local.generation = generation
+            self.local.published.clear()
@@ -0,0 +1,67 @@
+"""
+Настройка соединений с SQLite для работы под нагрузкой.
+
+По умолчанию SQLite пишет через rollback journal: пока идёт запись,
+читатели ждут, а параллельные записи (записи на курс, перестановки)
+падают с "database is locked". При каждом новом соединении выполняются
+PRAGMA из DATABASES[alias]['PRAGMAS'] (по умолчанию SQLITE_PRAGMAS):
+    journal_mode=WAL - читатели не блокируются писателем
+    synchronous=NORMAL - в WAL безопасно и без fsync на каждый коммит
+    busy_timeout - сколько мс ждать блокировку, прежде чем вернуть ошибку
+    cache_size / mmap_size - кэш страниц и чтение через mmap
+    temp_store=MEMORY - временные таблицы и сортировки в памяти
+
+Постоянные соединения - CONN_MAX_AGE. Раз соединение живёт между запросами,
+в начале запроса оно проверяется (HEALTH_CHECKS: True): если SELECT 1
+не проходит, соединение закрывается и django откроет новое.
+"""
+
+from django.db import connections
+from django.dispatch import receiver
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,  # отрицательное - в КиБ (~20 МБ)
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def get_pragmas(settings_dict):
+    return settings_dict.get('PRAGMAS', SQLITE_PRAGMAS)
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def setup_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, get_pragmas(connection.settings_dict))
+
+
+def is_healthy(connection):
+    # напрямую через драйвер - проверка не должна попадать в запросы django
+    try:
+        connection.connection.cursor().execute('SELECT 1')
+    except connection.Database.Error:
+        return False
+    return True
+
+
+@receiver(request_started)
+def check_persistent_connections(**kwargs):
+    # django (до 4.1) сам проверяет соединение только после ошибок в прошлом запросе
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict.get('HEALTH_CHECKS'):
+            continue
+        if not is_healthy(connection):
+            connection.close()
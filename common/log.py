@@ -0,0 +1,243 @@
+"""
+Асинхронная запись логов пачками.
+
+Обычный FileHandler пишет каждую запись в файл под блокировкой handler-а,
+в потоке запроса - с логированием SQL это запись в файл на каждый запрос в бд.
+AsyncBatchHandler только кладёт запись в очередь (QueueHandler), а файл пишет
+фоновый поток: забирает до BATCH_SIZE записей, пишет их одним write()
+и ротирует файл по размеру (max_bytes) и по времени (rotate_seconds - по
+границам периодов). Если в файл пишут несколько процессов, ротирует тот, кто
+первым заметил, остальные видят новый файл по пути и просто переоткрывают его.
+
+Очередь ограничена (queue_size). Если она заполнена больше, чем на
+pressure_ratio, записи ниже WARNING пишутся с вероятностью sample_rate,
+а в полную очередь они не попадают совсем (WARNING и выше ждут до
+block_timeout секунд). Сколько записей отброшено - пишется отдельной записью.
+
+JSONFormatter - одна запись = одна строка JSON (для сбора логов).
+SlowQueryFilter - для django.db.backends: пропускает только запросы
+дольше threshold_ms (django логирует SQL только при DEBUG).
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import datetime
+import threading
+from logging.handlers import QueueHandler
+
+# поля LogRecord, которые не нужно переносить в JSON как дополнительные
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+_PLAIN_TYPES = (str, int, float, bool, type(None), list, tuple, dict)
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage() if record.args else str(record.msg),
+        }
+        for name, value in vars(record).items():
+            # extra: duration, sql, params, alias (django.db.backends), status_code, request
+            if name not in _RECORD_FIELDS and not name.startswith('_'):
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SlowQueryFilter(logging.Filter):
+    """
+        Для хэндлера: из записей django.db.backends (и дочерних логгеров) пропускает
+        только запросы дольше threshold_ms, записи других логгеров - все
+    """
+    logger_name = 'django.db.backends'
+
+    def __init__(self, threshold_ms=None):
+        super().__init__()
+        self.threshold_ms = threshold_ms
+
+    def filter(self, record):
+        if record.name != self.logger_name and not record.name.startswith(self.logger_name + '.'):
+            return True
+        if not self.threshold_ms:
+            return True
+        duration = getattr(record, 'duration', None)  # секунды
+        return duration is not None and duration * 1000 >= self.threshold_ms
+
+
+class AsyncBatchHandler(QueueHandler):
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 0.5  # секунд - как долго запись может ждать в очереди
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, rotate_seconds=None, backup_count=5,
+                 queue_size=10000, pressure_ratio=0.8, sample_rate=0.1, block_timeout=0.1):
+        super().__init__(queue.Queue(queue_size))
+        self.filename = os.fspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.pressure_size = int(queue_size * pressure_ratio)
+        self.sample_rate = sample_rate
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.stream = None
+        self.period = None
+        self.thread = None
+        self.thread_pid = None
+        self.start_lock = threading.Lock()
+
+    # ---------------------------------------------------- поток запроса
+
+    def prepare(self, record):
+        # в очередь - уже готовый текст: аргументы и traceback живут только в потоке запроса
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        for name, value in vars(record).items():
+            # request и т.п. - строкой, чтобы не держать объекты в очереди
+            if name not in _RECORD_FIELDS and not isinstance(value, _PLAIN_TYPES):
+                setattr(record, name, str(value))
+        return record
+
+    def enqueue(self, record):
+        self.start()
+        if record.levelno < logging.WARNING:
+            if self.queue.qsize() >= self.pressure_size and random.random() >= self.sample_rate:
+                self.dropped += 1
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            return
+        try:
+            self.queue.put(record, timeout=self.block_timeout)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        # поток создаётся лениво и заново после fork (воркеры gunicorn/uwsgi)
+        if self.thread_pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            self.thread_pid = None  # следующая запись запустит поток заново
+
+    def close(self):
+        self.stop()
+        super().close()
+
+    # ---------------------------------------------------- фоновый поток
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=self.FLUSH_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                batch = batch[:batch.index(None)]
+                stopping = True
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                batch.append(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f'log queue is full, {dropped} records dropped', 'dropped': dropped,
+                }))
+            if batch:
+                self.write(batch)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+        try:
+            if self.stream is None or self.replaced():
+                self.open()
+            if self.should_rotate():
+                self.rotate()
+                self.open()
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        except OSError:
+            self.handleError(batch[0])
+
+    def open(self):
+        if self.stream is not None:
+            self.stream.close()
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        self.stream = open(self.filename, 'a', encoding='utf-8')
+        # период ротации файла - по времени его последней записи (файл мог остаться от прошлого запуска)
+        self.period = self.get_period(os.fstat(self.stream.fileno()).st_mtime)
+
+    def get_period(self, timestamp):
+        return int(timestamp // self.rotate_seconds) if self.rotate_seconds else 0
+
+    def replaced(self):
+        # файл уже ротировал другой процесс (воркеры пишут в один файл) - просто переоткрываем
+        try:
+            current = os.stat(self.filename)
+        except FileNotFoundError:
+            return True
+        opened = os.fstat(self.stream.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
+
+    def should_rotate(self):
+        if self.max_bytes and self.stream.tell() >= self.max_bytes:
+            return True
+        return self.get_period(time.time()) != self.period
+
+    def rotate(self):
+        self.stream.close()
+        self.stream = None
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        target = f'{self.filename}.{stamp}'
+        number = 0
+        while os.path.exists(target):
+            number += 1
+            target = f'{self.filename}.{stamp}-{number}'
+        os.replace(self.filename, target)
+        if self.backup_count:
+            directory, name = os.path.split(self.filename)
+            backups = sorted(
+                file for file in os.listdir(directory or '.') if file.startswith(name + '.')
+            )
+            for file in backups[:-self.backup_count]:
+                os.remove(os.path.join(directory, file))
@@ -0,0 +1,56 @@
+import time
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """
+        Потокобезопасный LRU-кэш в памяти процесса.
+        max_size - максимальное кол-во записей, при переполнении
+                   вытесняется запись, к которой дольше всего не обращались
+        timeout - время жизни записи в секундах (None - без ограничения)
+    """
+
+    def __init__(self, max_size=1024, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                return default
+            value, expires = value
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=_missing):
+        if timeout is _missing:
+            timeout = self.timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, _missing) is not _missing
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,259 @@
+"""
+Профилирование запросов с выборкой (sampling).
+
+RequestProfilingMiddleware замеряет долю SAMPLE_RATE запросов:
+    время запроса, количество и время SQL-запросов (execute_wrapper - без DEBUG
+    и без логирования каждого запроса), попадания/промахи кэша (их сообщает
+    TwoTierCache, common/cache_backends.py) и время рендеринга TemplateResponse.
+Замеры складываются в гистограммы в памяти процесса, по имени view.
+Отдаются в формате Prometheus по /metrics/ (INTERNAL_IPS или staff).
+
+Если задан PROFILE_SLOW_MS, выбранные запросы идут под cProfile, и для тех,
+что оказались медленнее порога, в PROFILE_DIR сохраняется .prof
+(смотреть: python -m pstats <файл> или snakeviz).
+
+Под ASGI middleware работает асинхронно: SQL выполняется в потоках
+sync_to_async, поэтому execute_wrapper (record_query) стоит на всех соединениях
+и находит замер запроса через ContextVar. cProfile в async-режиме не включается -
+в event loop он профилировал бы все запросы сразу.
+
+Настройки - settings.REQUEST_PROFILING:
+    ENABLED, SAMPLE_RATE (0..1), PROFILE_SLOW_MS (None - без cProfile), PROFILE_DIR
+"""
+
+import os
+import time
+import random
+import asyncio
+import cProfile
+import threading
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.deprecation import MiddlewareMixin
+
+# границы корзин гистограмм, мс
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_sample = ContextVar('request_profiling_sample', default=None)
+
+
+def get_profiling_settings():
+    return {
+        'ENABLED': True,
+        'SAMPLE_RATE': 0.05,
+        'PROFILE_SLOW_MS': None,
+        'PROFILE_DIR': os.path.join(settings.BASE_DIR, 'log', 'profiles'),
+        **getattr(settings, 'REQUEST_PROFILING', {}),
+    }
+
+
+class Sample:
+    """замеры одного запроса"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper всех соединений; вне выбранного запроса только вызывает execute"""
+    sample = _sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def add_query_recorder(sender, connection, **kwargs):
+    # signal приходит и при переподключении того же DatabaseWrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache(hits=0, misses=0):
+    """вызывается кэшем; вне выбранного запроса ничего не делает"""
+    sample = _sample.get()
+    if sample is not None:
+        sample.cache_hits += hits
+        sample.cache_misses += misses
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """гистограммы и счётчики по view, в памяти процесса"""
+
+    histograms = {
+        'request_latency_ms': BUCKETS,
+        'request_db_time_ms': BUCKETS,
+        'request_db_queries': QUERY_BUCKETS,
+        'request_template_ms': BUCKETS,
+    }
+    counters = ('request_cache_hits', 'request_cache_misses', )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view_name, latency, sample):
+        values = {
+            'request_latency_ms': latency * 1000,
+            'request_db_time_ms': sample.db_time * 1000,
+            'request_db_queries': sample.queries,
+            'request_template_ms': sample.template_time * 1000,
+        }
+        with self.lock:
+            if view_name not in self.views:
+                self.views[view_name] = {
+                    **{name: Histogram(buckets) for name, buckets in self.histograms.items()},
+                    **{name: 0 for name in self.counters},
+                }
+            view = self.views[view_name]
+            for name, value in values.items():
+                view[name].observe(value)
+            view['request_cache_hits'] += sample.cache_hits
+            view['request_cache_misses'] += sample.cache_misses
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def render(self):
+        """формат Prometheus (text exposition)"""
+        lines = []
+        with self.lock:
+            for name in self.histograms:
+                lines.append(f'# TYPE {name} histogram')
+                for view_name, view in sorted(self.views.items()):
+                    histogram = view[name]
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view_name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view_name}"}} {round(histogram.sum, 3)}')
+                    lines.append(f'{name}_count{{view="{view_name}"}} {histogram.count}')
+            for name in self.counters:
+                lines.append(f'# TYPE {name} counter')
+                for view_name, view in sorted(self.views.items()):
+                    lines.append(f'{name}{{view="{view_name}"}} {view[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def is_sampled(options):
+    return options['ENABLED'] and random.random() < options['SAMPLE_RATE']
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class RequestProfilingMiddleware(MiddlewareMixin):
+    # MiddlewareMixin - синхронный и асинхронный режим, как у middleware django
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        options = get_profiling_settings()
+        if not is_sampled(options):
+            return self.get_response(request)
+
+        # соединения, открытые до импорта модуля, connection_created не застал
+        for connection in connections.all():
+            add_query_recorder(sender=None, connection=connection)
+        sample = Sample()
+        token = _sample.set(sample)
+        profiler = cProfile.Profile() if options['PROFILE_SLOW_MS'] is not None else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            _sample.reset(token)
+        latency = time.perf_counter() - started
+
+        view_name = get_view_name(request)
+        metrics.observe(view_name, latency, sample)
+        if profiler is not None and latency * 1000 >= options['PROFILE_SLOW_MS']:
+            self.dump_profile(profiler, options['PROFILE_DIR'], view_name, latency)
+        return response
+
+    async def __acall__(self, request):
+        options = get_profiling_settings()
+        if not is_sampled(options):
+            return await self.get_response(request)
+
+        sample = Sample()
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sample.reset(token)
+        metrics.observe(get_view_name(request), time.perf_counter() - started, sample)
+        return response
+
+    def process_template_response(self, request, response):
+        # рендеринг идёт после всех process_template_response
+        sample = _sample.get()
+        if sample is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                sample.template_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def dump_profile(self, profiler, directory, view_name, latency):
+        os.makedirs(directory, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{view_name.replace(":", "_")}-{round(latency * 1000)}ms.prof'
+        profiler.dump_stats(os.path.join(directory, name))
+
+
+def metrics_view(request):
+    allowed = request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS or request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,146 @@
+"""
+Запись выборки настоящих запросов для нагрузочного replay.
+
+RequestRecordingMiddleware пишет долю SAMPLE_RATE запросов строками JSON
+(формат ввода для python manage.py replay_requests):
+    {"method": "POST", "path": "/students/enroll-course/", "query": "",
+     "role": "student", "auth": "session", "content_type": "application/x-www-form-urlencoded",
+     "body": {"course": ["5"]}, "url_name": "students:student_enroll_course", "status": 302}
+role - anonymous | student | instructor | staff: на replay под каждую роль
+логинится свой пользователь. auth - session или header (токен/Basic в API).
+Пароли, токены и csrf в body не попадают, файлы (multipart) не пишутся.
+
+Строки уходят в логгер common.replay - в settings.LOGGING это AsyncBatchHandler
+(common/log.py), т.е. запись в файл не задерживает запрос.
+
+Настройки - settings.REQUEST_RECORDING: SAMPLE_RATE (0 - выключено), MAX_BODY (байт)
+"""
+
+import json
+import random
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('anonymous', 'student', 'instructor', 'staff', )
+SENSITIVE_FIELDS = ('password', 'password1', 'password2', 'csrfmiddlewaretoken', 'token', 'key', )
+REQUIRED_FIELDS = ('method', 'path', )
+# вход и выход на replay делает сам клиент роли, метрики - не нагрузка
+EXCLUDED_URL_NAMES = ('login', 'logout', 'metrics', )
+
+
+def get_recording_settings():
+    return {
+        'SAMPLE_RATE': 0,
+        'MAX_BODY': 16 * 1024,
+        **getattr(settings, 'REQUEST_RECORDING', {}),
+    }
+
+
+def get_role(user):
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    if user.has_perm('courses.add_course'):
+        return 'instructor'
+    return 'student'
+
+
+def clean_body(data):
+    return {name: value for name, value in data.items() if name.lower() not in SENSITIVE_FIELDS}
+
+
+def read_body(request, max_body):
+    """body запроса без секретов; None - тела нет или его не записать"""
+    if request.method in ('GET', 'HEAD', 'OPTIONS'):
+        return None
+    content_type = request.content_type
+    if content_type == 'application/json':
+        if len(request.body) > max_body:
+            return None
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return None
+        return clean_body(data) if isinstance(data, dict) else data
+    if content_type == 'application/x-www-form-urlencoded':
+        if len(request.body) > max_body:
+            return None
+        return clean_body({name: request.POST.getlist(name) for name in request.POST})
+    return None
+
+
+def parse_line(text):
+    """
+        Строка файла записи -> dict или None, если это не запись запроса
+        (пустая строка, мусор, обрезанная при ротации запись)
+    """
+    try:
+        line = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(line, dict) or not all(isinstance(line.get(name), str) for name in REQUIRED_FIELDS):
+        return None
+    if not line['path'].startswith('/'):
+        return None
+    line['method'] = line['method'].upper()
+    line.setdefault('query', '')
+    line.setdefault('role', 'anonymous')
+    line.setdefault('auth', 'session')
+    return line
+
+
+class RequestRecordingMiddleware(MiddlewareMixin):
+    # MiddlewareMixin - синхронный и асинхронный режим, как у middleware django
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        options = get_recording_settings()
+        if random.random() >= options['SAMPLE_RATE']:
+            return self.get_response(request)
+        # тело читаем до view: после чтения потока (multipart, DRF) request.body недоступен
+        body = read_body(request, options['MAX_BODY'])
+        response = self.get_response(request)
+        if self.is_recorded(request):
+            self.record(request, response, body, get_role(getattr(request, 'user', None)))
+        return response
+
+    async def __acall__(self, request):
+        options = get_recording_settings()
+        if random.random() >= options['SAMPLE_RATE']:
+            return await self.get_response(request)
+        # под ASGI тело уже прочитано в память
+        body = read_body(request, options['MAX_BODY'])
+        response = await self.get_response(request)
+        if self.is_recorded(request):
+            # request.user загружается из бд лениво - не в event loop
+            role = await sync_to_async(get_role, thread_sensitive=True)(getattr(request, 'user', None))
+            self.record(request, response, body, role)
+        return response
+
+    def is_recorded(self, request):
+        match = request.resolver_match
+        return match is None or match.view_name not in EXCLUDED_URL_NAMES
+
+    def record(self, request, response, body, role):
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'query': request.META.get('QUERY_STRING', ''),
+            # пользователя API (токен, Basic) DRF тоже кладёт в request.user
+            'role': role,
+            'auth': 'header' if 'HTTP_AUTHORIZATION' in request.META else 'session',
+            'content_type': request.content_type if body is not None else None,
+            'body': body,
+            'url_name': match.view_name if match is not None else None,
+            'status': response.status_code,
+        }, ensure_ascii=False))
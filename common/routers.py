@@ -0,0 +1,144 @@
+"""
+Чтение с реплик, запись в основную базу (default).
+
+ReplicaRouter отправляет чтения моделей из REPLICA_APPS на одну из
+REPLICA_DATABASES (пусто - всё идёт в default, как без роутера).
+Реплика отстаёт от основной базы, поэтому чтения идут в default:
+    - вне запроса (management-команды, shell) - там обычно сразу читают записанное
+    - до конца запроса, в котором была запись (в том числе в той же транзакции);
+      запросы на запись (select_for_update, update, get_or_create) всегда идут в default
+    - PRIMARY_PIN_SECONDS секунд после запроса с записью для этого пользователя
+      (ключ в кэше - работает и для API с токеном) и для этого браузера (cookie)
+    - внутри primary_reads() - чтения, результат которых кладётся в кэш с ключом
+      по версии (каталог, снимок курса, страницы студента): версия уже увеличена,
+      и данные с отстающей реплики остались бы в кэше под новой версией
+Состояние запроса ставит PrimaryPinMiddleware (после AuthenticationMiddleware).
+Под ASGI ORM работает в потоках sync_to_async - они получают копию контекста,
+т.е. то же состояние запроса.
+"""
+
+import random
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = 'db_primary_pin'
+
+_request_state = ContextVar('db_request_state', default=None)
+_primary_reads = ContextVar('db_primary_reads', default=False)
+
+
+@contextmanager
+def primary_reads():
+    """все чтения внутри - из default (можно и декоратором)"""
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def pin_key(user_id):
+    return f'db_primary_pin:{user_id}'
+
+
+def get_pin_seconds():
+    return getattr(settings, 'PRIMARY_PIN_SECONDS', 10)
+
+
+class RequestState:
+
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self._pinned = {}  # id пользователя -> закреплён ли он за default
+
+    def is_pinned(self):
+        if self.wrote or self.request.COOKIES.get(PIN_COOKIE):
+            return True
+        # пользователь берётся лениво: API (DRF) аутентифицирует уже во view
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        if user.pk not in self._pinned:
+            self._pinned[user.pk] = bool(cache.get(pin_key(user.pk)))
+        return self._pinned[user.pk]
+
+
+class ReplicaRouter:
+
+    def get_replicas(self):
+        return getattr(settings, 'REPLICA_DATABASES', [])
+
+    def get_apps(self):
+        return getattr(settings, 'REPLICA_APPS', ('courses', 'students', ))
+
+    def db_for_read(self, model, **hints):
+        if not self.is_routed(model):
+            return None
+        state = _request_state.get()
+        if state is None or _primary_reads.get() or state.is_pinned():
+            return 'default'
+        return random.choice(self.get_replicas())
+
+    def is_routed(self, model):
+        return bool(self.get_replicas()) and model._meta.app_label in self.get_apps()
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        # объект, прочитанный с реплики, сохраняется всё равно в default
+        return 'default' if self.is_routed(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики - копии default, объекты с них можно связывать между собой
+        databases = {'default', *self.get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class PrimaryPinMiddleware(MiddlewareMixin):
+    # MiddlewareMixin - синхронный и асинхронный режим, как у middleware django
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RequestState(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote:
+            self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        state = RequestState(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote:
+            # request.user загружается из бд лениво - не в event loop
+            await sync_to_async(self.pin, thread_sensitive=True)(request, response)
+        return response
+
+    def pin(self, request, response):
+        seconds = get_pin_seconds()
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cache.set(pin_key(user.pk), True, seconds)
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
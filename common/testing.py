@@ -0,0 +1,132 @@
+"""
+Помощники для тестов производительности.
+
+build_catalog - небольшой, но похожий на настоящий каталог:
+    предметы -> курсы -> модули -> контент всех типов (Text, File, Image, Video),
+    студенты, записанные на курсы. Всё создаётся обычным create(),
+    т.е. с сигналами (версии кэша, счётчики порядка) - как в приложении.
+
+QueryBudgetMixin - assertQueryBudget(url, budget): запрос к url должен
+укладываться в budget SQL-запросов. Бюджет - текущее число запросов,
+так что тест падает на любом добавленном запросе (N+1 в шаблоне и т.п.).
+Время каждого запроса запоминается; с QUERY_BUDGET_REPORT=1 в окружении
+после тестов класса печатается таблица: url, запросов, бюджет, мс.
+"""
+
+import os
+import sys
+import time
+from functools import partial
+from types import SimpleNamespace
+
+from asgiref.sync import async_to_sync
+
+from django.db import connections
+from django.core.cache import caches
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+
+from courses.models import Subject, Course, Module, Content, Text, File, Image, Video
+
+ITEM_MODELS = (Text, File, Image, Video, )
+
+
+def create_item(model, owner, number):
+    params = {
+        'owner': owner,
+        'title': f'{model._meta.model_name} {number}',
+    }
+    if model is Text:
+        params['content'] = f'text {number}'
+    elif model is Video:
+        params['url'] = f'https://www.youtube.com/watch?v=video{number}'
+    else:
+        params['file'] = f'files/{number}.txt'
+    return model.objects.create(**params)
+
+
+def build_catalog(subjects=3, courses=3, modules=3, contents=4, students=3, owners=2):
+    """
+        subjects предметов, в каждом courses курсов, в курсе modules модулей,
+        в модуле contents объектов контента (типы по кругу).
+        Студенты записаны на все курсы первого предмета
+    """
+    User = get_user_model()
+    catalog = SimpleNamespace(subjects=[], courses=[], modules=[], contents=[])
+    catalog.owners = [
+        User.objects.create_user(username=f'owner{number}', password='password')
+        for number in range(owners)
+    ]
+    catalog.students = [
+        User.objects.create_user(username=f'student{number}', password='password')
+        for number in range(students)
+    ]
+    number = 0
+    for subject_number in range(subjects):
+        subject = Subject.objects.create(title=f'Subject {subject_number}')
+        catalog.subjects.append(subject)
+        for course_number in range(courses):
+            course = Course.objects.create(
+                owner=catalog.owners[course_number % owners],
+                subject=subject,
+                title=f'Course {subject_number}.{course_number}',
+                description='description ' * 20,
+            )
+            catalog.courses.append(course)
+            for module_number in range(modules):
+                module = Module.objects.create(course=course, title=f'Module {module_number}')
+                catalog.modules.append(module)
+                for _ in range(contents):
+                    model = ITEM_MODELS[number % len(ITEM_MODELS)]
+                    item = create_item(model, course.owner, number)
+                    catalog.contents.append(Content.objects.create(module=module, item=item))
+                    number += 1
+    for course in catalog.courses[:courses]:
+        course.students.add(*catalog.students)
+    return catalog
+
+
+class QueryBudgetMixin:
+    timings = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.timings = []
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get('QUERY_BUDGET_REPORT') and cls.timings:
+            sys.stderr.write(f'\n{cls.__name__}\n')
+            for method, url, queries, budget, elapsed in cls.timings:
+                sys.stderr.write(f'    {method:<6} {url:<60} {queries:>4} / {budget:<4} {elapsed:>8.1f} ms\n')
+        super().tearDownClass()
+
+    def assertQueryBudget(self, url, budget, method='get', status=200, using='default', asgi=False, **kwargs):
+        """
+            Запрос с холодным кэшем (иначе кэш страниц и каталога прячет запросы в бд).
+            kwargs - как у self.client.get/post (data, HTTP_ заголовки)
+            asgi - через self.async_client (middleware и view в async-режиме);
+                   заголовки тогда без HTTP_ (AsyncClient в django 4.0 их не понимает)
+        """
+        for cache in caches.all():
+            cache.clear()
+        if asgi:
+            async def request():
+                return await getattr(self.async_client, method)(url, **kwargs)
+
+            send = async_to_sync(request)
+        else:
+            send = partial(getattr(self.client, method), url, **kwargs)
+        with CaptureQueriesContext(connections[using]) as queries:
+            started = time.perf_counter()
+            response = send()
+            elapsed = (time.perf_counter() - started) * 1000
+        self.timings.append((method.upper(), url, len(queries), budget, elapsed))
+        self.assertEqual(response.status_code, status, f'{method.upper()} {url}')
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{method.upper()} {url}: {len(queries)} запросов при бюджете {budget}\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return response
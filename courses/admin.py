@@ -1,6 +1,6 @@
 from django.contrib import admin
 from courses.models import (
-    Subject, Course, Module, Content,
+    Subject, Course, Module, Content, APIToken,
 )
 
 
@@ -32,4 +32,11 @@ class ContentAdmin(admin.ModelAdmin):
     list_display = 'pk', 'module', 'order',
 
 
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'name', 'created', 'expires', 'revoked',)
+    list_filter = ('revoked',)
+    readonly_fields = ('key_hash',)
+
+
 admin.site.index_template = 'memcache_status/admin_index.html'
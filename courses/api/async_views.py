@@ -0,0 +1,67 @@
+"""
+Чтения API под ASGI (/api/async/...) - тонкая обёртка над синхронными представлениями.
+
+В django 4.0 ещё нет async ORM (в 4.1 это будет тот же sync_to_async вокруг
+синхронного ORM), а DRF не умеет async-представления. Поэтому:
+    - ответ строит то же представление DRF, что и в /api/ (права, пагинация,
+      ?fields/?expand, ETag), через sync_to_async(thread_sensitive=True) -
+      ровно так django под ASGI и так запускает любое синхронное представление.
+      Бд, кэш и сериализация идут в одном общем синхронном потоке, по очереди:
+      одновременных чтений из бд это не добавляет
+    - по-настоящему асинхронен только 304 курса (retrieve): If-None-Match
+      проверяется до DRF по версиям в кэше (cache.aget, acourse_validators) -
+      на 304 не нужны ни поток DRF, ни бд.
+      Если версии в кэше нет (её создаёт синхронный путь) - обычный ответ
+Выигрыш под ASGI - только на этих 304 и в middleware проекта (они умеют оба
+режима, кроме debug toolbar - см. DEBUG_TOOLBAR в settings); остальное
+под нагрузкой работает не лучше WSGI. Асинхронные чтения списка и курса
+(async ORM) - после перехода на django >= 4.1.
+"""
+
+from asgiref.sync import sync_to_async
+
+from courses.api.views import SubjectListAPIView, SubjectDetailAPIView, CourseViewSet
+from courses.conditional import acourse_validators, not_modified_response, set_validators
+
+# etag JSON-ответа: у browsable API другой суффикс, его etag здесь просто не совпадёт
+JSON_SUFFIX = '-json'
+
+
+def async_api_view(view):
+    """DRF-представление -> async view (в общем синхронном потоке, см. выше)"""
+    run = sync_to_async(view, thread_sensitive=True)
+
+    async def async_view(request, *args, **kwargs):
+        return await run(request, *args, **kwargs)
+
+    # csrf для сессионной аутентификации проверяет сам DRF
+    async_view.csrf_exempt = True
+    return async_view
+
+
+# initkwargs - как у DefaultRouter (courses/api/urls.py)
+subject_list = async_api_view(SubjectListAPIView.as_view())
+subject_detail = async_api_view(SubjectDetailAPIView.as_view())
+course_list = async_api_view(
+    CourseViewSet.as_view({'get': 'list'}, basename='course', detail=False, suffix='List')
+)
+course_retrieve = async_api_view(
+    CourseViewSet.as_view({'get': 'retrieve'}, basename='course', detail=True, suffix='Instance')
+)
+course_contents = async_api_view(
+    CourseViewSet.as_view({'get': 'courses'}, basename='course', detail=True, **CourseViewSet.courses.kwargs)
+)
+
+
+async def course_detail(request, pk):
+    if request.method in ('GET', 'HEAD') and 'HTTP_IF_NONE_MATCH' in request.META:
+        validators = await acourse_validators(pk, suffix=JSON_SUFFIX)
+        if validators is not None:
+            response = not_modified_response(request, *validators)
+            # 412 (If-Match) и прочее - пусть решает DRF
+            if response is not None and response.status_code == 304:
+                return set_validators(response, *validators)
+    return await course_retrieve(request, pk=pk)
+
+
+course_detail.csrf_exempt = True
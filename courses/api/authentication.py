@@ -0,0 +1,117 @@
+"""
+Аутентификация в API по токену.
+
+BasicAuthentication на каждый запрос считает PBKDF2 от пароля (это сотни
+тысяч итераций sha256), а токен проверяется одним sha256 и поиском по индексу.
+Проверенные токены ещё и держатся в памяти процесса (CACHE_TIMEOUT секунд),
+так что повторные запросы с тем же токеном обходятся без бд.
+Запись в памяти действует, пока не изменилась версия токенов API в общем кэше
+(courses/versions.py): её увеличивают отзыв токена и изменение пользователя,
+поэтому другие воркеры перестают принимать отозванный токен сразу.
+
+Заголовок: Authorization: Token <токен>  (или Bearer <токен>)
+Настройки - settings.API_TOKEN:
+    LIFETIME - время жизни токена в секундах (None - бессрочный)
+    CACHE_TIMEOUT - сколько секунд проверенный токен живёт в памяти процесса
+"""
+
+import copy
+import hashlib
+import secrets
+from datetime import timedelta
+
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from django.conf import settings
+from django.utils import timezone
+
+from common.cache import get_version, is_cached_version
+from common.lru import LRUCache
+from courses.models import APIToken
+from courses.versions import API_TOKENS_VERSION_NAME
+
+_verified_tokens = LRUCache(max_size=10000)
+
+
+def get_token_settings():
+    return {
+        'LIFETIME': None,
+        'CACHE_TIMEOUT': 60,
+        **getattr(settings, 'API_TOKEN', {}),
+    }
+
+
+def hash_token(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_token(user, name='', lifetime=None):
+    """
+        Создаёт токен и возвращает (токен, APIToken).
+        Сам токен нигде не сохраняется - его нужно сразу отдать пользователю
+    """
+    if lifetime is None:
+        lifetime = get_token_settings()['LIFETIME']
+    key = secrets.token_urlsafe(32)
+    token = APIToken.objects.create(
+        user=user,
+        name=name,
+        key_hash=hash_token(key),
+        expires=timezone.now() + timedelta(seconds=lifetime) if lifetime else None
+    )
+    return key, token
+
+
+def revoke_token(token):
+    # post_save меняет версию токенов (courses/signals.py) - запись в памяти воркеров устареет
+    token.revoked = True
+    token.save(update_fields=['revoked'])
+    _verified_tokens.delete(token.key_hash)
+
+
+class HashedTokenAuthentication(BaseAuthentication):
+    keywords = ('token', 'bearer',)
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower().decode() not in self.keywords:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Неверный заголовок Authorization')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Неверный токен')
+        return self.authenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        key_hash = hash_token(key)
+        # версия читается до бд: если токен отзовут после этого, запись в памяти
+        # окажется со старой версией и следующий запрос проверит токен заново
+        version = get_version(API_TOKENS_VERSION_NAME)
+        entry = _verified_tokens.get(key_hash)
+        if entry is None or entry[0] != version:
+            token = APIToken.objects.select_related('user').filter(key_hash=key_hash).first()
+            if token is None or not token.is_active:
+                _verified_tokens.delete(key_hash)
+                raise exceptions.AuthenticationFailed('Неверный токен')
+            if is_cached_version(version):
+                _verified_tokens.set(
+                    key_hash, (version, token),
+                    timeout=get_token_settings()['CACHE_TIMEOUT']
+                )
+        else:
+            token = entry[1]
+            if not token.is_active:  # истёк, пока лежал в памяти
+                _verified_tokens.delete(key_hash)
+                raise exceptions.AuthenticationFailed('Неверный токен')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('Пользователь неактивен')
+        # у каждого запроса свои экземпляры - объекты из памяти общие для потоков
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
+
+    def authenticate_header(self, request):
+        return 'Token'
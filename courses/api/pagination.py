@@ -0,0 +1,24 @@
+"""
+Постраничная выдача по курсору (keyset pagination).
+
+В отличие от ?page=N, база не пропускает OFFSET строк, а сразу находит место
+по индексу: WHERE created < <последний на странице> ORDER BY created DESC LIMIT n,
+поэтому дальние страницы отдаются так же быстро, как первая.
+В ответе next/previous - ссылки с закодированным курсором.
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class CourseCursorPagination(CursorPagination):
+    ordering = '-created'  # Course.created с индексом
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SubjectCursorPagination(CursorPagination):
+    ordering = 'slug'  # уникальный, с индексом
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from courses.enrollment import is_enrolled
+
 
 class IsEnrolledPermission(BasePermission):
 
@@ -7,4 +9,4 @@ class IsEnrolledPermission(BasePermission):
         return bool(request.user and request.user.is_authenticated)
 
     def has_object_permission(self, request, view, obj) -> True | False:
-        return obj.students.filter(pk=request.user.pk).exists()
+        return is_enrolled(request.user, obj)
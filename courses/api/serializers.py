@@ -1,9 +1,27 @@
-from rest_framework.serializers import ModelSerializer
-from rest_framework.relations import HyperlinkedIdentityField, RelatedField
+from collections import defaultdict
+
+from rest_framework.fields import BooleanField, CharField, Field, IntegerField
+from rest_framework.serializers import BaseSerializer, ListSerializer, ModelSerializer
+from rest_framework.relations import HyperlinkedIdentityField, RelatedField, PrimaryKeyRelatedField
 
 from courses.models import (
     Subject, Course, Module, Content,
 )
+from courses.outline import get_outline, render_contents
+
+
+class SparseFieldsetMixin:
+    """
+        Оставляет в сериалайзере только поля из context['fields']
+        (их выбирает SparseFieldsetViewMixin во views по ?fields= и ?expand=)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 # сериалайзер для предметов
@@ -27,7 +45,7 @@ class ModuleSerializer(ModelSerializer):
 
 
 # сериалайзер для курсов (list | detail)
-class CourseSerializer(ModelSerializer):
+class CourseSerializer(SparseFieldsetMixin, ModelSerializer):
     modules = ModuleSerializer(many=True, read_only=True)
 
     # url_to_enroll = HyperlinkedIdentityField(
@@ -78,6 +96,111 @@ class ModuleWithContentSerializer(ModelSerializer):
         ]
 
 
+# модули с контентом в формате ModuleWithContentSerializer, но из снимка курса
+# (courses/outline.py) - без запросов к модулям, контенту и объектам контента
+class OutlineModulesField(Field):
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, course):
+        modules = get_outline(course.pk)['modules']
+        # HTML всех модулей за один проход по кэшу HTML
+        html = {
+            content['id']: content['html']
+            for content in render_contents([content for module in modules for content in module['contents']])
+        }
+        return [
+            {
+                'title': module['title'],
+                'description': module['description'],
+                'order': module['order'],
+                'contents': [
+                    {'id': content['id'], 'order': content['order'], 'item': html[content['id']]}
+                    for content in module['contents']
+                ],
+            }
+            for module in modules
+        ]
+
+
 # сериалайзер с полем где модули с контентом отображаются по другому (подробно)
 class CourseWithContentSerializer(CourseSerializer):
-    modules = ModuleWithContentSerializer(many=True)
+    modules = OutlineModulesField()
+
+
+# поля, у которых to_representation не меняет значение из .values()
+PASSTHROUGH_FIELDS = (BooleanField, CharField, IntegerField, PrimaryKeyRelatedField, )
+
+
+class ValuesSerializer:
+    """
+        Быстрый (только для чтения) вариант ModelSerializer для списков:
+        строит dict'ы прямо из строк .values_list(named=True) - именованных
+        кортежей (как courses/read_models.py), без моделей и без обхода
+        полей DRF для каждого объекта.
+        Поля и их преобразования берутся ("компилируются") один раз
+        из serializer_class, поэтому ответ совпадает с ответом serializer_class.
+        Вложенные many=True сериалайзеры (Course.modules) загружаются
+        одним запросом на весь список.
+    """
+
+    def __init__(self, serializer_class):
+        self.model = serializer_class.Meta.model
+        self.pk = self.model._meta.pk.attname
+        # (имя, колонка в .values(), преобразование или None, вложенный ValuesSerializer)
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            model_field = self.model._meta.get_field(field.source)
+            if isinstance(field, ListSerializer):
+                # обратная FK: колонка - FK на нас у вложенной модели
+                self.fields.append((
+                    name, model_field.field.attname, None, ValuesSerializer(type(field.child))
+                ))
+            elif isinstance(field, BaseSerializer):
+                raise TypeError(f'{name}: поддерживаются только вложенные many=True сериалайзеры')
+            else:
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                self.fields.append((name, model_field.attname, convert, None))
+
+    def get_fields(self, fields=None):
+        return [field for field in self.fields if fields is None or field[0] in fields]
+
+    def values(self, queryset, fields=None, extra=()):
+        """строки queryset (именованные кортежи) с колонками, нужными для fields (и extra)"""
+        columns = dict.fromkeys((self.pk, *extra))
+        columns.update(dict.fromkeys(
+            column for _, column, _, nested in self.get_fields(fields) if nested is None
+        ))
+        return queryset.prefetch_related(None).values_list(*columns, named=True)
+
+    def to_representation(self, rows, fields=None):
+        selected = self.get_fields(fields)
+        related = {}
+        for name, column, _, nested in selected:
+            if nested is not None:
+                children = defaultdict(list)
+                queryset = nested.model._default_manager.filter(
+                    **{f'{column}__in': [getattr(row, self.pk) for row in rows]}
+                )
+                for child in nested.values(queryset, extra=(column,)):
+                    children[getattr(child, column)].append(child)
+                related[name] = children
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert, nested in selected:
+                if nested is not None:
+                    item[name] = nested.to_representation(related[name][getattr(row, self.pk)])
+                    continue
+                value = getattr(row, column)
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+
+course_values_serializer = ValuesSerializer(CourseSerializer)
+subject_values_serializer = ValuesSerializer(SubjectSerializer)
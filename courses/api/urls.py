@@ -2,11 +2,13 @@ from rest_framework import routers
 
 from django.urls import path, include
 
+from courses.api import async_views
 from courses.api.views import (
     SubjectDetailAPIView,
     SubjectListAPIView,
     CourseViewSet,
     CourseEnrollAPIView,
+    TokenAPIView,
 )
 
 app_name = 'api'
@@ -23,6 +25,13 @@ router.register(
 urlpatterns = [
     path('subjects/', SubjectListAPIView.as_view(), name='list_subject'),
     path('subjects/<int:pk>/', SubjectDetailAPIView.as_view(), name='detail_subject'),
+    path('token/', TokenAPIView.as_view(), name='token'),  # выдача (POST) и отзыв (DELETE) токена
     # path('courses/<int:pk>/enroll/', CourseEnrollAPIView.as_view(), name='courses-enroll'),
+    # те же чтения для ASGI (courses/api/async_views.py)
+    path('async/subjects/', async_views.subject_list, name='async_list_subject'),
+    path('async/subjects/<int:pk>/', async_views.subject_detail, name='async_detail_subject'),
+    path('async/courses/', async_views.course_list, name='async_course-list'),
+    path('async/courses/<int:pk>/', async_views.course_detail, name='async_course-detail'),
+    path('async/courses/<int:pk>/contents/', async_views.course_contents, name='async_course-courses'),
     path('', include(router.urls)),  # и здесь мы подключаем на router
 ]
@@ -1,6 +1,8 @@
 from rest_framework.views import APIView
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.authentication import BasicAuthentication
@@ -10,19 +12,84 @@ from rest_framework.generics import (
     get_object_or_404,
 )
 
-from courses.models import Subject, Course
+from django.db.models import prefetch_related_objects
+
+from courses.models import Subject, Course, APIToken
+from courses.enrollment import enroll
+from courses.conditional import course_validators, not_modified_response, set_validators
 from courses.api.permissions import IsEnrolledPermission
+from courses.api.pagination import CourseCursorPagination, SubjectCursorPagination
+from courses.api.authentication import (
+    HashedTokenAuthentication,
+    issue_token,
+    revoke_token,
+)
 from courses.api.serializers import (
     SubjectSerializer,
     CourseSerializer,
     CourseWithContentSerializer,
-
+    course_values_serializer,
+    subject_values_serializer,
 )
 
 
+class SparseFieldsetViewMixin:
+    """
+        Выбор полей ответа:
+            ?fields=id,title - только эти поля
+            ?expand=modules - добавить вложенные поля из expandable_fields.
+        Вложенные поля в списке (list) отдаются только по expand,
+        в остальных действиях - по умолчанию.
+        Выбранные поля (get_selected_fields) нужны и get_queryset -
+        чтобы не подгружать то, что не попадёт в ответ
+    """
+    expandable_fields = ()
+
+    def parse_names(self, param):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    def get_selected_fields(self):
+        if hasattr(self, '_selected_fields'):
+            return self._selected_fields
+        all_fields = set(self.get_serializer_class().Meta.fields)
+        fields = self.parse_names('fields')
+        expand = self.parse_names('expand') or set()
+        unknown = {
+            'fields': sorted((fields or set()) - all_fields),
+            'expand': sorted(expand - set(self.expandable_fields)),
+        }
+        unknown = {param: names for param, names in unknown.items() if names}
+        if unknown:
+            raise ValidationError({
+                param: f'Неизвестные поля: {", ".join(names)}' for param, names in unknown.items()
+            })
+
+        if fields is None:
+            fields = all_fields
+            if self.action == 'list':
+                fields = fields - set(self.expandable_fields)
+        self._selected_fields = fields | expand
+        return self._selected_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_selected_fields()
+        return context
+
+
 class SubjectListAPIView(ListAPIView):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    pagination_class = SubjectCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        # как CourseViewSet.list - строки .values_list() вместо моделей
+        queryset = subject_values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(subject_values_serializer.to_representation(page))
 
 
 class SubjectDetailAPIView(RetrieveAPIView):
@@ -30,16 +97,59 @@ class SubjectDetailAPIView(RetrieveAPIView):
     serializer_class = SubjectSerializer
 
 
-class CourseViewSet(ReadOnlyModelViewSet):
+class CourseViewSet(SparseFieldsetViewMixin, ReadOnlyModelViewSet):
     # доступны методы list, и retrieve (GET запрос)
-    queryset = Course.objects.all().prefetch_related('modules__contents')
+    queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CourseCursorPagination
+    expandable_fields = ('modules',)
+    values_serializer = course_values_serializer  # None - список через serializer_class
+
+    def get_prefetch_lookups(self):
+        if 'modules' not in self.get_selected_fields() or self.action == 'courses':
+            # подробные модули (CourseWithContentSerializer) - из снимка курса, без prefetch
+            return []
+        return ['modules', ]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'list':
+            return qs.prefetch_related(*self.get_prefetch_lookups())
+        # в retrieve модули подгружаются только если не ответили 304
+        return qs
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()  # здесь же проверка прав (IsEnrolledPermission)
+        etag, last_modified = course_validators(
+            instance.pk,
+            suffix=f'-{request.accepted_renderer.format}'
+        )
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            prefetch_related_objects([instance], *self.get_prefetch_lookups())
+            response = Response(self.get_serializer(instance).data)
+        return set_validators(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        # список строится из .values_list(), без моделей (ValuesSerializer)
+        if self.values_serializer is None:
+            return super().list(request, *args, **kwargs)
+        fields = self.get_selected_fields()
+        queryset = self.values_serializer.values(
+            self.filter_queryset(self.get_queryset()),
+            fields,
+            extra=('created',)  # нужен курсору пагинации
+        )
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(
+            self.values_serializer.to_representation(page, fields)
+        )
 
     @action(  # https://www.django-rest-framework.org/community/3.8-announcement/#deprecations
         methods=['post', ],
         detail=True,  # это значит что роутер будет обрабатывать это когда один экземпляр, иначе detail=False
         url_path='new-path-enroll',
-        authentication_classes=[BasicAuthentication, ],
+        authentication_classes=[HashedTokenAuthentication, BasicAuthentication, ],
         permission_classes=[IsAuthenticated, ]
     )
     def enroll(self, request, *args, **kwargs):
@@ -50,19 +160,16 @@ class CourseViewSet(ReadOnlyModelViewSet):
         способ поменять url - url_path='new-path-enroll'
         """
         course = self.get_object()  # как и get_queryset доступен от GenericAPIView
-        user = request.user
-        if user in course.students.all():
-            return Response({'already enrolled': True, })
-        else:
-            course.students.add(user)
+        if enroll(request.user, course):
             return Response({'enrolled': True, })
+        return Response({'already enrolled': True, })
 
     @action(
         methods=['get', ],
         detail=True,
         url_path='contents',
         serializer_class=CourseWithContentSerializer,
-        authentication_classes=[BasicAuthentication, ],
+        authentication_classes=[HashedTokenAuthentication, BasicAuthentication, ],
         permission_classes=[IsEnrolledPermission, ]  # BasicAuthentication
     )
     def courses(self, request, *args, **kwargs):
@@ -74,14 +181,39 @@ class CourseViewSet(ReadOnlyModelViewSet):
 # как и сделано выше
 class CourseEnrollAPIView(APIView):
     http_method_names = ['post', ]
-    authentication_classes = (BasicAuthentication,)
+    authentication_classes = (HashedTokenAuthentication, BasicAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, pk, format=None):
-        user = request.user
         course = get_object_or_404(Course, pk=pk)
-        if user not in course.students.all():
-            course.students.add(user)
+        if enroll(request.user, course):
             return Response({'enrolled': True, })
-        else:
-            return Response({'already enrolled': True, })
+        return Response({'already enrolled': True, })
+
+
+# выдача и отзыв токенов для HashedTokenAuthentication
+# POST (логин и пароль через BasicAuthentication) - новый токен
+# DELETE (с токеном) - отзыв токена, с которым пришёл запрос
+class TokenAPIView(APIView):
+    http_method_names = ['post', 'delete', ]
+    authentication_classes = (HashedTokenAuthentication, BasicAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, format=None):
+        key, token = issue_token(
+            user=request.user,
+            name=request.data.get('name', '')
+        )
+        return Response({
+            'token': key,
+            'expires': token.expires,
+        }, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, format=None):
+        if not isinstance(request.auth, APIToken):
+            return Response(
+                {'detail': 'Запрос должен быть выполнен с токеном'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        revoke_token(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        # подключаем обработчики сигналов
+        from courses import signals  # noqa: F401
+        # настройка соединений с SQLite (PRAGMA, проверка постоянных соединений)
+        from common import db  # noqa: F401
@@ -0,0 +1,103 @@
+"""
+Каталог курсов (страница CourseListView), заранее собранный и лежащий в кэше.
+
+В кэше хранятся уже вычисленные списки (не queryset'ы) строк из courses/read_models.py:
+    catalog:v2:subjects - предметы с количеством курсов (SubjectRow)
+    catalog:v2:subject:<id> - курсы предмета с количеством модулей,
+                              именем автора и названием предмета (CatalogCourseRow)
+Список всех курсов собирается из списков по предметам без запросов в бд.
+
+Списки пересобираются сигналами (courses/signals.py) при изменении
+Subject, Course и Module - и только те, которых изменение касается.
+При промахе (кэш очищен, memcached перезапущен) список собирается из бд
+одним запросом, остальные ждут его результат (common/cache.py, get_or_compute).
+"""
+
+from functools import partial
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from common.cache import get_or_compute, recompute, is_fresh, unwrap
+from common.routers import primary_reads
+
+from courses.models import Subject, Course
+from courses.read_models import SubjectRow, CatalogCourseRow, read
+
+CATALOG_CACHE_TIMEOUT = 600 * 720  # --- 5 суток
+
+# v2 - строки read_models вместо dict'ов
+SUBJECTS_KEY = 'catalog:v2:subjects'
+
+
+def subject_courses_key(subject_id):
+    return f'catalog:v2:subject:{subject_id}'
+
+
+# списки кладутся в кэш надолго - читаем не с реплики (common/routers.py)
+@primary_reads()
+def build_subjects():
+    # Meta.ordering в запросах с GROUP BY не применяется - порядок задаём сами
+    return read(SubjectRow, Subject.objects.annotate(total_courses=Count('courses')).order_by('-title'))
+
+
+@primary_reads()
+def build_subject_courses(subject_id):
+    return read(
+        CatalogCourseRow,
+        Course.objects.filter(
+            subject_id=subject_id
+        ).annotate(
+            total_modules=Count('modules')
+        ).order_by('-created')
+    )
+
+
+def refresh_subjects():
+    return recompute(SUBJECTS_KEY, build_subjects, CATALOG_CACHE_TIMEOUT)
+
+
+def refresh_subject_courses(subject_id):
+    return recompute(
+        subject_courses_key(subject_id),
+        partial(build_subject_courses, subject_id),
+        CATALOG_CACHE_TIMEOUT
+    )
+
+
+def forget_subject_courses(subject_id):
+    cache.delete(subject_courses_key(subject_id))
+
+
+def get_subjects():
+    return get_or_compute(SUBJECTS_KEY, build_subjects, CATALOG_CACHE_TIMEOUT)
+
+
+def get_subject(slug, subjects=None):
+    if subjects is None:
+        subjects = get_subjects()
+    return next((subject for subject in subjects if subject.slug == slug), None)
+
+
+def get_subject_courses(subject_id):
+    return get_or_compute(
+        subject_courses_key(subject_id),
+        partial(build_subject_courses, subject_id),
+        CATALOG_CACHE_TIMEOUT
+    )
+
+
+def get_all_courses(subjects=None):
+    if subjects is None:
+        subjects = get_subjects()
+    keys = {subject_courses_key(subject.id): subject.id for subject in subjects}
+    found = cache.get_many(keys)
+    courses = []
+    for key, subject_id in keys.items():
+        if key in found and is_fresh(found[key]):
+            courses.extend(unwrap(found[key]))
+        else:
+            courses.extend(get_subject_courses(subject_id))
+    # тот же порядок, что у Course.Meta.ordering
+    courses.sort(key=lambda course: course.created, reverse=True)
+    return courses
@@ -0,0 +1,149 @@
+"""
+Условные запросы (If-None-Match / If-Modified-Since -> 304) для страниц и API курса.
+
+Валидаторы считаются без рендеринга и почти без запросов в бд:
+    ETag - версии курса (и других данных страницы) из courses/versions.py,
+           меняются при любом изменении курса, модулей и контента
+    Last-Modified - самое позднее из: updated объектов контента курса,
+           created курса и времени последнего изменения версии курса.
+           Считается один раз на версию курса и лежит в кэше
+acourse_validators - то же для async view (courses/api/async_views.py): только из кэша
+"""
+
+import hashlib
+
+from django.db.models import Max
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.contrib.contenttypes.models import ContentType
+
+from common.cache import get_versions, version_key
+from common.routers import primary_reads
+from courses.models import Course, Content, Text, File, Image, Video
+from courses.versions import course_version_name, course_modified_key
+
+LAST_MODIFIED_TIMEOUT = 60 * 60 * 24
+
+ITEM_MODELS = (Text, File, Image, Video, )
+
+
+def last_modified_key(course_id, version):
+    return f'course_last_modified:{course_id}:{version}'
+
+
+@primary_reads()  # значение кэшируется под версией курса - не с реплики
+def compute_last_modified(course_id):
+    created = Course.objects.filter(pk=course_id).values_list('created', flat=True).first()
+    if created is None:
+        return None
+    dates = [created, cache.get(course_modified_key(course_id))]
+    for model in ITEM_MODELS:
+        dates.append(model.objects.filter(
+            pk__in=Content.objects.filter(
+                module__course_id=course_id,
+                content_type=ContentType.objects.get_for_model(model)
+            ).values('object_id')
+        ).aggregate(Max('updated'))['updated__max'])
+    return max(date for date in dates if date is not None)
+
+
+def course_validators(course_id, versions=(), suffix=''):
+    """
+        (etag, last_modified) для курса.
+        versions - имена других версий, от которых зависит ответ (записи пользователя)
+        suffix - то, чем отличаются ответы по одному url (пользователь, формат)
+    """
+    names = [course_version_name(course_id), *versions]
+    values = get_versions(names)
+    key = last_modified_key(course_id, values[names[0]])
+    last_modified = cache.get(key)
+    if last_modified is None:
+        last_modified = compute_last_modified(course_id)
+        if last_modified is not None:
+            cache.set(key, last_modified, LAST_MODIFIED_TIMEOUT)
+    return format_validators([values[name] for name in names], last_modified, suffix)
+
+
+async def acourse_validators(course_id, suffix=''):
+    """
+        course_validators без бд и без записи в кэш (для event loop).
+        None - версии курса или Last-Modified в кэше ещё нет: их посчитает course_validators
+    """
+    version = await cache.aget(version_key(course_version_name(course_id)))
+    if version is None:
+        return None
+    last_modified = await cache.aget(last_modified_key(course_id, version))
+    if last_modified is None:
+        return None
+    return format_validators([version], last_modified, suffix)
+
+
+def format_validators(versions, last_modified, suffix):
+    etag = '"{}{}"'.format('-'.join(str(version) for version in versions), suffix)
+    # в заголовке точность - секунды
+    return etag, int(last_modified.timestamp()) if last_modified is not None else None
+
+
+def not_modified_response(request, etag, last_modified):
+    """304 (412 для If-Match) или None, если нужно отдавать ответ целиком"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    return response
+
+
+class CourseConditionalMixin:
+    """
+        Для представлений курса: отвечает 304 до рендеринга (и до кэша страниц),
+        если у клиента актуальная версия.
+        get_course_id - id курса из url (None - пусть 404 отдаст само представление)
+        get_conditional_versions - другие версии, от которых зависит страница
+        conditional_csrf - в странице форма с csrf-токеном: etag зависит и от секрета csrf
+            (он меняется при входе - иначе браузер покажет копию со старым токеном и
+            POST формы получит 403), а Last-Modified не отдаётся - смену секрета он не видит
+    """
+    conditional_csrf = False
+
+    def get_course_id(self):
+        if not hasattr(self, '_course_id'):
+            if 'pk' in self.kwargs:
+                lookup = {'pk': self.kwargs['pk']}
+            else:
+                lookup = {'slug': self.kwargs['slug']}
+            self._course_id = Course.objects.filter(**lookup).values_list('pk', flat=True).first()
+        return self._course_id
+
+    def get_conditional_versions(self):
+        return []
+
+    def get_conditional_suffix(self):
+        # в шаблоне есть пользователь (меню) - у каждого своя страница
+        suffix = f'-u{self.request.user.pk or 0}'
+        if self.conditional_csrf:
+            # CSRF_COOKIE кладёт CsrfViewMiddleware; в etag - только хэш секрета
+            secret = self.request.META.get('CSRF_COOKIE', '')
+            suffix += '-c' + hashlib.md5(secret.encode()).hexdigest()[:12]
+        return suffix
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or self.get_course_id() is None:
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = course_validators(
+            self.get_course_id(),
+            versions=self.get_conditional_versions(),
+            suffix=self.get_conditional_suffix()
+        )
+        if self.conditional_csrf:
+            last_modified = None
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
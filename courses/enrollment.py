@@ -0,0 +1,114 @@
+"""
+Запись студентов на курсы.
+
+user in course.students.all() достаёт из бд всех студентов курса,
+поэтому проверка и запись идут напрямую через промежуточную таблицу
+Course.students.through по индексу (course_id, user_id).
+Результат проверки кэшируется для пары (user, course), кэш сбрасывается
+обработчиком m2m_changed (courses/signals.py) при любом изменении course.students
+"""
+
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models.sql import InsertQuery
+from django.db.models.signals import m2m_changed
+
+from common.cache import get_version, is_cached_version
+from common.routers import primary_reads
+from courses.models import Course
+from courses.versions import user_courses_version_name
+
+Enrollment = Course.students.through
+
+ENROLLMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def enrollment_cache_key(user_id, course_id):
+    return f'enrolled:{course_id}:{user_id}'
+
+
+def is_enrolled(user, course) -> bool:
+    if not user.is_authenticated:
+        return False
+    key = enrollment_cache_key(user.pk, course.pk)
+    enrolled = cache.get(key)
+    if enrolled is None:
+        # результат кэшируется на сутки - читаем не с реплики (common/routers.py)
+        with primary_reads():
+            enrolled = Enrollment.objects.filter(
+                course_id=course.pk,
+                user_id=user.pk
+            ).exists()
+        # храним 1/0, т.к. None в кэше не отличить от промаха
+        cache.set(key, int(enrolled), ENROLLMENT_CACHE_TIMEOUT)
+    return bool(enrolled)
+
+
+def user_course_ids_key(user_id, version):
+    return f'user_course_ids:{user_id}:{version}'
+
+
+def user_course_ids(user):
+    """id курсов, на которые записан пользователь (в кэше под версией его записей)"""
+    version = get_version(user_courses_version_name(user.pk))
+    key = user_course_ids_key(user.pk, version)
+    course_ids = cache.get(key)
+    if course_ids is None:
+        with primary_reads():
+            course_ids = list(Enrollment.objects.filter(user_id=user.pk).values_list('course_id', flat=True))
+        if is_cached_version(version):
+            cache.set(key, course_ids, ENROLLMENT_CACHE_TIMEOUT)
+    return course_ids
+
+
+def enroll(user, course) -> bool:
+    """
+        Записывает пользователя на курс.
+        Возвращает True, если пользователь был записан сейчас,
+        и False, если он уже был записан раньше.
+        Решает сам INSERT с ignore_conflicts (INSERT OR IGNORE / ON CONFLICT DO NOTHING):
+        одна запись в бд, и параллельная запись того же пользователя не падает
+        на unique constraint, а просто не вставит строку - тогда post_add не посылается
+    """
+    key = enrollment_cache_key(user.pk, course.pk)
+    if cache.get(key) == 1:  # точно записан - в бд не ходим
+        return False
+    using = router.db_for_write(Course, instance=course)
+    signal_kwargs = {
+        'sender': Enrollment,
+        'instance': course,
+        'reverse': False,
+        'model': user.__class__,
+        'pk_set': {user.pk, },
+        'using': using,
+    }
+    # сигналы шлём сами, как это делает course.students.add()
+    m2m_changed.send(action='pre_add', **signal_kwargs)
+    inserted = insert_enrollment(course.pk, user.pk, using)
+    if inserted:
+        m2m_changed.send(action='post_add', **signal_kwargs)
+    cache.set(key, 1, ENROLLMENT_CACHE_TIMEOUT)
+    return inserted
+
+
+def insert_enrollment(course_id, user_id, using):
+    """
+        INSERT ... ON CONFLICT DO NOTHING одной строки. True - строка вставлена
+        (bulk_create(ignore_conflicts=True) не говорит, была ли она вставлена)
+    """
+    query = InsertQuery(Enrollment, ignore_conflicts=True)
+    query.insert_values(
+        [Enrollment._meta.get_field('course'), Enrollment._meta.get_field('user')],
+        [Enrollment(course_id=course_id, user_id=user_id)]
+    )
+    with transaction.mark_for_rollback_on_error(using), connections[using].cursor() as cursor:
+        for sql, params in query.get_compiler(using).as_sql():
+            cursor.execute(sql, params)
+        return cursor.rowcount > 0
+
+
+def forget_enrollments(pairs):
+    """pairs - [(user_id, course_id), ...]"""
+    cache.delete_many([
+        enrollment_cache_key(user_id, course_id) for user_id, course_id in pairs
+    ])
@@ -1,5 +1,11 @@
-from django.db.models import PositiveIntegerField
-from django.core.exceptions import ObjectDoesNotExist
+from django.apps import apps
+from django.db.models import Case, F, Max, PositiveIntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.sql import UpdateQuery
+from django.db import IntegrityError, connections, router, transaction
+
+# сколько счётчиков поднимать одним UPDATE (ограничение на кол-во параметров в SQL у sqlite)
+COUNTER_BATCH_SIZE = 300
 
 
 class OrderField(PositiveIntegerField):
@@ -22,20 +28,187 @@ class OrderField(PositiveIntegerField):
         """
         # если пользователь не задал поле order (OrderField)
         if getattr(model_instance, self.attname) is None:
-            qs = self.model.objects.all()  # достаём все объекты модели
-            if self.for_fields:
-                parent_model = {  # подготавливаем параметры, которые будем использовать для фильтра
-                    field: getattr(model_instance, field) for field in self.for_fields
-                }
-                # если родительская модель, то достаём экземпляры которые привязаны только к ней
-                qs = qs.filter(**parent_model)
-            try:
-                # если не было родительской модели, используем qs для всех объектов
-                instance = qs.latest(self.attname)
-                value = getattr(instance, self.attname) + 1
-            except ObjectDoesNotExist:
-                value = 0
+            value = self.reserve(model_instance)
             setattr(model_instance, self.attname, value)
             return value
         else:
+            # order задан явно (админка, create(order=...)) - счётчик здесь не трогаем:
+            # reserve сам берёт не меньше MAX(order) + 1, а массовые вставки
+            # поднимают счётчики один раз на пачку (raise_counter_values)
             return super(OrderField, self).pre_save(model_instance, add)
+
+    def get_scope(self, model_instance):
+        """
+            Ключ счётчика - модель, поле и значения for_fields,
+            например 'courses.content.order:module_id=5'
+            (берём attname - id, чтобы не доставать родительский объект из бд)
+        """
+        return self.scope_from_values({
+            field.attname: getattr(model_instance, field.attname) for field in self.parent_fields
+        })
+
+    @property
+    def parent_fields(self):
+        return [self.model._meta.get_field(name) for name in self.for_fields or ()]
+
+    def scope_from_values(self, values):
+        """get_scope по значениям {attname родителя: значение}"""
+        scope = f'{self.model._meta.label_lower}.{self.attname}'
+        if self.for_fields:
+            parents = ','.join(f'{field.attname}={values[field.attname]}' for field in self.parent_fields)
+            scope = f'{scope}:{parents}'
+        return scope
+
+    def get_next_from_table(self, model_instance, using):
+        """
+            Следующий номер по данным самой таблицы - нужен только один раз,
+            когда счётчика для родителя ещё нет (старые данные)
+        """
+        qs = self.model._default_manager.using(using)  # достаём все объекты модели
+        if self.for_fields:
+            parent_model = {  # подготавливаем параметры, которые будем использовать для фильтра
+                field: getattr(model_instance, field) for field in self.for_fields
+            }
+            # если родительская модель, то достаём экземпляры которые привязаны только к ней
+            qs = qs.filter(**parent_model)
+        last = qs.order_by(f'-{self.attname}').values_list(self.attname, flat=True).first()
+        return 0 if last is None else last + 1
+
+    def next_from_table_expression(self, model_instance):
+        """get_next_from_table подзапросом - внутри UPDATE счётчика"""
+        qs = self.model._default_manager.all()
+        if self.for_fields:
+            qs = qs.filter(**{field: getattr(model_instance, field) for field in self.for_fields})
+        last = qs.order_by(f'-{self.attname}').values(self.attname)[:1]
+        return Coalesce(Subquery(last) + 1, Value(0))
+
+    def reserve(self, model_instance, count=1):
+        """
+            Атомарно резервирует count номеров подряд для родителя model_instance
+            и возвращает первый из них.
+
+            Номера выдаются из строки-счётчика OrderCounter:
+            UPDATE ... SET value = value + count захватывает блокировку на запись
+            (строки в postgres, всей бд в sqlite), поэтому параллельные вставки
+            в один и тот же модуль/курс не получат одинаковые order.
+            Счётчик не меньше MAX(order) + 1 - номера, заданные в обход него
+            (явный order, bulk_reorder), не повторятся.
+            Обычно это один запрос (update_counter), ещё два - при создании счётчика.
+        """
+        OrderCounter = apps.get_model('courses', 'OrderCounter')
+        scope = self.get_scope(model_instance)
+        using = router.db_for_write(self.model, instance=model_instance)
+        counters = OrderCounter.objects.using(using).filter(scope=scope)
+        next_value = Greatest(F('value'), self.next_from_table_expression(model_instance)) + count
+        value = self.update_counter(counters, next_value)
+        if value is None:
+            try:
+                with transaction.atomic(using=using):
+                    value = self.get_next_from_table(model_instance, using) + count
+                    OrderCounter.objects.using(using).create(scope=scope, value=value)
+            except IntegrityError:
+                # счётчик успел создать параллельный запрос
+                value = self.update_counter(counters, next_value)
+        return value - count
+
+    @staticmethod
+    def update_counter(counters, value):
+        """
+            UPDATE счётчика и его новое значение (None - счётчика ещё нет).
+            Где есть UPDATE ... RETURNING (postgres, sqlite >= 3.35) - один запрос,
+            иначе UPDATE и SELECT в одной транзакции
+        """
+        connection = connections[counters.db]
+        if connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert:
+            query = counters.query.chain(UpdateQuery)
+            query.add_update_values({'value': value})
+            statement, params = query.get_compiler(counters.db).as_sql()
+            with connection.cursor() as cursor:
+                cursor.execute(f'{statement} RETURNING {connection.ops.quote_name("value")}', params)
+                row = cursor.fetchone()
+            return None if row is None else row[0]
+        with transaction.atomic(using=counters.db):
+            if not counters.update(value=value):
+                return None
+            return counters.values_list('value', flat=True).get()
+
+    def counter_values(self, objs):
+        """{scope: MAX(order) + 1} по объектам с заданным order"""
+        values = {}
+        for obj in objs:
+            value = getattr(obj, self.attname)
+            if value is not None:
+                scope = self.get_scope(obj)
+                values[scope] = max(values.get(scope, 0), value + 1)
+        return values
+
+    def raise_counter_values(self, values, using, create=False):
+        """
+            Поднимает счётчики {scope: value} до value (если они меньше) -
+            один UPDATE на COUNTER_BATCH_SIZE родителей, а не запрос на строку.
+            create - заодно создать недостающие счётчики (новые родители после bulk_create)
+        """
+        OrderCounter = apps.get_model('courses', 'OrderCounter')
+        items = list(values.items())
+        for start in range(0, len(items), COUNTER_BATCH_SIZE):
+            batch = items[start:start + COUNTER_BATCH_SIZE]
+            counters = OrderCounter.objects.using(using)
+            if create:
+                counters.bulk_create(
+                    [OrderCounter(scope=scope, value=value) for scope, value in batch],
+                    ignore_conflicts=True
+                )
+            counters.filter(scope__in=[scope for scope, _ in batch]).update(value=Greatest(
+                F('value'),
+                Case(
+                    *[When(scope=scope, then=Value(value)) for scope, value in batch],
+                    output_field=PositiveIntegerField()
+                )
+            ))
+
+    def raise_counters(self, queryset):
+        """после изменения order в обход счётчика (bulk_reorder): счётчики родителей queryset"""
+        parents = [field.attname for field in self.parent_fields]
+        if parents:
+            rows = queryset.order_by().values(*parents).annotate(last=Max(self.attname))
+        else:
+            rows = [queryset.aggregate(last=Max(self.attname))]
+        self.raise_counter_values(
+            {self.scope_from_values(row): row['last'] + 1 for row in rows if row['last'] is not None},
+            queryset.db
+        )
+
+    def assign_orders(self, objs):
+        """
+            Проставляет order всем объектам без него,
+            по одному резервированию на каждого родителя (для bulk_create)
+        """
+        groups = {}
+        for obj in objs:
+            if getattr(obj, self.attname) is None:
+                groups.setdefault(self.get_scope(obj), []).append(obj)
+        for group in groups.values():
+            value = self.reserve(group[0], count=len(group))
+            for obj in group:
+                setattr(obj, self.attname, value)
+                value += 1
+        return objs
+
+
+def bulk_create_ordered(model, objs, **kwargs):
+    """
+        bulk_create, при котором все OrderField заполняются заранее
+        непрерывными номерами, а не отдельным запросом на каждую строку
+    """
+    objs = list(objs)
+    order_fields = [field for field in model._meta.concrete_fields if isinstance(field, OrderField)]
+    # order, заданные явно, - счётчики поднимем после вставки, по одному UPDATE на пачку
+    explicit = {field: field.counter_values(objs) for field in order_fields}
+    for field in order_fields:
+        field.assign_orders(objs)
+    created = model._default_manager.bulk_create(objs, **kwargs)
+    using = router.db_for_write(model)
+    for field, values in explicit.items():
+        if values:
+            field.raise_counter_values(values, using)
+    return created
@@ -0,0 +1,54 @@
+import base64
+
+from django.test import Client
+from django.urls import reverse
+from django.contrib.auth import authenticate
+from django.core.management.base import BaseCommand, CommandError
+
+from common.bench import measure, format_row
+from courses.models import Course
+from courses.api.authentication import issue_token, revoke_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает requests/sec для /api/courses/<pk>/contents/ '
+        'с BasicAuthentication и с токеном (HashedTokenAuthentication)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, required=True, help='pk курса')
+        parser.add_argument('--username', required=True, help='студент, записанный на курс')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = authenticate(username=options['username'], password=options['password'])
+        if user is None:
+            raise CommandError('Неверный логин или пароль')
+        course = Course.objects.filter(pk=options['course']).first()
+        if course is None:
+            raise CommandError('Курс не найден')
+
+        url = reverse('api:course-courses', kwargs={'pk': course.pk})
+        client = Client(HTTP_HOST='localhost')
+        basic = base64.b64encode(
+            f'{options["username"]}:{options["password"]}'.encode()
+        ).decode()
+        key, token = issue_token(user, name='bench_api_auth')
+        try:
+            for name, header in (
+                    ('BasicAuthentication', f'Basic {basic}'),
+                    ('HashedTokenAuthentication', f'Token {key}'),
+            ):
+                response = client.get(url, HTTP_AUTHORIZATION=header)
+                if response.status_code != 200:
+                    raise CommandError(f'{name}: {url} вернул {response.status_code}')
+                stats = measure(
+                    lambda: client.get(url, HTTP_AUTHORIZATION=header),
+                    repeat=options['requests']
+                )
+                self.stdout.write(format_row(name, stats))
+        finally:
+            revoke_token(token)
+            token.delete()
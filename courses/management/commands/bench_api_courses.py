@@ -0,0 +1,53 @@
+from rest_framework.renderers import JSONRenderer
+
+from django.test import Client
+from django.urls import reverse
+from django.core.management.base import BaseCommand, CommandError
+
+from common.bench import measure, format_row
+from courses.api.views import CourseViewSet
+from courses.api.renderers import FastJSONRenderer
+from courses.api.serializers import course_values_serializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает /api/courses/ с JSONRenderer + CourseSerializer (как было) '
+        'и FastJSONRenderer + ValuesSerializer: requests/sec, bytes/sec и задержки'
+    )
+
+    modes = (
+        ('JSONRenderer + serializer', JSONRenderer, None),
+        ('FastJSONRenderer + values', FastJSONRenderer, course_values_serializer),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--expand', default='modules', help='пустая строка - без модулей')
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        url = reverse('api:course-list')
+        params = {'page_size': options['page_size']}
+        if options['expand']:
+            params['expand'] = options['expand']
+        client = Client(HTTP_HOST='localhost')
+
+        renderer_classes = CourseViewSet.renderer_classes
+        values_serializer = CourseViewSet.values_serializer
+        try:
+            for name, renderer_class, serializer in self.modes:
+                CourseViewSet.renderer_classes = [renderer_class, ]
+                CourseViewSet.values_serializer = serializer
+                response = client.get(url, params)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} вернул {response.status_code}')
+                stats = measure(lambda: client.get(url, params), repeat=options['requests'])
+                size = len(response.content)
+                self.stdout.write(
+                    f'{format_row(name, stats)}  '
+                    f'{size} B/resp  {round(size * stats["rps"] / 1024 / 1024, 2)} MB/s'
+                )
+        finally:
+            CourseViewSet.renderer_classes = renderer_classes
+            CourseViewSet.values_serializer = values_serializer
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+import importlib.util
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from common.bench import summarize, format_row
+from courses.models import Course
+
+# сервер -> (приложение uvicorn, префикс url API)
+SERVERS = {
+    'wsgi': (['education.wsgi:application', '--interface', 'wsgi'], '/api/'),
+    'asgi': (['education.asgi:application', '--interface', 'asgi3'], '/api/async/'),
+}
+STARTUP_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает чтение API под uvicorn: WSGI (education/wsgi.py, /api/...) и '
+        'ASGI (education/asgi.py, /api/async/...) - requests/sec и задержки '
+        'при разном числе одновременных соединений. /api/async/ - обёртка над теми же '
+        'синхронными представлениями (courses/api/async_views.py), асинхронен только 304 '
+        'по If-None-Match, поэтому на обычных GET ждите примерно одинаковых цифр. '
+        'Нужен uvicorn (pip install uvicorn); с --wsgi-url/--asgi-url - уже запущенные серверы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', action='append', default=[],
+            help='url относительно префикса API, можно несколько (по умолчанию subjects/, courses/, courses/<id>/)'
+        )
+        parser.add_argument('--concurrency', default='1,8,32,64', help='числа соединений через запятую')
+        parser.add_argument('--requests', type=int, default=500, help='запросов на каждый замер')
+        parser.add_argument('--workers', type=int, default=1, help='процессов uvicorn')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--wsgi-url', help='не запускать WSGI сервер, а мерить этот')
+        parser.add_argument('--asgi-url', help='не запускать ASGI сервер, а мерить этот')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(value) for value in options['concurrency'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('--concurrency: числа через запятую')
+        paths = options['path'] or self.default_paths()
+        results = {}
+        for offset, (name, (app, prefix)) in enumerate(SERVERS.items()):
+            base_url = options[f'{name}_url']
+            server = None
+            if base_url is None:
+                port = options['port'] + offset
+                server = self.start_server(app, port, options['workers'])
+                base_url = f'http://127.0.0.1:{port}/'
+            try:
+                for path in paths:
+                    url = urljoin(base_url, prefix.lstrip('/') + path)
+                    for concurrency in levels:
+                        stats = self.run(url, concurrency, options['requests'], options['timeout'])
+                        results[name, path, concurrency] = stats
+                        self.stdout.write(f'{format_row(f"{name} {path} c={concurrency}", stats)}  '
+                                          f'errors {stats["errors"]}')
+            finally:
+                if server is not None:
+                    self.stop_server(server)
+
+        self.stdout.write('\nasgi / wsgi, requests/sec:')
+        for path in paths:
+            for concurrency in levels:
+                wsgi, asgi = results['wsgi', path, concurrency], results['asgi', path, concurrency]
+                ratio = asgi['rps'] / wsgi['rps'] if wsgi['rps'] else 0.0
+                self.stdout.write(
+                    f'  {path:<30} c={concurrency:<4} {wsgi["rps"]:>9} -> {asgi["rps"]:>9} req/s  x{ratio:.2f}  '
+                    f'p95 {wsgi["p95_ms"]} -> {asgi["p95_ms"]} ms'
+                )
+
+    def default_paths(self):
+        paths = ['subjects/', 'courses/']
+        course_id = Course.objects.values_list('pk', flat=True).first()
+        if course_id is not None:
+            paths.append(f'courses/{course_id}/')
+        return paths
+
+    def start_server(self, app, port, workers):
+        if importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('нужен uvicorn: pip install uvicorn (или --wsgi-url и --asgi-url)')
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'education.settings'),
+            'DEBUG_TOOLBAR': '0',
+        }
+        server = subprocess.Popen(
+            [
+                sys.executable, '-m', 'uvicorn', *app,
+                '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning', '--no-access-log',
+            ],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'uvicorn {app[0]} завершился с кодом {server.returncode}')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    return server
+            except OSError:
+                time.sleep(0.2)
+        self.stop_server(server)
+        raise CommandError(f'uvicorn {app[0]} не запустился за {STARTUP_TIMEOUT} s')
+
+    def stop_server(self, server):
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    def run(self, url, concurrency, total, timeout):
+        """total запросов к url из concurrency потоков (у каждого своё соединение)"""
+        local = threading.local()
+        lock = threading.Lock()
+        latencies, errors = [], 0
+
+        def send(_):
+            nonlocal errors
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                failed = local.session.get(url, timeout=timeout).status_code != 200
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += failed
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(send, range(concurrency)))  # соединения и прогрев
+            latencies.clear()
+            errors = 0
+            started = time.perf_counter()
+            list(executor.map(send, range(total)))
+            elapsed = time.perf_counter() - started
+        return summarize(latencies, elapsed, errors=errors)
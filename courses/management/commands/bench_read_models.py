@@ -0,0 +1,64 @@
+import gc
+import time
+import pickle
+import tracemalloc
+
+from django.db.models import Count
+from django.core.management.base import BaseCommand, CommandError
+
+from common.bench import measure, format_row
+from courses.models import Course
+from courses.read_models import CatalogCourseRow, read
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает список курсов каталога из моделей (select_related), dict\'ов .values() '
+        'и строк read_models: время построения, память списка, размер и чтение из кэша (pickle). '
+        'Каталог на 50k курсов: python manage.py generate_catalog --courses 50000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='сколько курсов (по умолчанию все)')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        queryset = Course.objects.annotate(total_modules=Count('modules')).order_by('-created')
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        total = queryset.count()
+        if not total:
+            raise CommandError('курсов нет: python manage.py generate_catalog --courses 50000')
+        self.stdout.write(f'{total} courses')
+
+        modes = (
+            ('models + select_related', lambda: list(queryset.select_related('owner', 'subject'))),
+            ('values() dicts', lambda: list(queryset.values(*CatalogCourseRow.columns))),
+            ('read model rows', lambda: read(CatalogCourseRow, queryset)),
+        )
+        for name, build in modes:
+            stats = measure(build, repeat=options['repeat'], warmup=1)
+            size = self.memory(build)
+            data = pickle.dumps(build(), pickle.HIGHEST_PROTOCOL)
+            started = time.perf_counter()
+            pickle.loads(data)
+            loads = time.perf_counter() - started
+            self.stdout.write(
+                f'{format_row(name, stats)}  '
+                f'memory {size / 1024 / 1024:>7.1f} MB  pickle {len(data) / 1024 / 1024:>7.1f} MB  '
+                f'unpickle {loads * 1000:>8.1f} ms'
+            )
+
+    def memory(self, build):
+        """сколько памяти занимает построенный список (без временных объектов)"""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            result = build()
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        del result
+        return size
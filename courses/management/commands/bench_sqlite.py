@@ -0,0 +1,124 @@
+import os
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+
+from django.core.management.base import BaseCommand
+
+from common.bench import summarize
+from common.db import SQLITE_PRAGMAS, apply_pragmas
+
+
+class Command(BaseCommand):
+    help = (
+        'Параллельные чтения и записи (запись на курс, перестановка) в SQLite: '
+        'настройки по умолчанию против PRAGMA из common/db.py'
+    )
+
+    modes = (
+        ('default (rollback journal)', {}),
+        ('tuned (common.db.SQLITE_PRAGMAS)', SQLITE_PRAGMAS),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        for name, pragmas in self.modes:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.prepare(path, options['rows'])
+                reads, writes = self.run(path, pragmas, options)
+            self.stdout.write(name)
+            for kind, stats in (('reads', reads), ('writes', writes)):
+                self.stdout.write(
+                    f'    {kind:<7} {stats["requests"]:>7} ok  {stats["errors"]:>5} locked  '
+                    f'{stats["rps"]:>9} /s  p50 {stats["p50_ms"]:>8} ms  p95 {stats["p95_ms"]:>8} ms'
+                )
+
+    def connect(self, path, pragmas):
+        # как в django: timeout по умолчанию 5 с, транзакции вручную
+        db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_pragmas(db.cursor(), pragmas)
+        return db
+
+    def prepare(self, path, rows):
+        db = sqlite3.connect(path, isolation_level=None)
+        db.execute(
+            'CREATE TABLE enrollment (id INTEGER PRIMARY KEY, course INTEGER, '
+            'user INTEGER, "order" INTEGER, UNIQUE (course, user))'
+        )
+        db.execute('BEGIN')
+        db.executemany(
+            'INSERT INTO enrollment (course, user, "order") VALUES (?, ?, ?)',
+            ((number % 100, number, number) for number in range(rows))
+        )
+        db.execute('COMMIT')
+        db.close()
+
+    def run(self, path, pragmas, options):
+        stop = time.monotonic() + options['seconds']
+        results = {'reads': ([], [0]), 'writes': ([], [0])}
+        lock = threading.Lock()
+
+        def worker(kind, operation):
+            db = self.connect(path, pragmas)
+            latencies, errors = [], 0
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                try:
+                    operation(db)
+                except sqlite3.OperationalError:  # database is locked
+                    errors += 1
+                    if db.in_transaction:
+                        db.execute('ROLLBACK')
+                    continue
+                latencies.append(time.perf_counter() - started)
+            db.close()
+            with lock:
+                results[kind][0].extend(latencies)
+                results[kind][1][0] += errors
+
+        def read(db):
+            db.execute(
+                'SELECT COUNT(*), MAX("order") FROM enrollment WHERE course = ?',
+                (random.randrange(100),)
+            ).fetchone()
+
+        def write(db):
+            course = random.randrange(100)
+            db.execute('BEGIN')
+            # запись на курс
+            db.execute(
+                'INSERT OR IGNORE INTO enrollment (course, user, "order") VALUES (?, ?, 0)',
+                (course, random.randrange(10 ** 9))
+            )
+            # перестановка: несколько строк одного курса
+            db.execute(
+                'UPDATE enrollment SET "order" = "order" + 1 WHERE course = ? AND id % 50 = 0',
+                (course,)
+            )
+            db.execute('COMMIT')
+
+        threads = [
+            threading.Thread(target=worker, args=('reads', read))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('writes', write))
+            for _ in range(options['writers'])
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        total = time.monotonic() - started
+        return tuple(
+            summarize(latencies, total, errors=errors[0])
+            for latencies, errors in (results['reads'], results['writes'])
+        )
@@ -0,0 +1,256 @@
+import time
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections, transaction
+from django.db.models import Max
+from django.core.management.color import no_style
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+
+from courses import catalog
+from courses.enrollment import Enrollment
+from courses.models import Subject, Course, Module, Content, Text, File, Image, Video
+
+ITEM_MODELS = (Text, File, Image, Video, )
+
+WORDS = (
+    'python django модуль курс задание данные функция класс объект запрос '
+    'шаблон модель список словарь строка число цикл условие тест кэш'
+).split()
+
+WORKER_BUSY_TIMEOUT = 10 * 60 * 1000  # мс
+
+User = get_user_model()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choices(WORDS, k=words))
+
+
+class Plan:
+    """
+        Размеры каталога и первые id каждой таблицы.
+        id назначаются заранее (база + номер), поэтому части каталога можно
+        генерировать независимо - в любом порядке и в разных процессах,
+        а результат при одном seed и той же исходной базе всегда одинаковый
+    """
+
+    def __init__(self, options, owner_ids, subject_ids):
+        self.seed = options['seed']
+        self.prefix = options['prefix']
+        self.courses = options['courses']
+        self.modules = options['modules']
+        self.contents = options['contents']
+        self.batch_size = options['batch_size']
+        self.owner_ids = owner_ids
+        self.subject_ids = subject_ids
+        self.content_types = [ContentType.objects.get_for_model(model).pk for model in ITEM_MODELS]
+        self.first_ids = {
+            model: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            for model in (Course, Module, Content, *ITEM_MODELS)
+        }
+
+    @property
+    def courses_per_chunk(self):
+        # примерно batch_size строк Content на часть - память не зависит от размера каталога
+        return max(1, self.batch_size // max(1, self.modules * self.contents))
+
+    def chunks(self):
+        step = self.courses_per_chunk
+        return [(start, min(start + step, self.courses)) for start in range(0, self.courses, step)]
+
+
+def generate_chunk(plan, start, stop):
+    """курсы с номерами [start, stop) со всеми модулями, контентом и объектами контента"""
+    rng = random.Random(f'{plan.seed}:courses:{start}')
+    courses, modules, contents = [], [], []
+    items = {model: [] for model in ITEM_MODELS}
+    for number in range(start, stop):
+        course_id = plan.first_ids[Course] + number
+        courses.append(Course(
+            id=course_id,
+            owner_id=rng.choice(plan.owner_ids),
+            subject_id=rng.choice(plan.subject_ids),
+            title=f'{plan.prefix} {sentence(rng, 3)} {course_id}',
+            slug=f'{plan.prefix}-course-{course_id}',
+            description=sentence(rng, 40),
+        ))
+        for module_order in range(plan.modules):
+            module_number = number * plan.modules + module_order
+            module_id = plan.first_ids[Module] + module_number
+            modules.append(Module(
+                id=module_id, course_id=course_id, order=module_order,
+                title=sentence(rng, 3), description=sentence(rng, 15),
+            ))
+            for content_order in range(plan.contents):
+                content_number = module_number * plan.contents + content_order
+                # типы по кругу: номер объекта своего типа = номер контента // 4
+                type_index = content_number % len(ITEM_MODELS)
+                model = ITEM_MODELS[type_index]
+                item_id = plan.first_ids[model] + content_number // len(ITEM_MODELS)
+                items[model].append(make_item(rng, model, item_id, courses[-1].owner_id))
+                contents.append(Content(
+                    id=plan.first_ids[Content] + content_number, module_id=module_id,
+                    content_type_id=plan.content_types[type_index], object_id=item_id,
+                    order=content_order,
+                ))
+    with transaction.atomic():
+        Course.objects.bulk_create(courses, batch_size=plan.batch_size)
+        Module.objects.bulk_create(modules, batch_size=plan.batch_size)
+        for model, objs in items.items():
+            model.objects.bulk_create(objs, batch_size=plan.batch_size)
+        Content.objects.bulk_create(contents, batch_size=plan.batch_size)
+        # order заданы явно - счётчики OrderField курсов и модулей этой части
+        # создаём сразу, одним запросом на пачку родителей (courses/fields.py)
+        for model, objs in ((Module, modules), (Content, contents)):
+            field = model._meta.get_field('order')
+            field.raise_counter_values(field.counter_values(objs), 'default', create=True)
+    return len(courses), len(modules), len(contents)
+
+
+def make_item(rng, model, item_id, owner_id):
+    params = {'id': item_id, 'owner_id': owner_id, 'title': sentence(rng, 4)}
+    if model is Text:
+        params['content'] = sentence(rng, 60)
+    elif model is Video:
+        params['url'] = f'https://www.youtube.com/watch?v=gen{item_id}'
+    else:
+        params['file'] = f'{model._meta.model_name}s/gen-{item_id}.txt'
+    return model(**params)
+
+
+def generate_chunk_in_worker(plan, start, stop):
+    connection = connections['default']
+    if connection.vendor == 'sqlite':
+        # писатель в SQLite один, остальные процессы ждут своей очереди
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA busy_timeout = {WORKER_BUSY_TIMEOUT}')
+    try:
+        return generate_chunk(plan, start, stop)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует большой каталог для нагрузочных тестов: предметы, курсы, модули, '
+        'контент всех типов и записи студентов. bulk_create частями (память ограничена), '
+        'одинаковый результат при одном --seed, --workers - параллельно в процессах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subjects', type=int, default=10)
+        parser.add_argument('--courses', type=int, default=1000, help='всего курсов')
+        parser.add_argument('--modules', type=int, default=10, help='модулей в курсе')
+        parser.add_argument('--contents', type=int, default=10, help='объектов контента в модуле')
+        parser.add_argument('--owners', type=int, default=20)
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--enrollments', type=int, default=5, help='курсов у каждого студента')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='gen', help='начало имён, slug и логинов')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='процессов для курсов; SQLite пишет по одному, выигрыш - в генерации объектов'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['courses'] and (options['subjects'] < 1 or options['owners'] < 1):
+            raise CommandError('для курсов нужен хотя бы один предмет и один автор')
+        started = time.monotonic()
+        password = make_password('password')
+
+        with transaction.atomic():
+            first_subject = (Subject.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            Subject.objects.bulk_create([
+                Subject(
+                    id=first_subject + number,
+                    title=f'{options["prefix"]} subject {first_subject + number}',
+                    slug=f'{options["prefix"]}-subject-{first_subject + number}',
+                )
+                for number in range(options['subjects'])
+            ])
+            subject_ids = list(range(first_subject, first_subject + options['subjects']))
+            owner_ids = self.create_users('owner', options['owners'], password, options)
+            student_ids = self.create_users('student', options['students'], password, options)
+
+        plan = Plan(options, owner_ids, subject_ids)
+        chunks = plan.chunks()
+        totals = [0, 0, 0]
+        if options['workers'] > 1:
+            # дочерние процессы не должны унаследовать открытые соединения;
+            # fork - процессы получают уже настроенный django
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context) as executor:
+                futures = [executor.submit(generate_chunk_in_worker, plan, *chunk) for chunk in chunks]
+                for done, future in enumerate(futures, 1):
+                    self.add_totals(totals, future.result(), done, len(chunks), started)
+        else:
+            for done, chunk in enumerate(chunks, 1):
+                self.add_totals(totals, generate_chunk(plan, *chunk), done, len(chunks), started)
+
+        first_course = plan.first_ids[Course]
+        enrollments = self.enroll(
+            student_ids, list(range(first_course, first_course + options['courses'])), options
+        )
+        self.reset_sequences()
+        # сигналы при bulk_create не срабатывают - каталог в кэше пересобираем сами
+        catalog.refresh_subjects()
+
+        elapsed = time.monotonic() - started
+        rows = sum(totals) + totals[2] + enrollments  # у каждого контента ещё объект
+        self.stdout.write(
+            f'subjects {len(subject_ids)}, courses {totals[0]}, modules {totals[1]}, '
+            f'contents {totals[2]}, enrollments {enrollments}: '
+            f'{elapsed:.1f} s, {rows / max(elapsed, 0.001):.0f} rows/s'
+        )
+
+    def add_totals(self, totals, counts, done, total, started):
+        for index, count in enumerate(counts):
+            totals[index] += count
+        if self.verbosity > 1 or done == total or done % 10 == 0:
+            self.stdout.write(f'  {done}/{total} parts, {totals[2]} contents, {time.monotonic() - started:.1f} s')
+
+    def create_users(self, role, count, password, options):
+        first = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        User.objects.bulk_create(
+            [
+                User(id=first + number, username=f'{options["prefix"]}-{role}-{first + number}', password=password)
+                for number in range(count)
+            ],
+            batch_size=options['batch_size']
+        )
+        return list(range(first, first + count))
+
+    def enroll(self, student_ids, course_ids, options):
+        per_student = min(options['enrollments'], len(course_ids))
+        if not per_student:
+            return 0
+        total = 0
+        step = max(1, options['batch_size'] // per_student)
+        for start in range(0, len(student_ids), step):
+            rng = random.Random(f'{options["seed"]}:enrollments:{start}')
+            rows = [
+                Enrollment(user_id=student_id, course_id=course_id)
+                for student_id in student_ids[start:start + step]
+                for course_id in rng.sample(course_ids, per_student)
+            ]
+            Enrollment.objects.bulk_create(rows, batch_size=options['batch_size'])
+            total += len(rows)
+        return total
+
+    def reset_sequences(self):
+        # id задавались явно - в PostgreSQL и др. последовательности нужно сдвинуть
+        connection = connections['default']
+        models = [Subject, User, Course, Module, Content, *ITEM_MODELS]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,249 @@
+import json
+import time
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from django.conf import settings
+from django.urls import resolve, Resolver404
+from django.shortcuts import resolve_url
+from django.core.management.base import BaseCommand, CommandError
+
+from common.bench import summarize, format_row
+from common.replay import ROLES, EXCLUDED_URL_NAMES, parse_line
+
+TOTAL = '__all__'
+
+
+class Client:
+    """сессии одного потока: по одной на роль, логин при первом запросе роли"""
+
+    def __init__(self, base_url, credentials, timeout):
+        self.base_url = base_url
+        self.credentials = credentials
+        self.timeout = timeout
+        self.sessions = {}
+
+    def get_session(self, role):
+        if role not in self.sessions:
+            session = requests.Session()
+            if role in self.credentials:
+                self.login(session, *self.credentials[role])
+            self.sessions[role] = session
+        return self.sessions[role]
+
+    def login(self, session, username, password):
+        url = urljoin(self.base_url, resolve_url(settings.LOGIN_URL))
+        session.get(url, timeout=self.timeout)
+        response = session.post(url, data={
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': session.cookies.get('csrftoken', ''),
+        }, headers={'Referer': url}, allow_redirects=False, timeout=self.timeout)
+        if response.status_code != 302:
+            raise CommandError(f'не удалось войти как {username}: {response.status_code}')
+
+    def send(self, line):
+        session = self.get_session(line['role'])
+        url = urljoin(self.base_url, line['path'])
+        if line['query']:
+            url = f'{url}?{line["query"]}'
+        kwargs = {'timeout': self.timeout, 'allow_redirects': False}
+        if line['auth'] == 'header' and line['role'] in self.credentials:
+            # в API запрос пришёл с токеном - на replay Basic тем же пользователем
+            kwargs['auth'] = self.credentials[line['role']]
+        if line.get('body') is not None:
+            if line.get('content_type') == 'application/json':
+                kwargs['json'] = line['body']
+            else:
+                kwargs['data'] = line['body']
+        if line['method'] not in ('GET', 'HEAD', 'OPTIONS'):
+            kwargs['headers'] = {'X-CSRFToken': session.cookies.get('csrftoken', ''), 'Referer': url}
+        return session.request(line['method'], url, **kwargs)
+
+
+class Command(BaseCommand):
+    help = (
+        'Проигрывает записанные запросы (common/replay.py) на запущенном сервере: '
+        'p50/p95/p99, requests/sec и ошибки (ответ другого класса, чем при записи; 4xx отдельно) '
+        'по именам url; '
+        '--save сохраняет результат, --compare сравнивает с прошлым прогоном'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--input', default=str(settings.BASE_DIR / 'log' / 'requests.jsonl'),
+            help='файл записи (строки JSON); строки в другом формате пропускаются'
+        )
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--limit', type=int, default=None, help='сколько строк проиграть')
+        parser.add_argument('--repeat', type=int, default=1, help='сколько раз проиграть файл')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--user', action='append', default=[], metavar='ROLE=USERNAME:PASSWORD',
+            help=f'под кем проигрывать запросы роли ({", ".join(ROLES[1:])}); без него - анонимно'
+        )
+        parser.add_argument('--save', help='сохранить результат в JSON')
+        parser.add_argument('--compare', help='результат прошлого прогона (JSON) для сравнения')
+        parser.add_argument('--against', help='сравнить --compare с этим файлом, не проигрывая запросы')
+        parser.add_argument(
+            '--threshold', type=float, default=10,
+            help='рост p95 больше чем на столько процентов - регрессия'
+        )
+
+    def handle(self, *args, **options):
+        if options['against']:
+            if not options['compare']:
+                raise CommandError('--against сравнивает с файлом из --compare')
+            results = self.load(options['against'])
+        else:
+            lines, skipped = self.read_lines(options['input'], options['limit'])
+            if not lines:
+                raise CommandError(f'в {options["input"]} нет записанных запросов')
+            if skipped:
+                self.stdout.write(f'skipped {skipped} lines (invalid or login/logout)')
+            results = self.replay(lines * options['repeat'], options)
+            self.report(results)
+            if options['save']:
+                with open(options['save'], 'w', encoding='utf-8') as file:
+                    json.dump(results, file, indent=2, ensure_ascii=False)
+        if options['compare']:
+            self.compare(self.load(options['compare']), results, options['threshold'])
+
+    def read_lines(self, path, limit):
+        lines, skipped = [], 0
+        try:
+            file = open(path, encoding='utf-8')
+        except OSError as error:
+            raise CommandError(error)
+        with file:
+            for text in file:
+                line = parse_line(text)
+                if line is None:
+                    skipped += 1
+                    continue
+                if not line.get('url_name'):
+                    line['url_name'] = self.get_url_name(line['path'])
+                if line['url_name'] in EXCLUDED_URL_NAMES:
+                    skipped += 1
+                    continue
+                lines.append(line)
+                if limit is not None and len(lines) >= limit:
+                    break
+        return lines, skipped
+
+    def get_url_name(self, path):
+        try:
+            return resolve(path).view_name
+        except Resolver404:
+            return 'unresolved'
+
+    def get_credentials(self, users):
+        credentials = {}
+        for value in users:
+            role, _, user = value.partition('=')
+            username, _, password = user.partition(':')
+            if role not in ROLES or not username:
+                raise CommandError(f'--user {value}: нужно ROLE=USERNAME:PASSWORD, ROLE из {ROLES}')
+            credentials[role] = (username, password)
+        return credentials
+
+    def replay(self, lines, options):
+        credentials = self.get_credentials(options['user'])
+        local = threading.local()
+        lock = threading.Lock()
+        latencies, errors, client_errors = {}, {}, {}
+
+        def run(line):
+            if not hasattr(local, 'client'):
+                local.client = Client(options['base_url'], credentials, options['timeout'])
+            local.client.get_session(line['role'])  # логин не входит во время запроса
+            started = time.perf_counter()
+            try:
+                status = local.client.send(line).status_code
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - started
+            failed = is_failed(status, line.get('status'))
+            with lock:
+                latencies.setdefault(line['url_name'], []).append(elapsed)
+                errors[line['url_name']] = errors.get(line['url_name'], 0) + failed
+                if failed and status is not None and 400 <= status < 500:
+                    client_errors[line['url_name']] = client_errors.get(line['url_name'], 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            # list - чтобы исключения (например, неудачный логин) не потерялись
+            list(executor.map(run, lines))
+        total = time.perf_counter() - started
+
+        results = {
+            name: dict(summarize(values, total, errors=errors[name]), client_errors=client_errors.get(name, 0))
+            for name, values in sorted(latencies.items())
+        }
+        results[TOTAL] = dict(
+            summarize(
+                [value for values in latencies.values() for value in values], total, errors=sum(errors.values())
+            ),
+            client_errors=sum(client_errors.values()),
+        )
+        return results
+
+    def report(self, results):
+        for name, stats in results.items():
+            self.stdout.write(
+                f'{format_row(name, stats)}  errors {error_rate(stats):>6.2f}% '
+                f'(4xx {stats.get("client_errors", 0)})'
+            )
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'{path}: {error}')
+
+    def compare(self, base, current, threshold):
+        regressions = []
+        for name, stats in current.items():
+            if name not in base:
+                continue
+            before = base[name]
+            growth = (stats['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+            errors_growth = error_rate(stats) - error_rate(before)
+            line = (
+                f'{name:<45} p95 {before["p95_ms"]:>8} -> {stats["p95_ms"]:>8} ms ({growth:+6.1f}%)  '
+                f'errors {error_rate(before):.2f}% -> {error_rate(stats):.2f}%'
+            )
+            if growth > threshold or errors_growth > 0:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f'{line}  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'регрессии: {", ".join(regressions)}')
+
+
+def status_class(status):
+    # 304 - тот же ответ, что и 200, только из кэша клиента
+    return 2 if status == 304 else status // 100
+
+
+def is_failed(status, recorded=None):
+    """
+        status - ответ при проигрывании (None - запрос не удался), recorded - записанный.
+        Ошибка - другой класс ответа, чем при записи (403 без csrf или роли, 404 на id,
+        которых нет в локальной бд); без записанного - любой ответ >= 400
+    """
+    if status is None:
+        return True
+    if isinstance(recorded, int):
+        return status_class(status) != status_class(recorded)
+    return status >= 400
+
+
+def error_rate(stats):
+    return stats['errors'] / stats['requests'] * 100 if stats['requests'] else 0.0
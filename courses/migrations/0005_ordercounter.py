@@ -0,0 +1,25 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0004_course_students'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=255, unique=True, verbose_name='Модель и родитель')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='Следующий номер')),
+            ],
+            options={
+                'verbose_name': 'Счётчик порядка',
+                'verbose_name_plural': 'Счётчики порядка',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.6 on 2026-10-18 11:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('courses', '0005_ordercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_hash', models.CharField(max_length=64, unique=True, verbose_name='sha256 токена')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Название')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('expires', models.DateTimeField(blank=True, null=True, verbose_name='Действует до')),
+                ('revoked', models.BooleanField(default=False, verbose_name='Отозван')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'API токен',
+                'verbose_name_plural': 'API токены',
+            },
+        ),
+    ]
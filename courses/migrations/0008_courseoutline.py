@@ -0,0 +1,27 @@
+# Generated by Django 4.0.6 on 2026-10-18 12:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseOutline',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='outline', serialize=False, to='courses.course', verbose_name='Курс')),
+                ('version', models.BigIntegerField(verbose_name='Версия курса')),
+                ('document', models.JSONField(verbose_name='Документ')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлён')),
+            ],
+            options={
+                'verbose_name': 'Снимок курса',
+                'verbose_name_plural': 'Снимки курсов',
+            },
+        ),
+    ]
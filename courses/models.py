@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth import get_user_model
 from django.template.loader import render_to_string
@@ -7,6 +8,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 
 from courses.fields import OrderField
 from courses.utils import from_cyrilic_to_eng
+from courses.render_cache import get_render_cache
 
 User = get_user_model()
 
@@ -45,6 +47,7 @@ class Course(models.Model):
         to=User,
         on_delete=models.CASCADE,
         related_name='courses_created',
+        db_index=False,  # есть course_owner_created_idx
         verbose_name='Владелец курса'
     )
     subject = models.ForeignKey(
@@ -88,6 +91,10 @@ class Course(models.Model):
         verbose_name = 'Курс'
         verbose_name_plural = 'Курсы'
         ordering = ('-created',)
+        indexes = [
+            # курсы автора (ManageCourseListView) в порядке Meta.ordering
+            models.Index(fields=['owner', '-created'], name='course_owner_created_idx'),
+        ]
 
 
 class Module(models.Model):
@@ -95,6 +102,7 @@ class Module(models.Model):
         to='Course',
         on_delete=models.CASCADE,
         related_name='modules',
+        db_index=False,  # есть module_course_order_idx
         verbose_name='Курс'
     )
     title = models.CharField(
@@ -117,6 +125,10 @@ class Module(models.Model):
         ordering = ('order',)
         verbose_name = 'Модуль'
         verbose_name_plural = 'Модули'
+        indexes = [
+            # модули курса всегда выбираются по курсу и сортируются по order
+            models.Index(fields=['course', 'order'], name='module_course_order_idx'),
+        ]
 
 
 # мы здесь сделали обощённую связь, чтобы соединить объекты типа Content
@@ -126,11 +138,13 @@ class Content(models.Model):
         to='Module',
         on_delete=models.CASCADE,
         related_name='contents',
+        db_index=False,  # есть content_module_order_idx
         verbose_name='Модуль'
     )
     content_type = models.ForeignKey(  # Внешний ключ на ContentType (будет в бд)
         to=ContentType,
         on_delete=models.CASCADE,
+        db_index=False,  # есть content_item_idx
         limit_choices_to={
             # ограничиваем модели, к которым может быть привязан content_type
             # (это ограничение скорее всего на уровне django, не db)
@@ -153,12 +167,19 @@ class Content(models.Model):
     )
 
     def __str__(self):
-        return f'{self.order}. {self.content_type.name}'
+        # get_for_id - из кэша ContentType, а не запрос на каждый объект (N+1 в списках и админке)
+        return f'{self.order}. {ContentType.objects.get_for_id(self.content_type_id).name}'
 
     class Meta:
         ordering = ('order',)
         verbose_name = 'Контент'
         verbose_name_plural = 'Контенты'
+        indexes = [
+            # контент модуля всегда выбирается по модулю и сортируется по order
+            models.Index(fields=['module', 'order'], name='content_module_order_idx'),
+            # обратный поиск по GenericForeignKey (в каких модулях объект)
+            models.Index(fields=['content_type', 'object_id'], name='content_item_idx'),
+        ]
 
 
 class BaseItem(models.Model):
@@ -186,6 +207,10 @@ class BaseItem(models.Model):
         abstract = True
 
     def render(self):
+        # HTML берётся из кэша (courses/render_cache.py), рендерится только при промахе
+        return get_render_cache().render(self)
+
+    def render_html(self):
         return render_to_string(
             template_name=f'students/content/{self._meta.model_name}.html',
             context={
@@ -216,3 +241,98 @@ class File(BaseItem):
 
 class Video(BaseItem):
     url = models.URLField(verbose_name='абсолютный URL видео')
+
+
+# денормализованный снимок курса (courses/outline.py): модули по порядку,
+# контент с готовым HTML объектов. Копия того, что лежит в кэше - переживает его очистку
+class CourseOutline(models.Model):
+    course = models.OneToOneField(
+        to='Course',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='outline',
+        verbose_name='Курс'
+    )
+    version = models.BigIntegerField(
+        verbose_name='Версия курса'
+    )
+    document = models.JSONField(
+        verbose_name='Документ'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Обновлён'
+    )
+
+    def __str__(self):
+        return f'{self.course_id}: {self.version}'
+
+    class Meta:
+        verbose_name = 'Снимок курса'
+        verbose_name_plural = 'Снимки курсов'
+
+
+# счётчик для OrderField - следующий свободный номер для каждого родителя
+# (модуля для Content, курса для Module), см. OrderField.reserve
+class OrderCounter(models.Model):
+    scope = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Модель и родитель'
+    )
+    value = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Следующий номер'
+    )
+
+    def __str__(self):
+        return f'{self.scope}: {self.value}'
+
+    class Meta:
+        verbose_name = 'Счётчик порядка'
+        verbose_name_plural = 'Счётчики порядка'
+
+
+# токен для REST API (courses/api/authentication.py)
+# в бд хранится только sha256 от токена, сам токен показывается один раз при выдаче
+class APIToken(models.Model):
+    user = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        related_name='api_tokens',
+        verbose_name='Пользователь'
+    )
+    key_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='sha256 токена'
+    )
+    name = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name='Название'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создан'
+    )
+    expires = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Действует до'
+    )
+    revoked = models.BooleanField(
+        default=False,
+        verbose_name='Отозван'
+    )
+
+    def __str__(self):
+        return f'{self.user} {self.name or self.key_hash[:8]}'
+
+    @property
+    def is_active(self):
+        return not self.revoked and (self.expires is None or self.expires > timezone.now())
+
+    class Meta:
+        verbose_name = 'API токен'
+        verbose_name_plural = 'API токены'
@@ -0,0 +1,151 @@
+"""
+Снимок курса (outline) - денормализованный документ для страниц и API с контентом курса.
+
+Вместо курс -> модули -> контент -> Text|Image|File|Video (4+ таблицы на каждый
+запрос) StudentCourseDetailView и CourseWithContentSerializer читают один документ:
+    {'version': <версия курса>, 'modules': [
+        {'id', 'title', 'description', 'order', 'version': <версия модуля>,
+         'contents': [{'id', 'order', 'type', 'object_id', 'title', 'model', 'updated'}, ...]},
+    ]}
+HTML объектов в документ не входит: render_contents берёт его из кэша HTML
+(courses/render_cache.py) по model, object_id и updated, поэтому
+ITEM_RENDER_CACHE['ENABLED'] = False и сброс кэша HTML действуют и здесь.
+Документ лежит в кэше и в таблице CourseOutline:
+если кэш вытеснил большой документ, а версии остались - один запрос в бд.
+После полной очистки кэша версии новые, и снимок пересобирается (один раз на курс:
+пересобирает один запрос, остальные ждут его под блокировкой get_or_compute).
+
+Актуальность проверяется по версиям (courses/versions.py): если версия курса
+изменилась, список модулей читается заново, а контент пересобирается только
+у модулей, версия которых изменилась (контент, его порядок, объекты контента).
+Пересобирает снимок первое чтение после изменения, а не сигналы: в autocommit
+on_commit выполнялся бы внутри каждого save() пишущего запроса (формы модулей,
+массовое создание контента) и держал бы блокировку бд на запись дольше.
+"""
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+
+from common.cache import get_or_compute, get_version, get_versions, is_cached_version
+from common.routers import primary_reads
+from courses.models import Module, Content, CourseOutline
+from courses.render_cache import get_render_cache
+from courses.versions import course_version_name, module_version_name
+
+OUTLINE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def outline_key(course_id, version):
+    return f'course_outline:{course_id}:{version}'
+
+
+def get_outline(course_id):
+    version = get_version(course_version_name(course_id))
+    if not is_cached_version(version):
+        # кэш недоступен - версиям верить нельзя: собираем из бд целиком и не сохраняем
+        with primary_reads():
+            return build_outline(course_id, version)
+    # после изменения курса снимок пересобирает и записывает в бд один запрос
+    # (блокировка get_or_compute на курс и версию), остальные ждут его результат
+    return get_or_compute(
+        outline_key(course_id, version), lambda: load_outline(course_id, version), OUTLINE_TIMEOUT
+    )
+
+
+def load_outline(course_id, version):
+    """снимок из бд, а если там старая версия - пересобранный и сохранённый"""
+    # снимок ляжет в кэш и в бд под версией - читаем не с реплики (common/routers.py)
+    with primary_reads():
+        row = CourseOutline.objects.filter(course_id=course_id).values_list('version', 'document').first()
+        document = None
+        if row is not None:
+            document = {'version': row[0], 'modules': row[1]['modules']}
+        if document is None or document['version'] != version:
+            document = build_outline(course_id, version, document)
+            save_outline(course_id, document, created=row is None)
+    return document
+
+
+def build_outline(course_id, version, previous=None):
+    """документ с версией version; контент неизменившихся модулей берётся из previous"""
+    modules = list(Module.objects.filter(course_id=course_id).values('id', 'title', 'description', 'order'))
+    versions = get_versions(module_version_name(module['id']) for module in modules)
+    previous = {module['id']: module for module in (previous or {}).get('modules', ())}
+    stale = []
+    for module in modules:
+        module['version'] = versions[module_version_name(module['id'])]
+        old = previous.get(module['id'])
+        if old is not None and old['version'] == module['version'] and is_cached_version(module['version']):
+            module['contents'] = old['contents']
+        else:
+            stale.append(module)
+    if stale:
+        contents = build_contents([module['id'] for module in stale])
+        for module in stale:
+            module['contents'] = contents.get(module['id'], [])
+    return {'version': version, 'modules': modules}
+
+
+def build_contents(module_ids):
+    """{id модуля: [контент по порядку]} - запрос на Content и по одному на каждый тип item"""
+    render_cache = get_render_cache()
+    contents = {}
+    queryset = Content.objects.filter(module_id__in=module_ids).order_by('module_id', 'order').prefetch_related('item')
+    for content in queryset:
+        item = content.item  # None - объект контента удалён, а Content остался
+        if item is not None and render_cache.enabled:
+            render_cache.render(item)  # объекты уже загружены - заодно прогреваем кэш HTML
+        contents.setdefault(content.module_id, []).append({
+            'id': content.pk,
+            'order': content.order,
+            'type': ContentType.objects.get_for_id(content.content_type_id).model,
+            'object_id': content.object_id,
+            'title': item.title if item is not None else None,
+            'model': item._meta.label_lower if item is not None else None,
+            'updated': item.updated.timestamp() if item is not None and item.updated else None,
+        })
+    return contents
+
+
+def render_contents(contents):
+    """
+        Контент из снимка с готовым HTML ('html') - из кэша HTML без запросов к бд,
+        объекты загружаются (запрос на тип) только для промахов
+    """
+    render_cache = get_render_cache()
+    html = {}
+    missing = {}
+    for content in contents:
+        if content['model'] is None:
+            continue
+        if render_cache.enabled:
+            key = render_cache.key_for(content['model'], content['object_id'], content['updated'])
+            html[content['id']] = render_cache.get_key(key)
+        if html.get(content['id']) is None:
+            missing.setdefault(content['model'], {})[content['object_id']] = content['id']
+    for label, content_ids in missing.items():
+        for item in apps.get_model(label)._default_manager.filter(pk__in=content_ids):
+            html[content_ids[item.pk]] = render_cache.render(item)
+    return [{**content, 'html': html.get(content['id'])} for content in contents]
+
+
+def save_outline(course_id, document, created=False):
+    """created - строки снимка ещё не было (сразу insert, без лишнего update)"""
+    # using - мимо роутера: запись снимка - не запись пользователя,
+    # закреплять его за основной базой (common/routers.py) не нужно
+    outlines = CourseOutline.objects.using(DEFAULT_DB_ALIAS)
+    if not created:
+        # более новый снимок (пересобранный другим запросом) не перезаписываем
+        outlines.filter(
+            course_id=course_id, version__lt=document['version']
+        ).update(version=document['version'], document={'modules': document['modules']}, updated=timezone.now())
+        return
+    try:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            outlines.create(
+                course_id=course_id, version=document['version'], document={'modules': document['modules']}
+            )
+    except IntegrityError:
+        pass  # снимок успел сохранить другой запрос
@@ -0,0 +1,39 @@
+from django.db.models import Prefetch, prefetch_related_objects
+
+from courses.models import Content
+
+
+def contents_prefetch(lookup='contents'):
+    """
+        Prefetch для Content вместе с объектами item (GenericForeignKey).
+        item у Content - обобщённая связь, и без prefetch каждый content.item
+        это отдельный SQL запрос (N+1). prefetch_related('item') группирует
+        Content по content_type_id и достаёт Text|Image|File|Video
+        одним запросом на каждый тип, а потом раскладывает их по экземплярам Content.
+
+        lookup - путь до contents от той модели, с которой работаем:
+            Module.objects.prefetch_related(contents_prefetch())
+            Course.objects.prefetch_related(contents_prefetch('modules__contents'))
+    """
+    return Prefetch(
+        lookup,
+        queryset=Content.objects.prefetch_related('item')
+    )
+
+
+def module_contents(module):
+    """
+        Ленивый queryset контента модуля вместе с item.
+        Запросы выполнятся только когда по нему начнут итерироваться
+        (важно для шаблонов, где контент обёрнут в {% cache %})
+    """
+    return module.contents.all().prefetch_related('item')
+
+
+def prefetch_contents(instances, lookup='contents'):
+    """
+        Тоже самое, что contents_prefetch, но для уже загруженных
+        экземпляров (модулей или курсов)
+    """
+    prefetch_related_objects(list(instances), contents_prefetch(lookup))
+    return instances
@@ -0,0 +1,71 @@
+"""
+Лёгкие модели для чтения (read models) - строки списков без экземпляров моделей django.
+
+Строка - NamedTuple (кортеж с __slots__ = ()): только нужные странице колонки,
+без __dict__ и _state модели, без description и без строки User целиком.
+Строится из .values_list() - на строку не создаётся ни модель, ни dict.
+В кэше (каталог, courses/catalog.py) кортеж и меньше dict'а: pickle хранит
+класс один раз, а у строки - только значения, без имён полей.
+
+columns - выражения для .values_list() в порядке полей (с __ и аннотациями).
+В шаблонах поля доступны как атрибуты, как у моделей.
+"""
+
+from datetime import datetime
+from functools import partial
+from typing import NamedTuple, Optional
+
+
+def read(row_class, queryset):
+    """строки queryset как row_class"""
+    # tuple.__new__ вместо row_class._make - без вызова python-функции на строку
+    return list(map(partial(tuple.__new__, row_class), queryset.values_list(*row_class.columns)))
+
+
+class SubjectRow(NamedTuple):
+    id: int
+    title: str
+    slug: str
+    total_courses: int
+
+    columns = ('id', 'title', 'slug', 'total_courses', )
+
+    def __str__(self):
+        return self.title
+
+
+class CatalogCourseRow(NamedTuple):
+    """курс в каталоге (CourseListView)"""
+    id: int
+    title: str
+    slug: str
+    created: datetime
+    total_modules: int
+    owner_username: str
+    subject_id: int
+    subject_title: str
+    subject_slug: str
+
+    columns = (
+        'id', 'title', 'slug', 'created', 'total_modules', 'owner__username',
+        'subject_id', 'subject__title', 'subject__slug',
+    )
+
+    def __str__(self):
+        return self.title
+
+
+class ManageCourseRow(NamedTuple):
+    """курс в списке автора (ManageCourseListView)"""
+    id: int
+    title: str
+    first_module_id: Optional[int]
+
+    columns = ('id', 'title', 'first_module_id', )
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.title
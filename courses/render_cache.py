@@ -0,0 +1,139 @@
+"""
+Кэш готового HTML для BaseItem.render()
+
+Ключ - (модель, pk, updated), поэтому после изменения объекта старый HTML
+просто перестаёт находиться (auto_now обновляет updated при каждом save)
+и со временем вытесняется из кэша.
+
+Бэкенды опрашиваются по порядку (быстрые в начале), при промахе в первом
+и попадании во втором - HTML дописывается в первый.
+Настраивается через settings.ITEM_RENDER_CACHE:
+    ENABLED - можно выключить кэш целиком (например, для отладки шаблонов)
+    BACKENDS - список бэкендов {'BACKEND': <путь к классу>, 'OPTIONS': {...}}
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from common.lru import LRUCache
+
+
+class LRUBackend:
+    """HTML в памяти процесса"""
+
+    def __init__(self, max_size=1024, timeout=None):
+        self._cache = LRUCache(max_size=max_size, timeout=timeout)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class DjangoCacheBackend:
+    """HTML в кэше из settings.CACHES (общий для всех воркеров)"""
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        # в общем кэше лежат не только наши ключи - чистить его целиком нельзя
+        pass
+
+
+class ItemRenderCache:
+    key_prefix = 'item_html'
+
+    def __init__(self, backends=(), enabled=True):
+        self.backends = list(backends)
+        self.enabled = enabled
+
+    def make_key(self, item):
+        return self.key_for(item._meta.label_lower, item.pk, item.updated.timestamp() if item.updated else None)
+
+    def key_for(self, label, pk, updated):
+        """ключ без самого объекта - по модели, pk и updated.timestamp() (снимок курса)"""
+        return f'{self.key_prefix}:{label}:{pk}:{"" if updated is None else updated}'
+
+    def get(self, item):
+        return self.get_key(self.make_key(item))
+
+    def get_key(self, key):
+        for index, backend in enumerate(self.backends):
+            html = backend.get(key)
+            if html is not None:
+                for faster_backend in self.backends[:index]:
+                    faster_backend.set(key, html)
+                return html
+        return None
+
+    def set(self, item, html):
+        key = self.make_key(item)
+        for backend in self.backends:
+            backend.set(key, html)
+
+    def render(self, item):
+        if not self.enabled or item.pk is None:
+            return item.render_html()
+        html = self.get(item)
+        if html is None:
+            html = self.warm(item)
+        return html
+
+    def warm(self, item):
+        html = item.render_html()
+        if self.enabled:
+            self.set(item, html)
+        return html
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+
+def create_render_cache():
+    config = getattr(settings, 'ITEM_RENDER_CACHE', {})
+    backends = [
+        import_string(backend['BACKEND'])(**backend.get('OPTIONS', {}))
+        for backend in config.get('BACKENDS', ())
+    ]
+    return ItemRenderCache(
+        backends=backends,
+        enabled=config.get('ENABLED', True)
+    )
+
+
+_render_cache = None
+
+
+def get_render_cache():
+    global _render_cache
+    if _render_cache is None:
+        _render_cache = create_render_cache()
+    return _render_cache
+
+
+def reset_render_cache(*, setting, **kwargs):
+    global _render_cache
+    if setting in ('ITEM_RENDER_CACHE', 'CACHES'):
+        _render_cache = None
+
+
+setting_changed.connect(reset_render_cache)
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models import Case, When, Value, PositiveIntegerField
+
+from courses.fields import OrderField
+
+# сколько строк обновлять одним UPDATE (ограничение на кол-во параметров в SQL у sqlite)
+REORDER_BATCH_SIZE = 300
+
+
+def parse_orders(data):
+    """
+        {"<pk>": <order>, ...} из json тела запроса -> {pk: order}
+        ValueError если данные не в таком формате
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Ожидается объект вида {"<pk>": <order>}')
+    orders = {}
+    for pk, order in data.items():
+        pk, order = int(pk), int(order)
+        if order < 0:
+            raise ValueError('order не может быть отрицательным')
+        orders[pk] = order
+    return orders
+
+
+def bulk_reorder(queryset, orders, field='order'):
+    """
+        Меняет порядок сразу у всех объектов одним UPDATE ... SET order = CASE ... END
+        queryset - объекты, которые пользователь имеет право менять
+                   (например Module.objects.filter(course__owner=user)),
+                   проверка владельца попадает в WHERE того же UPDATE,
+                   поэтому чужие pk просто не обновятся
+        orders - {pk: order}
+        возвращает кол-во обновлённых строк
+        Счётчик OrderField (courses/fields.py) поднимается выше новых номеров
+    """
+    items = list(orders.items())
+    order_field = queryset.model._meta.get_field(field)
+    updated = 0
+    with transaction.atomic(using=queryset.db):
+        for start in range(0, len(items), REORDER_BATCH_SIZE):
+            batch = items[start:start + REORDER_BATCH_SIZE]
+            rows = queryset.filter(pk__in=[pk for pk, _ in batch])
+            batch_updated = rows.update(**{
+                field: Case(
+                    *[When(pk=pk, then=Value(order)) for pk, order in batch],
+                    output_field=PositiveIntegerField()
+                )
+            })
+            if batch_updated and isinstance(order_field, OrderField):
+                order_field.raise_counters(rows)
+            updated += batch_updated
+    return updated
@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.dispatch import receiver
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+
+from courses import catalog
+from courses.models import BaseItem, Subject, Course, Module, Content, APIToken
+from courses.enrollment import Enrollment, forget_enrollments
+from courses.render_cache import get_render_cache
+from courses.versions import (
+    module_and_course_ids_for_item,
+    bump_course_versions,
+    bump_module_versions,
+    bump_user_courses_versions,
+    bump_api_tokens_version,
+)
+
+
+@receiver(post_save)
+def warm_item_render_cache(sender, instance, raw=False, **kwargs):
+    # BaseItem абстрактная модель, поэтому sender указать нельзя
+    # и фильтруем по наследникам (Text, Image, File, Video)
+    if raw or not issubclass(sender, BaseItem):
+        return
+    get_render_cache().warm(instance)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    bump_course_versions([instance.pk])
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, instance, **kwargs):
+    bump_course_versions([instance.course_id])
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+def content_changed(sender, instance, **kwargs):
+    bump_module_versions([instance.module_id])
+    course_id = Module.objects.filter(
+        pk=instance.module_id
+    ).values_list('course_id', flat=True).first()
+    if course_id is not None:
+        bump_course_versions([course_id])
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def item_changed(sender, instance, raw=False, **kwargs):
+    if raw or not issubclass(sender, BaseItem):
+        return
+    ids = module_and_course_ids_for_item(instance)
+    bump_module_versions(module_id for module_id, _ in ids)
+    bump_course_versions(course_id for _, course_id in ids)
+
+
+@receiver(post_save, sender=Subject)
+def subject_changed(sender, instance, created, raw=False, **kwargs):
+    # название предмета есть на страницах его курсов
+    if raw or created:
+        return
+    bump_course_versions(Course.objects.filter(subject=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=get_user_model())
+def owner_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # имя автора есть на страницах его курсов
+    if raw or created or (update_fields is not None and 'username' not in update_fields):
+        return
+    bump_course_versions(instance.courses_created.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def invalidate_enrollment_cache(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """
+        Сбрасывает кэш is_enrolled при изменении course.students
+        (или user.courses_joined, тогда reverse=True и instance - пользователь)
+        и увеличивает версии списков курсов у затронутых пользователей
+    """
+    field = 'user_id' if reverse else 'course_id'
+    if action == 'pre_clear':
+        # после clear() уже не узнать кого удалили, поэтому запоминаем заранее
+        instance._cleared_enrollments = list(
+            Enrollment.objects.using(using).filter(
+                **{field: instance.pk}
+            ).values_list('user_id', 'course_id')
+        )
+        return
+    if action == 'post_clear':
+        pairs = getattr(instance, '_cleared_enrollments', ())
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            pairs = [(instance.pk, course_id) for course_id in pk_set]
+        else:
+            pairs = [(user_id, instance.pk) for user_id in pk_set]
+    else:
+        return
+    forget_enrollments(pairs)
+    bump_user_courses_versions(user_id for user_id, _ in pairs)
+
+
+# ------------------------------- каталог (courses/catalog.py)
+# пересобираем после коммита, чтобы в кэш не попали данные откатившейся транзакции
+
+@receiver(post_save, sender=Subject)
+def subject_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(catalog.refresh_subjects)
+    # название и slug предмета есть в каждой строке курсов предмета
+    transaction.on_commit(lambda: catalog.refresh_subject_courses(instance.pk))
+
+
+@receiver(post_delete, sender=Subject)
+def subject_deleted(sender, instance, **kwargs):
+    transaction.on_commit(catalog.refresh_subjects)
+    transaction.on_commit(lambda: catalog.forget_subject_courses(instance.pk))
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_subject(sender, instance, raw=False, **kwargs):
+    # если курс перенесли в другой предмет, пересобрать нужно и старый предмет
+    if raw or instance.pk is None:
+        return
+    instance._catalog_old_subject_id = Course.objects.filter(
+        pk=instance.pk
+    ).values_list('subject_id', flat=True).first()
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_catalog_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    subject_ids = {instance.subject_id, getattr(instance, '_catalog_old_subject_id', None)}
+    subject_ids.discard(None)
+    transaction.on_commit(catalog.refresh_subjects)
+    for subject_id in subject_ids:
+        transaction.on_commit(lambda subject_id=subject_id: catalog.refresh_subject_courses(subject_id))
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_catalog_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    subject_id = Course.objects.filter(
+        pk=instance.course_id
+    ).values_list('subject_id', flat=True).first()
+    if subject_id is not None:
+        transaction.on_commit(lambda: catalog.refresh_subject_courses(subject_id))
+
+
+@receiver(post_save, sender=get_user_model())
+def owner_catalog_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # в каталоге есть имя автора курса
+    if raw or created or (update_fields is not None and 'username' not in update_fields):
+        return
+    subject_ids = set(
+        Course.objects.filter(owner=instance).values_list('subject_id', flat=True)
+    )
+    for subject_id in subject_ids:
+        transaction.on_commit(lambda subject_id=subject_id: catalog.refresh_subject_courses(subject_id))
+
+
+# ------------------------------- токены API (courses/api/authentication.py)
+# проверенные токены лежат в памяти каждого воркера - отзыв и деактивация
+# пользователя должны дойти до всех, а не только до процесса, где они случились
+
+@receiver(post_save, sender=APIToken)
+@receiver(post_delete, sender=APIToken)
+def api_token_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_api_tokens_version()
+
+
+@receiver(post_save, sender=get_user_model())
+def api_token_user_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # вход (last_login) на токены не влияет
+    if raw or created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    bump_api_tokens_version()
@@ -1,3 +1,1562 @@
-from django.test import TestCase
+import os
+import re
+import json
+import tempfile
+import base64
+import time
+import logging
+import threading
+from io import StringIO
+from urllib.parse import urlencode
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from rest_framework.renderers import JSONRenderer
+
+from django.urls import reverse
+from django.core.management import call_command, CommandError
+from django.db import connection, OperationalError
+from django.db.models.signals import m2m_changed
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+
+from common.cache import get_or_compute, get_version, set_computed
+from common.cache_backends import TwoTierCache
+from common.db import SQLITE_PRAGMAS, is_healthy
+from common.log import AsyncBatchHandler, JSONFormatter, SlowQueryFilter
+from common.replay import parse_line
+from common.testing import QueryBudgetMixin, build_catalog, create_item
+from common.profiling import metrics
+from courses.models import (
+    Subject, Course, Module, Content,
+    Text, File, Image, Video, CourseOutline, APIToken, OrderCounter,
+)
+from courses.api.authentication import HashedTokenAuthentication, issue_token
+from courses.api.renderers import FastJSONRenderer
+from courses.api.serializers import CourseSerializer, SubjectSerializer, ModuleWithContentSerializer
+from courses.read_models import SubjectRow, CatalogCourseRow, ManageCourseRow
+from courses import outline
+from courses.views import ManageCourseListView
+from courses.enrollment import Enrollment, enroll, is_enrolled
+from courses.fields import OrderField, bulk_create_ordered
+from courses.reorder import bulk_reorder
+from courses.versions import course_version_name
+from courses.prefetch import contents_prefetch, module_contents
+from courses.render_cache import get_render_cache
+from courses.management.commands.replay_requests import Command as ReplayCommand, is_failed
+from students.views import StudentCourseListView, StudentCourseDetailView
+
+User = get_user_model()
+
+
+class ContentPrefetchTestCase(TestCase):
+    items_count = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.module = Module.objects.create(course=cls.course, title='Module')
+        item_models = (Text, File, Image, Video)
+        for number in range(cls.items_count):
+            item = create_item(item_models[number % 4], cls.owner, number)
+            Content.objects.create(module=cls.module, item=item)
+
+    def test_module_contents_queries_do_not_depend_on_items_count(self):
+        # 1 запрос на Content + по одному на каждый из 4-х типов item
+        with self.assertNumQueries(5):
+            titles = [content.item.title for content in module_contents(self.module)]
+        self.assertEqual(len(titles), self.items_count)
+
+    def test_course_contents_prefetch(self):
+        # курс + модули + контент + по одному запросу на каждый тип item
+        with self.assertNumQueries(7):
+            course = Course.objects.prefetch_related(
+                contents_prefetch('modules__contents')
+            ).get(pk=self.course.pk)
+            items = [
+                content.item
+                for module in course.modules.all()
+                for content in module.contents.all()
+            ]
+        self.assertEqual(len(items), self.items_count)
+        self.assertEqual(
+            {item._meta.model_name for item in items},
+            {'text', 'file', 'image', 'video'}
+        )
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ItemRenderCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        get_render_cache().clear()
+        self.item = create_item(Text, self.owner, 1)
+
+    def test_render_is_warmed_on_save(self):
+        with mock.patch.object(Text, 'render_html') as render_html:
+            html = self.item.render()
+        render_html.assert_not_called()
+        self.assertIn('text 1', html)
+
+    def test_render_is_invalidated_by_update(self):
+        self.item.content = 'changed text'
+        self.item.save()
+        self.assertIn('changed text', Text.objects.get(pk=self.item.pk).render())
+
+    def test_render_reads_from_shared_cache(self):
+        render_cache = get_render_cache()
+        render_cache.backends[0].clear()  # как будто это другой воркер
+        with mock.patch.object(Text, 'render_html') as render_html:
+            html = self.item.render()
+        render_html.assert_not_called()
+        self.assertEqual(render_cache.backends[0].get(render_cache.make_key(self.item)), html)
+
+    def test_render_cache_can_be_disabled(self):
+        with self.settings(ITEM_RENDER_CACHE={'ENABLED': False}):
+            with mock.patch.object(Text, 'render_html', return_value='fresh') as render_html:
+                self.assertEqual(self.item.render(), 'fresh')
+                self.assertEqual(self.item.render(), 'fresh')
+        self.assertEqual(render_html.call_count, 2)
+
+
+class ReorderTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.stranger = User.objects.create_user(username='stranger', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.foreign_course = Course.objects.create(
+            owner=cls.stranger, subject=subject,
+            title='Foreign course', description='description'
+        )
+        cls.modules = [
+            Module.objects.create(course=cls.course, title=f'Module {number}')
+            for number in range(5)
+        ]
+        cls.foreign_module = Module.objects.create(course=cls.foreign_course, title='Foreign')
+        cls.contents = [
+            Content.objects.create(
+                module=cls.modules[0],
+                item=create_item(Text, cls.owner, number)
+            )
+            for number in range(200)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def post_json(self, url, data):
+        return self.client.post(url, data=json.dumps(data), content_type='application/json')
+
+    def test_content_reorder_is_single_update(self):
+        new_orders = {
+            str(content.pk): len(self.contents) - index - 1
+            for index, content in enumerate(self.contents)
+        }
+        # сессия + пользователь + SAVEPOINT/UPDATE/RELEASE + id курсов для сброса кэша
+        # + последний order модуля и подъём его счётчика
+        with self.assertNumQueries(8):
+            response = self.post_json(reverse('courses:content_order_change'), new_orders)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(Content.objects.values_list('pk', 'order')),
+            {int(pk): order for pk, order in new_orders.items()}
+        )
+
+    def test_module_reorder_skips_foreign_modules(self):
+        new_orders = {str(module.pk): 10 + index for index, module in enumerate(self.modules)}
+        new_orders[str(self.foreign_module.pk)] = 100
+        response = self.post_json(reverse('courses:module_order_change'), new_orders)
+        self.assertEqual(response.status_code, 200)
+        self.foreign_module.refresh_from_db()
+        self.assertEqual(self.foreign_module.order, 0)
+        self.assertEqual(
+            list(self.course.modules.values_list('order', flat=True)),
+            [10, 11, 12, 13, 14]
+        )
+
+    def test_bad_request(self):
+        response = self.post_json(reverse('courses:module_order_change'), {'first': 'last'})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderFieldTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.module = Module.objects.create(course=cls.course, title='Module')
+
+    def test_orders_are_sequential_per_parent(self):
+        other_module = Module.objects.create(course=self.course, title='Other')
+        self.assertEqual(other_module.order, 1)
+        orders = [
+            Content.objects.create(module=self.module, item=create_item(Text, self.owner, number)).order
+            for number in range(3)
+        ]
+        self.assertEqual(orders, [0, 1, 2])
+        content = Content.objects.create(module=other_module, item=create_item(Text, self.owner, 3))
+        self.assertEqual(content.order, 0)
+
+    def test_counter_skips_orders_set_directly(self):
+        Content.objects.create(module=self.module, item=create_item(Text, self.owner, 0))
+        explicit = Content.objects.create(module=self.module, order=5, item=create_item(Text, self.owner, 1))
+        self.assertEqual(Content.objects.create(module=self.module, item=create_item(Text, self.owner, 2)).order, 6)
+        bulk_reorder(Content.objects.filter(pk=explicit.pk), {explicit.pk: 20})
+        self.assertEqual(Content.objects.create(module=self.module, item=create_item(Text, self.owner, 3)).order, 21)
+        # в обход и pre_save, и bulk_reorder - счётчик догонит MAX(order) при резервировании
+        Content.objects.filter(pk=explicit.pk).update(order=40)
+        self.assertEqual(Content.objects.create(module=self.module, item=create_item(Text, self.owner, 4)).order, 41)
+
+    def test_counter_starts_after_existing_rows(self):
+        Content.objects.create(module=self.module, order=7, item=create_item(Text, self.owner, 0))
+        content = Content.objects.create(module=self.module, item=create_item(Text, self.owner, 1))
+        self.assertEqual(content.order, 8)
+
+    def test_bulk_create_ordered(self):
+        Content.objects.create(module=self.module, item=create_item(Text, self.owner, 0))
+        items = [create_item(Text, self.owner, number) for number in range(1, 51)]
+        contents = [Content(module=self.module, item=item) for item in items]
+        # UPDATE ... RETURNING счётчика + один INSERT на все строки
+        with self.assertNumQueries(2):
+            bulk_create_ordered(Content, contents)
+        self.assertEqual(
+            list(self.module.contents.values_list('order', flat=True)),
+            list(range(51))
+        )
+
+    def test_bulk_create_with_explicit_orders(self):
+        Content.objects.create(module=self.module, item=create_item(Text, self.owner, 0))
+        items = [create_item(Text, self.owner, number) for number in range(1, 31)]
+        contents = [Content(module=self.module, item=item, order=number + 10) for number, item in enumerate(items)]
+        # один INSERT и один UPDATE счётчика на всю пачку, а не запрос на строку
+        with self.assertNumQueries(2):
+            bulk_create_ordered(Content, contents)
+        self.assertEqual(OrderCounter.objects.get(scope=f'courses.content.order:module_id={self.module.pk}').value, 40)
+        self.assertEqual(Content.objects.create(module=self.module, item=create_item(Text, self.owner, 31)).order, 40)
+
+
+class OrderFieldConcurrencyTestCase(TransactionTestCase):
+    writers = 8
+    inserts_per_writer = 15
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        course = Course.objects.create(
+            owner=self.owner, subject=subject,
+            title='Course', description='description'
+        )
+        self.module = Module.objects.create(course=course, title='Module')
+        self.items = [
+            create_item(Text, self.owner, number)
+            for number in range(self.writers * self.inserts_per_writer)
+        ]
+
+    def create_content(self, item):
+        # тестовая sqlite в памяти не ждёт освобождения блокировки,
+        # поэтому писатель, упёршийся в блокировку, просто пробует снова
+        while True:
+            try:
+                return Content.objects.create(module=self.module, item=item)
+            except OperationalError:
+                time.sleep(0.001)
+
+    def writer(self, items, barrier, errors):
+        try:
+            barrier.wait()
+            for item in items:
+                self.create_content(item)
+        except Exception as error:  # pragma: no cover
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def test_parallel_writers_get_unique_orders(self):
+        original_pre_save = OrderField.pre_save
+
+        def slow_pre_save(field, model_instance, add):
+            # задержка между выдачей номера и INSERT, как у нагруженной бд
+            value = original_pre_save(field, model_instance, add)
+            time.sleep(0.002)
+            return value
+
+        with mock.patch.object(OrderField, 'pre_save', slow_pre_save):
+            self.run_writers()
+        orders = list(self.module.contents.values_list('order', flat=True))
+        self.assertEqual(len(orders), len(self.items))
+        self.assertEqual(len(set(orders)), len(orders))
+
+    def run_writers(self):
+        barrier = threading.Barrier(self.writers)
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.writer,
+                args=(self.items[number::self.writers], barrier, errors)
+            )
+            for number in range(self.writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EnrollmentTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.student = User.objects.create_user(username='student', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_enroll_is_idempotent(self):
+        self.assertTrue(enroll(self.student, self.course))
+        self.assertFalse(enroll(self.student, self.course))
+        self.assertEqual(self.course.students.count(), 1)
+
+    def test_enroll_decides_by_insert(self):
+        # строку успел вставить параллельный запрос: кэш пуст, проверка "до" её бы не увидела
+        Enrollment.objects.create(course=self.course, user=self.student)
+        actions = []
+
+        def receiver(action, **kwargs):
+            actions.append(action)
+
+        m2m_changed.connect(receiver, sender=Enrollment)
+        self.addCleanup(m2m_changed.disconnect, receiver, sender=Enrollment)
+        with self.assertNumQueries(1):  # только INSERT ... ON CONFLICT DO NOTHING
+            self.assertFalse(enroll(self.student, self.course))
+        self.assertEqual(actions, ['pre_add'])
+        self.assertEqual(self.course.students.count(), 1)
+
+    def test_is_enrolled_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(is_enrolled(self.student, self.course))
+            self.assertFalse(is_enrolled(self.student, self.course))
+        enroll(self.student, self.course)
+        with self.assertNumQueries(0):
+            self.assertTrue(is_enrolled(self.student, self.course))
+
+    def test_cache_is_invalidated_by_m2m_changes(self):
+        enroll(self.student, self.course)
+        self.course.students.remove(self.student)
+        self.assertFalse(is_enrolled(self.student, self.course))
+        self.student.courses_joined.add(self.course)
+        self.assertTrue(is_enrolled(self.student, self.course))
+        self.course.students.clear()
+        self.assertFalse(is_enrolled(self.student, self.course))
+
+    def test_enroll_api(self):
+        url = reverse('api:course-enroll', kwargs={'pk': self.course.pk})
+        auth = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'student:password').decode()}
+        self.assertEqual(self.client.post(url, **auth).json(), {'enrolled': True})
+        self.assertEqual(self.client.post(url, **auth).json(), {'already enrolled': True})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenAuthenticationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.student = User.objects.create_user(username='student', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.course.students.add(cls.student)
+        Module.objects.create(course=cls.course, title='Module')
+
+    def test_issue_token(self):
+        auth = 'Basic ' + base64.b64encode(b'student:password').decode()
+        response = self.client.post(reverse('api:token'), HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 201)
+        key = response.json()['token']
+        self.assertFalse(self.student.api_tokens.filter(key_hash=key).exists())
+
+        url = reverse('api:course-courses', kwargs={'pk': self.course.pk})
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_verified_token_is_cached(self):
+        key, token = issue_token(self.student)
+        url = reverse('api:course-enroll', kwargs={'pk': self.course.pk})
+        self.client.post(url, HTTP_AUTHORIZATION=f'Bearer {key}')
+        with self.assertNumQueries(1):  # только сам курс
+            response = self.client.post(url, HTTP_AUTHORIZATION=f'Bearer {key}')
+        self.assertEqual(response.json(), {'already enrolled': True})
+
+    def test_revoke_token(self):
+        key, token = issue_token(self.student)
+        url = reverse('api:token')
+        response = self.client.delete(url, HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.delete(url, HTTP_AUTHORIZATION=f'Token {key}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_revocation_reaches_other_workers(self):
+        # токен в памяти этого процесса; отзыв и деактивация - как из другого воркера (админка)
+        key, token = issue_token(self.student)
+        url = reverse('api:course-courses', kwargs={'pk': self.course.pk})
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}').status_code, 200)
+        APIToken.objects.get(pk=token.pk).save()  # не меняет токен - просто новая версия
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}').status_code, 200)
+        self.student.is_active = False
+        self.student.save()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}').status_code, 401)
+        self.student.is_active = True
+        self.student.save()
+        token.revoked = True
+        token.save()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Token {key}').status_code, 401)
+
+    def test_requests_get_own_user_instances(self):
+        key, token = issue_token(self.student)
+        authentication = HashedTokenAuthentication()
+        first_user, first_token = authentication.authenticate_credentials(key)
+        second_user, second_token = authentication.authenticate_credentials(key)
+        self.assertEqual(first_user, second_user)
+        self.assertIsNot(first_user, second_user)
+        self.assertIs(second_token.user, second_user)
+
+    def test_expired_token(self):
+        key, token = issue_token(self.student, lifetime=-1)
+        response = self.client.get(
+            reverse('api:course-courses', kwargs={'pk': self.course.pk}),
+            HTTP_AUTHORIZATION=f'Token {key}'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.python = Subject.objects.create(title='Python')
+        cls.math = Subject.objects.create(title='Math')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=cls.python,
+            title='Django course', description='description'
+        )
+        Module.objects.create(course=cls.course, title='Module')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_warm_catalog_does_not_hit_db(self):
+        url = reverse('courses:course_list')
+        self.client.get(url)
+        self.client.get(reverse('courses:course_list_subject', kwargs={'subject_slug': 'python'}))
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+            self.assertContains(response, 'Django course')
+            self.assertContains(response, '1 модулей')
+            response = self.client.get(
+                reverse('courses:course_list_subject', kwargs={'subject_slug': 'python'})
+            )
+            self.assertContains(response, 'Django course')
+
+    def test_unknown_subject(self):
+        response = self.client.get(
+            reverse('courses:course_list_subject', kwargs={'subject_slug': 'unknown'})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_catalog_is_rebuilt_by_signals(self):
+        url = reverse('courses:course_list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Module.objects.create(course=self.course, title='Second module')
+        self.assertContains(self.client.get(url), '2 модулей')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.subject = self.math
+            self.course.save()
+        response = self.client.get(
+            reverse('courses:course_list_subject', kwargs={'subject_slug': 'python'})
+        )
+        self.assertNotContains(response, 'Django course')
+        response = self.client.get(
+            reverse('courses:course_list_subject', kwargs={'subject_slug': 'math'})
+        )
+        self.assertContains(response, 'Django course')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.username = 'teacher'
+            self.owner.save()
+        self.assertContains(self.client.get(url), 'Teacher')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReadModelTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.subject = Subject.objects.create(title='Python')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=cls.subject,
+            title='Django course', description='description'
+        )
+        cls.empty_course = Course.objects.create(
+            owner=cls.owner, subject=cls.subject,
+            title='Empty course', description='description'
+        )
+        cls.second = Module.objects.create(course=cls.course, title='Second', order=1)
+        cls.first = Module.objects.create(course=cls.course, title='First', order=0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_catalog_rows(self):
+        response = self.client.get(reverse('courses:course_list_subject', kwargs={'subject_slug': 'python'}))
+        self.assertEqual(response.context['subject'], SubjectRow(self.subject.pk, 'Python', 'python', 2))
+        self.assertContains(response, 'Курсы по предмету "Python"')
+        row = response.context['course_list'][-1]
+        self.assertIsInstance(row, CatalogCourseRow)
+        self.assertEqual((row.title, row.total_modules, row.owner_username), ('Django course', 2, 'owner'))
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_manage_course_list(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('courses:manage_course_list'))
+        self.assertEqual(response.context['object_list'], [
+            ManageCourseRow(self.empty_course.pk, 'Empty course', None),
+            ManageCourseRow(self.course.pk, 'Django course', self.first.pk),
+        ])
+        self.assertContains(response, reverse('courses:module_content_list', kwargs={'module_id': self.first.pk}))
+        self.assertContains(response, 'Редактировать', count=1)
+
+    def test_subject_list_api_matches_serializer(self):
+        response = self.client.get(reverse('api:list_subject'))
+        expected = SubjectSerializer(Subject.objects.order_by('slug'), many=True).data
+        self.assertEqual(response.json()['results'], expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseOutlineTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.student = User.objects.create_user(username='student', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.course.students.add(cls.student)
+        cls.first = Module.objects.create(course=cls.course, title='First')
+        cls.second = Module.objects.create(course=cls.course, title='Second')
+        cls.text = Text.objects.create(owner=cls.owner, title='Lesson', content='first version')
+        Content.objects.create(module=cls.first, item=cls.text)
+        Content.objects.create(
+            module=cls.second, item=Video.objects.create(owner=cls.owner, title='Video', url='https://www.youtube.com/watch?v=abc')
+        )
+
+    def setUp(self):
+        cache.clear()
+        get_render_cache().clear()
+
+    @staticmethod
+    def first_html(document):
+        return outline.render_contents(document['modules'][0]['contents'])[0]['html']
+
+    def test_warm_outline_does_not_hit_db(self):
+        document = outline.get_outline(self.course.pk)
+        self.assertEqual([module['title'] for module in document['modules']], ['First', 'Second'])
+        with self.assertNumQueries(0):
+            self.assertEqual(outline.get_outline(self.course.pk), document)
+            # HTML прогрет при сборке снимка
+            self.assertEqual(self.first_html(document), '<p>first version</p>')
+
+    def test_html_is_rendered_through_render_cache(self):
+        document = outline.get_outline(self.course.pk)
+        with override_settings(ITEM_RENDER_CACHE={'ENABLED': False}):
+            with mock.patch.object(Text, 'render_html', return_value='<p>template changed</p>'):
+                self.assertEqual(self.first_html(document), '<p>template changed</p>')
+        cache.clear()  # HTML в общем кэше
+        get_render_cache().clear()  # и в памяти процесса
+        with self.assertNumQueries(1):  # промах в кэше HTML - объект из бд
+            self.assertEqual(self.first_html(document), '<p>first version</p>')
+
+    def test_only_changed_module_is_rebuilt(self):
+        outline.get_outline(self.course.pk)
+        self.text.content = 'second version'
+        self.text.save()
+        with mock.patch.object(outline, 'build_contents', wraps=outline.build_contents) as build_contents:
+            document = outline.get_outline(self.course.pk)
+        build_contents.assert_called_once_with([self.first.pk])
+        self.assertEqual(self.first_html(document), '<p>second version</p>')
+        self.assertEqual(CourseOutline.objects.get(pk=self.course.pk).version, document['version'])
+
+    def test_evicted_outline_is_read_from_db(self):
+        document = outline.get_outline(self.course.pk)
+        cache.delete(outline.outline_key(self.course.pk, document['version']))
+        with self.assertNumQueries(1):
+            self.assertEqual(outline.get_outline(self.course.pk), document)
+
+    def test_concurrent_readers_rebuild_once(self):
+        builds = []
+
+        def slow_load(course_id, version):
+            builds.append(version)
+            time.sleep(0.2)
+            return {'version': version, 'modules': []}
+
+        with mock.patch.object(outline, 'load_outline', side_effect=slow_load):
+            readers = [threading.Thread(target=outline.get_outline, args=(self.course.pk, )) for _ in range(8)]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(len(builds), 1)
+
+    def test_writes_do_not_rebuild_outline(self):
+        outline.get_outline(self.course.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Module.objects.create(course=self.course, title='Third')
+            self.text.title = 'Renamed lesson'
+            self.text.save()
+        version = get_version(course_version_name(self.course.pk))
+        self.assertFalse(CourseOutline.objects.filter(version=version).exists())
+        # пересобирает первое чтение: новый модуль и изменённый - с контентом, остальные из снимка
+        with mock.patch.object(outline, 'build_contents', wraps=outline.build_contents) as build_contents:
+            document = outline.get_outline(self.course.pk)
+        self.assertEqual(
+            sorted(build_contents.call_args.args[0]), [self.first.pk, document['modules'][-1]['id']]
+        )
+        self.assertEqual(document['modules'][-1]['title'], 'Third')
+        self.assertEqual(document['modules'][0]['contents'][0]['title'], 'Renamed lesson')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_outline_without_cache(self):
+        # memcached недоступен: версии не хранятся - снимок всегда из бд и не сохраняется
+        self.assertEqual(self.first_html(outline.get_outline(self.course.pk)), '<p>first version</p>')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.text.content = 'second version'
+            self.text.save()
+        self.assertEqual(self.first_html(outline.get_outline(self.course.pk)), '<p>second version</p>')
+        self.assertFalse(CourseOutline.objects.exists())
+
+    def test_api_contents_match_serializer(self):
+        key, _ = issue_token(self.student)
+        response = self.client.get(
+            reverse('api:course-courses', kwargs={'pk': self.course.pk}), HTTP_AUTHORIZATION=f'Token {key}'
+        )
+        expected = ModuleWithContentSerializer(self.course.modules.all(), many=True).data
+        self.assertEqual(response.json()['modules'], json.loads(JSONRenderer().render(expected)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrComputeTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def slow_compute(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return 'value'
+
+    def test_miss_is_computed_once(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(get_or_compute('key', self.slow_compute, 60))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 10)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_while_recomputing(self):
+        set_computed('key', 'old', timeout=-1, stale_timeout=60)
+        cache.add('key:lock', 'other', 30)
+        self.assertEqual(get_or_compute('key', self.slow_compute, 60), 'old')
+        self.assertEqual(self.calls, 0)
+
+        cache.delete('key:lock')
+        self.assertEqual(get_or_compute('key', self.slow_compute, 60), 'value')
+        self.assertEqual(self.calls, 1)
+
+    def test_value_of_released_lock_is_used(self):
+        def holder_finishes(key, timeout):
+            # add не прошёл, а к проверке блокировки держатель уже положил значение и отпустил её
+            set_computed('key', 'fresh', 60)
+            return None
+
+        with mock.patch('common.cache._acquire_lock', side_effect=holder_finishes):
+            self.assertEqual(get_or_compute('key', self.slow_compute, 60), 'fresh')
+        self.assertEqual(self.calls, 0)
+
+    def test_early_recompute(self):
+        set_computed('key', 'old', timeout=60, delta=1000)
+        self.assertEqual(get_or_compute('key', self.slow_compute, 60, beta=0), 'old')
+        with mock.patch('common.cache.random.random', return_value=0.99):
+            self.assertEqual(get_or_compute('key', self.slow_compute, 60), 'value')
+        self.assertEqual(self.calls, 1)
+
+
+TWO_TIER_CACHES = {
+    'default': {
+        'BACKEND': 'common.cache_backends.TwoTierCache',
+        'LOCATION': 'two-tier-test',
+        'OPTIONS': {'SHARED': 'shared', 'CHECK_INTERVAL': 0, },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'two-tier-shared',
+    },
+}
+
+
+@override_settings(CACHES=TWO_TIER_CACHES)
+class TwoTierCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # L1 другого воркера - отдельное имя, тот же L2
+        self.other_worker = TwoTierCache('two-tier-other', TWO_TIER_CACHES['default'])
+        self.other_worker.local.data.clear()
+
+    def test_reads_are_served_from_l1(self):
+        cache.set('key', 'value')
+        # из L2 ключ пропал, но в L1 ещё есть
+        caches['shared'].delete('key')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertEqual(cache.get_many(['key', 'unknown']), {'key': 'value'})
+
+    def test_l1_keeps_a_copy(self):
+        cache.set('key', ['value'])
+        cache.get('key').append('changed')
+        self.assertEqual(cache.get('key'), ['value'])
+
+    def test_write_on_other_worker_invalidates_l1(self):
+        self.other_worker.set('key', 'first')
+        self.assertEqual(cache.get('key'), 'first')
+
+        self.other_worker.set('key', 'second')
+        self.assertEqual(cache.get('key'), 'second')
+
+        self.other_worker.add('counter', 1)
+        self.assertEqual(cache.get('counter'), 1)
+        self.other_worker.incr('counter')
+        self.assertEqual(cache.get('counter'), 2)
+
+        self.other_worker.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_only_overwrites_are_published(self):
+        def generation():
+            return caches['shared'].get('two_tier:generation')
+
+        cache.set('known', 'first')
+        published = generation()
+        # новые ключи и блокировки - без записи в журнал
+        cache.set('new key', 'value')
+        self.assertTrue(cache.add('lock', 'token'))
+        self.assertEqual(generation(), published)
+        cache.set('known', 'second')
+        cache.delete('lock')
+        self.assertEqual(generation(), published + 2)
+
+    def test_lost_change_log_flushes_l1(self):
+        cache.set('key', 'first')
+        self.other_worker.set('key', 'second')
+        caches['shared'].delete_many([f'two_tier:changed:{n}' for n in range(
+            caches['shared'].get('two_tier:generation') - 5,
+            caches['shared'].get('two_tier:generation') + 1
+        )])
+        self.assertEqual(cache.get('key'), 'second')
+
+    def test_non_atomic_shared_cache_is_refused(self):
+        params = {'OPTIONS': {'SHARED': 'files'}}
+        files = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/cache'}
+        with override_settings(CACHES={**TWO_TIER_CACHES, 'files': files}):
+            with self.assertRaises(ImproperlyConfigured):
+                TwoTierCache('two-tier-files', params)
+
+    def test_stats_on_admin_index(self):
+        def get_stats():
+            l1_stats, l2_stats = (stats for name, stats in cache._cache.get_stats())
+            return l1_stats['get_hits'], l2_stats['get_misses']
+
+        admin = User.objects.create_superuser(username='admin', password='password')
+        l1_hits, l2_misses = get_stats()
+        cache.set('key', 'value')
+        cache.get('key')
+        cache.get('unknown')
+        self.assertEqual(get_stats(), (l1_hits + 1, l2_misses + 1))
+
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:index'))
+        self.assertContains(response, 'L1 (pid')
+        self.assertContains(response, 'L2 (shared)')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseListAPITestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        Subject.objects.create(title='Other subject')
+        cls.courses = [
+            Course.objects.create(
+                owner=cls.owner, subject=subject,
+                title=f'Course {number}', description='description'
+            )
+            for number in range(5)
+        ]
+        for course in cls.courses:
+            Module.objects.create(course=course, title='Module')
+
+    def test_list_is_paginated_by_cursor(self):
+        url = reverse('api:course-list')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        titles = [course['title'] for course in response.json()['results']]
+        self.assertEqual(titles, ['Course 4', 'Course 3'])
+
+        seen = list(titles)
+        next_url = response.json()['next']
+        while next_url:
+            page = self.client.get(next_url).json()
+            seen.extend(course['title'] for course in page['results'])
+            next_url = page['next']
+        self.assertEqual(seen, [f'Course {number}' for number in range(4, -1, -1)])
+
+    def test_list_skips_modules_unless_expanded(self):
+        url = reverse('api:course-list')
+        # курсы (без COUNT - курсор его не делает)
+        with self.assertNumQueries(1):
+            course = self.client.get(url).json()['results'][0]
+        self.assertNotIn('modules', course)
+        # + модули одним запросом
+        with self.assertNumQueries(2):
+            course = self.client.get(url, {'expand': 'modules'}).json()['results'][0]
+        self.assertEqual(course['modules'][0]['title'], 'Module')
+
+    def test_fields(self):
+        response = self.client.get(reverse('api:course-list'), {'fields': 'id,title'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+
+        url = reverse('api:course-detail', kwargs={'pk': self.courses[0].pk})
+        self.assertIn('modules', self.client.get(url).json())
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'fields': 'title'})
+        self.assertEqual(response.json(), {'title': 'Course 0'})
+
+    def test_fast_list_matches_serializer(self):
+        response = self.client.get(reverse('api:course-list'), {'expand': 'modules'})
+        expected = CourseSerializer(Course.objects.all(), many=True).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+        self.assertEqual(
+            json.loads(FastJSONRenderer().render(expected)),
+            json.loads(JSONRenderer().render(expected))
+        )
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse('api:course-list'), {'fields': 'title,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.json())
+        response = self.client.get(reverse('api:course-list'), {'expand': 'owner'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_subjects_are_paginated(self):
+        response = self.client.get(reverse('api:list_subject'), {'page_size': 1})
+        self.assertEqual([subject['slug'] for subject in response.json()['results']], ['other-subject'])
+        self.assertIsNotNone(response.json()['next'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalRequestTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.student = User.objects.create_user(username='student', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.module = Module.objects.create(course=cls.course, title='Module')
+        cls.text = create_item(Text, cls.owner, 1)
+        Content.objects.create(module=cls.module, item=cls.text)
+        cls.course.students.add(cls.student)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_course_detail(self):
+        url = reverse('courses:course_detail', kwargs={'slug': self.course.slug})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # только id курса по slug
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.module.title = 'Renamed module'
+        self.module.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_course_detail_depends_on_user(self):
+        url = reverse('courses:course_detail', kwargs={'slug': self.course.slug})
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_course_detail_depends_on_csrf_secret(self):
+        url = reverse('courses:course_detail', kwargs={'slug': self.course.slug})
+        self.client.force_login(self.student)
+        self.client.cookies['csrftoken'] = 'a' * 32
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # вход заново меняет секрет csrf - страница с формой нужна заново
+        self.client.cookies['csrftoken'] = 'b' * 32
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_student_course_detail(self):
+        url = reverse('students:student_course_detail', kwargs={'slug': self.course.slug})
+        self.client.force_login(self.student)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.text.content = 'changed'
+        self.text.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'changed')
+
+        self.course.students.remove(self.student)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    def test_api_contents(self):
+        url = reverse('api:course-courses', kwargs={'pk': self.course.pk})
+        key, _ = issue_token(self.student)
+        auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+        response = self.client.get(url, **auth)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # только курс: токен уже проверен (в памяти), модули и контент не нужны
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **auth)
+        self.assertEqual(response.status_code, 304)
+
+        other_key, _ = issue_token(self.owner)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_AUTHORIZATION=f'Token {other_key}')
+        self.assertEqual(response.status_code, 403)
+
+    def test_api_retrieve(self):
+        url = reverse('api:course-detail', kwargs={'pk': self.course.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.course.subject.title = 'Renamed subject'
+        self.course.subject.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class QueryPlanTestCase(TestCase):
+    """
+        EXPLAIN для частых запросов из courses/views.py и students/views.py:
+        таблица не должна читаться целиком (SCAN), а там, где порядок
+        может дать индекс - без сортировки во временном B-дереве
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Course', description='description'
+        )
+        cls.module = Module.objects.create(course=cls.course, title='Module')
+        cls.text = create_item(Text, cls.owner, 1)
+        Content.objects.create(module=cls.module, item=cls.text)
+        cls.course.students.add(cls.owner)
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('разбирается план SQLite')
+
+    def assertIndexedPlan(self, queryset, sorted_by_index=True):
+        plan = queryset.explain()
+        self.assertIsNone(re.search(r'\bSCAN\b', plan), plan)
+        if sorted_by_index:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def get_view_queryset(self, view_class, **kwargs):
+        request = RequestFactory().get('/')
+        request.user = self.owner
+        view = view_class()
+        view.setup(request, **kwargs)
+        return view.get_queryset()
+
+    def test_module_contents(self):
+        self.assertIndexedPlan(module_contents(self.module))
+
+    def test_course_modules(self):
+        self.assertIndexedPlan(self.course.modules.all())
+        # prefetch_related('modules') для списка курсов - IN (...), сортировка остаётся
+        self.assertIndexedPlan(Module.objects.filter(course__in=[self.course]), sorted_by_index=False)
+
+    def test_next_order(self):
+        # OrderField.get_next_from_table
+        self.assertIndexedPlan(
+            Content.objects.filter(module=self.module).order_by('-order').values_list('order')[:1]
+        )
+
+    def test_item_modules(self):
+        # module_and_course_ids_for_item - обратный поиск по GenericForeignKey
+        self.assertIndexedPlan(
+            Content.objects.filter(
+                content_type=ContentType.objects.get_for_model(self.text),
+                object_id=self.text.pk
+            ).values_list('module_id', 'module__course_id'),
+            sorted_by_index=False
+        )
+
+    def test_enrollment(self):
+        self.assertIndexedPlan(Enrollment.objects.filter(course_id=self.course.pk, user_id=self.owner.pk))
+
+    def test_manage_course_list(self):
+        self.assertIndexedPlan(self.get_view_queryset(ManageCourseListView))
+
+    def test_student_courses(self):
+        # сортировка по created после соединения с таблицей записей - индексом не обойтись
+        self.assertIndexedPlan(self.get_view_queryset(StudentCourseListView), sorted_by_index=False)
+        self.assertIndexedPlan(
+            self.get_view_queryset(StudentCourseDetailView, slug=self.course.slug).filter(slug=self.course.slug),
+            sorted_by_index=False
+        )
+
+
+class SQLiteConnectionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('только для SQLite')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.wrapper = DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3')},
+            alias='sqlite_connection_test'
+        )
+        self.addCleanup(self.wrapper.close)
+
+    def pragma(self, name):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_pragmas_from_settings(self):
+        self.wrapper.settings_dict['PRAGMAS'] = {'busy_timeout': 100}
+        self.assertEqual(self.pragma('busy_timeout'), 100)
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+
+    def test_health_check(self):
+        self.wrapper.ensure_connection()
+        self.assertTrue(is_healthy(self.wrapper))
+        self.wrapper.connection.close()
+        self.assertFalse(is_healthy(self.wrapper))
+
+
+@override_settings(CACHES=TWO_TIER_CACHES)
+class RequestProfilingTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        subject = Subject.objects.create(title='Subject')
+        Course.objects.create(owner=cls.owner, subject=subject, title='Course', description='description')
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def metric(self, text, name, view):
+        match = re.search(rf'^{name}{{view="{view}"}} (\S+)$', text, re.MULTILINE)
+        return float(match.group(1)) if match else None
+
+    @override_settings(REQUEST_PROFILING={'SAMPLE_RATE': 1})
+    def test_sampled_requests_are_aggregated_by_view(self):
+        self.client.get(reverse('courses:course_list'))
+        self.client.get(reverse('courses:course_list'))
+        self.client.get(reverse('api:course-list'))
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertEqual(self.metric(text, 'request_latency_ms_count', 'courses:course_list'), 2)
+        self.assertEqual(self.metric(text, 'request_latency_ms_count', 'api:course-list'), 1)
+        self.assertGreater(self.metric(text, 'request_db_queries_sum', 'api:course-list'), 0)
+        self.assertGreater(self.metric(text, 'request_template_ms_sum', 'courses:course_list'), 0)
+        # второй раз каталог и страница берутся из кэша
+        self.assertGreater(self.metric(text, 'request_cache_hits', 'courses:course_list'), 0)
+        self.assertGreater(self.metric(text, 'request_cache_misses', 'courses:course_list'), 0)
+
+    @override_settings(REQUEST_PROFILING={'SAMPLE_RATE': 0})
+    def test_not_sampled_requests_are_not_recorded(self):
+        self.client.get(reverse('courses:course_list'))
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIsNone(self.metric(text, 'request_latency_ms_count', 'courses:course_list'))
+
+    def test_slow_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            options = {'SAMPLE_RATE': 1, 'PROFILE_SLOW_MS': 0, 'PROFILE_DIR': directory}
+            with override_settings(REQUEST_PROFILING=options):
+                self.client.get(reverse('courses:course_list'))
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertTrue(os.listdir(directory)[0].endswith('.prof'))
+
+    def test_metrics_are_internal(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncLogHandlerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.filename = os.path.join(self.directory, 'application.log')
+
+    def make_logger(self, handler, *filters):
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger(f'test.async_log.{id(handler)}')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        for log_filter in filters:
+            logger.addFilter(log_filter)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def read_lines(self):
+        with open(self.filename, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_records_are_written_as_json_lines(self):
+        handler = AsyncBatchHandler(self.filename)
+        logger = self.make_logger(handler)
+        logger.debug('(%.3f) %s; args=%s', 0.5, 'SELECT 1', (), extra={'duration': 0.5, 'sql': 'SELECT 1'})
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logger.exception('failed')
+        handler.close()
+
+        first, second = self.read_lines()
+        self.assertEqual(first['message'], '(0.500) SELECT 1; args=()')
+        self.assertEqual(first['sql'], 'SELECT 1')
+        self.assertEqual(first['duration'], 0.5)
+        self.assertEqual(second['level'], 'ERROR')
+        self.assertIn('ValueError: broken', second['exception'])
+
+    def test_slow_query_filter(self):
+        handler = AsyncBatchHandler(self.filename)
+        handler.setFormatter(JSONFormatter())
+        # фильтр на хэндлере - видит и записи дочерних логгеров
+        handler.addFilter(SlowQueryFilter(threshold_ms=100))
+        for name, message, duration in (
+            ('django.db.backends', 'fast', 0.01),
+            ('django.db.backends', 'slow', 0.2),
+            ('django.db.backends.schema', 'CREATE TABLE', None),
+            ('django.request', 'Not Found', None),
+        ):
+            handler.handle(logging.makeLogRecord({
+                'name': name, 'msg': message, 'duration': duration,
+                'levelno': logging.DEBUG, 'levelname': 'DEBUG',
+            }))
+        handler.close()
+        self.assertEqual([line['message'] for line in self.read_lines()], ['slow', 'Not Found'])
+
+    def test_rotation_by_size(self):
+        handler = AsyncBatchHandler(self.filename, max_bytes=100, backup_count=2)
+        logger = self.make_logger(handler)
+        for number in range(5):
+            logger.info('record %s', number)
+            # пачки пишутся по одной, чтобы ротация проверялась между ними
+            handler.stop()
+        handler.close()
+        backups = [name for name in os.listdir(self.directory) if name != 'application.log']
+        self.assertEqual(len(backups), 2)
+
+    def test_file_rotated_by_other_process_is_reopened(self):
+        handler = AsyncBatchHandler(self.filename)
+        handler.setFormatter(JSONFormatter())
+        self.addCleanup(handler.close)
+        handler.write([logging.makeLogRecord({'msg': 'first'})])
+        # файл ротировал другой процесс
+        os.replace(self.filename, self.filename + '.1')
+        handler.write([logging.makeLogRecord({'msg': 'second'})])
+        handler.stream.close()
+        self.assertEqual([line['message'] for line in self.read_lines()], ['second'])
+
+    def test_low_priority_records_are_dropped_when_queue_is_full(self):
+        handler = AsyncBatchHandler(self.filename, queue_size=2, sample_rate=0, block_timeout=0.01)
+        logger = self.make_logger(handler)
+        # писатель ещё не запущен - очередь не разбирается
+        with mock.patch.object(AsyncBatchHandler, 'start'):
+            for number in range(5):
+                logger.info('record %s', number)
+            logger.error('error')
+        self.assertEqual(handler.dropped, 4)
+        handler.start()
+        handler.close()
+        messages = [line['message'] for line in self.read_lines()]
+        self.assertEqual(messages, ['record 0', 'error', 'log queue is full, 4 records dropped'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """
+        Бюджет SQL-запросов для каждого url courses/urls.py и courses/api/urls.py (и /api/async/).
+        Бюджеты - нынешнее число запросов: если тест упал, запросов стало больше
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = build_catalog()
+        cls.owner = cls.catalog.owners[0]
+        User.objects.filter(pk=cls.owner.pk).update(is_superuser=True)
+        cls.student = cls.catalog.students[0]
+        cls.course = cls.catalog.courses[0]
+        cls.module = cls.course.modules.first()
+        cls.content = cls.module.contents.first()
+
+    def test_budgets_do_not_depend_on_contents_count(self):
+        for number in range(8):
+            item = create_item(Text, self.owner, 1000 + number)
+            Content.objects.create(module=self.module, item=item)
+        self.client.force_login(self.owner)
+        self.assertQueryBudget(reverse('courses:module_content_list', args=[self.module.pk]), 10)
+        auth = 'Basic ' + base64.b64encode(b'student0:password').decode()
+        self.assertQueryBudget(reverse('api:course-courses', args=[self.course.pk]), 18, HTTP_AUTHORIZATION=auth)
+
+    def test_content_str(self):
+        # prefetch item уже положил типы в кэш ContentType
+        contents = list(module_contents(self.module))
+        with self.assertNumQueries(0):
+            [str(content) for content in contents]
+
+    def test_catalog(self):
+        self.assertQueryBudget(reverse('courses:course_list'), 4)
+        self.assertQueryBudget(reverse('courses:course_list_subject', args=[self.course.subject.slug]), 2)
+        self.assertQueryBudget(reverse('courses:course_detail', args=[self.course.slug]), 10)
+        self.client.force_login(self.student)
+        self.assertQueryBudget(reverse('courses:course_detail', args=[self.course.slug]), 12)
+
+    def test_manage_pages(self):
+        self.client.force_login(self.owner)
+        self.assertQueryBudget(reverse('courses:manage_course_list'), 3)
+        self.assertQueryBudget(reverse('courses:course_create'), 3)
+        self.assertQueryBudget(reverse('courses:course_update', args=[self.course.pk]), 4)
+        self.assertQueryBudget(reverse('courses:course_delete', args=[self.course.pk]), 3)
+        self.assertQueryBudget(reverse('courses:module_update', args=[self.course.pk]), 4)
+        self.assertQueryBudget(reverse('courses:module_content_list', args=[self.module.pk]), 10)
+        self.assertQueryBudget(reverse('courses:content_create', args=[self.module.pk, 'text']), 3)
+        item = self.content.item
+        self.assertQueryBudget(
+            reverse('courses:content_update', args=[self.module.pk, item._meta.model_name, item.pk]), 4
+        )
+
+    def test_manage_writes(self):
+        self.client.force_login(self.owner)
+        modules = self.course.modules.all()
+        self.assertQueryBudget(
+            reverse('courses:module_order_change'), 8, method='post',
+            data={module.pk: number for number, module in enumerate(reversed(modules))},
+            content_type='application/json'
+        )
+        contents = self.module.contents.all()
+        self.assertQueryBudget(
+            reverse('courses:content_order_change'), 8, method='post',
+            data={content.pk: number for number, content in enumerate(reversed(contents))},
+            content_type='application/json'
+        )
+        self.assertQueryBudget(
+            reverse('courses:content_delete', args=[self.content.pk]), 9, method='post', status=302
+        )
+
+    def test_api(self):
+        self.assertQueryBudget(reverse('api:api-root'), 0)
+        self.assertQueryBudget(reverse('api:list_subject'), 1)
+        self.assertQueryBudget(reverse('api:detail_subject', args=[self.course.subject.pk]), 1)
+        self.assertQueryBudget(reverse('api:course-list'), 1)
+        self.assertQueryBudget(reverse('api:course-list'), 2, data={'expand': 'modules'})
+        self.assertQueryBudget(reverse('api:course-detail', args=[self.course.pk]), 7)
+
+        auth = 'Basic ' + base64.b64encode(b'student0:password').decode()
+        self.assertQueryBudget(reverse('api:course-courses', args=[self.course.pk]), 18, HTTP_AUTHORIZATION=auth)
+        self.assertQueryBudget(
+            reverse('api:course-enroll', args=[self.catalog.courses[-1].pk]), 4,
+            method='post', HTTP_AUTHORIZATION=auth
+        )
+        self.assertQueryBudget(reverse('api:token'), 2, method='post', status=201, HTTP_AUTHORIZATION=auth)
+        key, _ = issue_token(self.student)
+        self.assertQueryBudget(
+            reverse('api:course-courses', args=[self.course.pk]), 16, HTTP_AUTHORIZATION=f'Token {key}'
+        )
+
+    def test_async_api(self):
+        # /api/async/ (courses/api/async_views.py) - те же представления, те же бюджеты
+        self.assertQueryBudget(reverse('api:async_list_subject'), 1, asgi=True)
+        self.assertQueryBudget(reverse('api:async_detail_subject', args=[self.course.subject.pk]), 1, asgi=True)
+        self.assertQueryBudget(reverse('api:async_course-list'), 1, asgi=True)
+        self.assertQueryBudget(reverse('api:async_course-list'), 2, asgi=True, data={'expand': 'modules'})
+        self.assertQueryBudget(reverse('api:async_course-detail', args=[self.course.pk]), 7, asgi=True)
+        key, _ = issue_token(self.student)
+        self.assertQueryBudget(
+            reverse('api:async_course-courses', args=[self.course.pk]), 18, asgi=True, Authorization=f'Token {key}'
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GenerateCatalogTestCase(TestCase):
+    options = {
+        'subjects': 2, 'courses': 3, 'modules': 2, 'contents': 5,
+        'owners': 2, 'students': 4, 'enrollments': 2, 'batch_size': 7,
+    }
+
+    def generate(self, **options):
+        call_command('generate_catalog', stdout=StringIO(), **{**self.options, **options})
+
+    def test_catalog_is_generated(self):
+        self.generate()
+        self.assertEqual(Course.objects.count(), 3)
+        self.assertEqual(Module.objects.count(), 6)
+        self.assertEqual(Content.objects.count(), 30)
+        self.assertEqual(Enrollment.objects.count(), 8)
+        course = Course.objects.prefetch_related(contents_prefetch('modules__contents')).first()
+        modules = list(course.modules.all())
+        self.assertEqual([module.order for module in modules], [0, 1])
+        items = [content.item for content in modules[0].contents.all()]
+        self.assertEqual(len(items), 5)
+        self.assertNotIn(None, items)
+        self.assertEqual({item.owner_id for item in items}, {course.owner_id})
+        # счётчик порядка продолжает нумерацию сгенерированных модулей
+        self.assertEqual(Module.objects.create(course=course, title='New').order, 2)
+
+    def test_order_counters_are_set_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.generate()
+        self.assertEqual(OrderCounter.objects.count(), 3 + 6)  # курсы (для модулей) и модули (для контента)
+        # по курсу на часть: INSERT и UPDATE счётчиков для модулей и для контента, а не по строке
+        counter_writes = [query for query in queries if 'courses_ordercounter' in query['sql']]
+        self.assertEqual(len(counter_writes), 3 * 2 * 2)
+
+    def test_same_seed_gives_same_catalog(self):
+        self.generate(prefix='first')
+        self.generate(prefix='second')
+        first, second = (
+            list(Course.objects.filter(slug__startswith=prefix).order_by('pk').values_list('description', flat=True))
+            for prefix in ('first', 'second')
+        )
+        self.assertEqual(first, second)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RequestReplayTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = build_catalog(subjects=1, courses=2, modules=1, contents=1, students=1, owners=1)
+
+    def test_sampled_request_is_recorded_without_secrets(self):
+        self.client.force_login(self.catalog.students[0])
+        course = self.catalog.courses[-1]
+        with override_settings(REQUEST_RECORDING={'SAMPLE_RATE': 1}), self.assertLogs('common.replay') as logs:
+            self.client.post(
+                reverse('students:student_enroll_course'),
+                urlencode({'course': course.pk, 'password': 'secret'}),
+                content_type='application/x-www-form-urlencoded'
+            )
+        line = parse_line(logs.records[0].getMessage())
+        self.assertEqual(line['method'], 'POST')
+        self.assertEqual(line['role'], 'student')
+        self.assertEqual(line['url_name'], 'students:student_enroll_course')
+        self.assertEqual(line['body'], {'course': [str(course.pk)]})
+        self.assertEqual(line['status'], 302)
+
+    def test_invalid_lines_are_skipped(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write('{"request_id": "user-001", "title": "not a recorded request"}\n')
+            file.write('garbage\n')
+            file.write('{"method": "get", "path": "/courses/"}\n')
+            file.write('{"method": "POST", "path": "/accounts/logout/"}\n')
+        self.addCleanup(os.remove, file.name)
+        lines, skipped = ReplayCommand().read_lines(file.name, limit=None)
+        self.assertEqual(skipped, 3)
+        self.assertEqual([(line['method'], line['url_name']) for line in lines], [('GET', 'courses:course_list')])
+
+    def test_status_differing_from_recorded_is_error(self):
+        self.assertFalse(is_failed(404, 404))
+        self.assertFalse(is_failed(304, 200))
+        self.assertTrue(is_failed(403, 302))
+        self.assertTrue(is_failed(404, 200))
+        self.assertTrue(is_failed(200, 500))
+        self.assertTrue(is_failed(403))
+        self.assertFalse(is_failed(302))
+        self.assertTrue(is_failed(None, 200))
+
+    def test_runs_are_compared(self):
+        def run(p95, errors=0):
+            stats = {'requests': 100, 'errors': errors, 'p95_ms': p95}
+            with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+                json.dump({'courses:course_list': stats}, file)
+            self.addCleanup(os.remove, file.name)
+            return file.name
+
+        base = run(100)
+        call_command('replay_requests', compare=base, against=run(105), stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'courses:course_list'):
+            call_command('replay_requests', compare=base, against=run(150), stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'courses:course_list'):
+            call_command('replay_requests', compare=base, against=run(100, errors=5), stdout=StringIO())
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncAPITestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = build_catalog(subjects=2, courses=2, modules=2, contents=2, students=1, owners=1)
+        cls.course = cls.catalog.courses[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def async_get(self, url, data=None, headers=None):
+        """
+            Запрос через AsyncClient: middleware и view в async-режиме, как под ASGI.
+            headers - имена заголовков HTTP (в django 4.0 AsyncClient не понимает HTTP_...)
+        """
+        async def get():
+            return await self.async_client.get(url, data, **(headers or {}))
+
+        return async_to_sync(get)()
+
+    def test_responses_match_sync_api(self):
+        pairs = [
+            ('list_subject', {}, {}),
+            ('detail_subject', {'pk': self.catalog.subjects[0].pk}, {}),
+            ('course-list', {}, {'expand': 'modules'}),
+            ('course-detail', {'pk': self.course.pk}, {}),
+        ]
+        for name, kwargs, data in pairs:
+            with self.subTest(name):
+                expected = self.client.get(reverse(f'api:{name}', kwargs=kwargs), data).json()
+                response = self.async_get(reverse(f'api:async_{name}', kwargs=kwargs), data)
+                self.assertEqual(response.status_code, 200)
+                result = response.json()
+                if 'results' in expected:
+                    # в ссылках пагинации - свой url
+                    expected, result = expected['results'], result['results']
+                self.assertEqual(result, expected)
+
+    def test_retrieve_not_modified_from_cache(self):
+        url = reverse('api:async_course-detail', kwargs={'pk': self.course.pk})
+        response = self.async_get(url)
+        etag = response['ETag']
+        # ETag тот же, что у синхронного API
+        self.assertEqual(self.client.get(reverse('api:course-detail', kwargs={'pk': self.course.pk}))['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.async_get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.catalog.modules[0].title = 'Renamed module'
+        self.catalog.modules[0].save()
+        self.assertEqual(self.async_get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_contents_requires_enrollment(self):
+        url = reverse('api:async_course-courses', kwargs={'pk': self.course.pk})
+        key, _ = issue_token(self.catalog.students[0])
+        response = self.async_get(url, headers={'Authorization': f'Token {key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['modules']), 2)
+        self.assertEqual(self.async_get(url).status_code, 401)
+
+    @override_settings(REQUEST_PROFILING={'SAMPLE_RATE': 1})
+    def test_async_requests_are_profiled(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.async_get(reverse('api:async_course-list'))
+        text = metrics.render()
+        # SQL выполнялся в потоке sync_to_async, замер - из ContextVar запроса
+        self.assertIn('request_db_queries_count{view="api:async_course-list"} 1', text)
+        self.assertNotIn('request_db_queries_sum{view="api:async_course-list"} 0', text)
@@ -0,0 +1,71 @@
+"""
+Имена версий (common/cache.py) для данных курсов.
+Версия курса увеличивается при любом изменении самого курса, его модулей,
+контента и объектов Text|Image|File|Video, на которые ссылается контент.
+Версия модуля - только при изменении его контента (в том числе порядка).
+Версия записей пользователя увеличивается при записи/отписке от курсов.
+Версия токенов API - при изменении любого токена или пользователя (отзыв, is_active).
+Вместе с версией курса запоминается время изменения (для Last-Modified)
+"""
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+
+from common.cache import bump_version, bump_versions
+from courses.models import Content
+
+COURSE_MODIFIED_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def course_version_name(course_id):
+    return f'course:{course_id}'
+
+
+def module_version_name(module_id):
+    return f'module:{module_id}'
+
+
+def user_courses_version_name(user_id):
+    return f'user_courses:{user_id}'
+
+
+API_TOKENS_VERSION_NAME = 'api_tokens'
+
+
+def course_modified_key(course_id):
+    return f'course_modified:{course_id}'
+
+
+def module_and_course_ids_for_item(item):
+    """(id модуля, id курса) для всех модулей, в которых используется item (Text|Image|File|Video)"""
+    return set(
+        Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(item),
+            object_id=item.pk
+        ).values_list('module_id', 'module__course_id')
+    )
+
+
+def bump_course_versions(course_ids):
+    course_ids = set(course_ids)
+    if not course_ids:
+        return
+    bump_versions(course_version_name(course_id) for course_id in course_ids)
+    now = timezone.now()
+    cache.set_many(
+        {course_modified_key(course_id): now for course_id in course_ids},
+        COURSE_MODIFIED_TIMEOUT
+    )
+
+
+def bump_module_versions(module_ids):
+    bump_versions(module_version_name(module_id) for module_id in module_ids)
+
+
+def bump_user_courses_versions(user_ids):
+    bump_versions(user_courses_version_name(user_id) for user_id in user_ids)
+
+
+def bump_api_tokens_version():
+    bump_version(API_TOKENS_VERSION_NAME)
@@ -1,8 +1,8 @@
 from braces.views import JsonRequestResponseMixin, CsrfExemptMixin
 
 from django.apps import apps
-from django.db.models import Count
-from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from django.http import Http404
 from django.urls import reverse_lazy
 from django.forms import modelform_factory
 from django.shortcuts import redirect, get_object_or_404
@@ -16,7 +16,13 @@ from django.views.generic import (
     UpdateView, DetailView, DeleteView,
 )
 
+from courses import catalog
 from courses.forms import ModuleFormSet
+from courses.prefetch import module_contents
+from courses.read_models import ManageCourseRow, read
+from courses.conditional import CourseConditionalMixin
+from courses.reorder import parse_orders, bulk_reorder
+from courses.versions import bump_course_versions, bump_module_versions
 from courses.models import (
     Subject, Course,
     Module, Content,
@@ -29,8 +35,6 @@ from common.analize.analizetools import (
     show_doc, console, console_compose,
 )
 
-TIME_FOR_CACHE = 600 * 720  # --- 5 суток
-
 
 class OwnerMixin:
     def get_queryset(self):
@@ -78,7 +82,13 @@ class ManageCourseListView(OwnerCourseMixin, ListView):
     template_name = 'courses/manage/course/list.html'
 
     def get_queryset(self):
-        return super().get_queryset().prefetch_related('modules')
+        # из модулей странице нужен только первый (ссылка "Редактировать")
+        first_module = Module.objects.filter(course_id=OuterRef('pk')).order_by('order').values('pk')[:1]
+        return super().get_queryset().annotate(first_module_id=Subquery(first_module))
+
+    def get_context_data(self, **kwargs):
+        # в шаблон - строки ManageCourseRow, а не модели
+        return super().get_context_data(object_list=read(ManageCourseRow, self.object_list), **kwargs)
 
 
 class CourseCreateView(PermissionRequiredMixin, OwnerCourseEditMixin, CreateView):
@@ -316,97 +326,101 @@ class ModuleContentListView(TemplateResponseMixin, View):
             course__owner=request.user
         )
         return self.render_to_response(
-            context={'module': module, }
+            context={
+                'module': module,
+                'contents': module_contents(module),
+            }
         )
 
 
-class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    def post(self, request, *args, **kwargs):
-        for pk, order in self.request_json.items():
-            Module.objects.filter(
-                pk=pk,
-                course__owner=request.user).update(order=order)
-        return self.render_json_response(
-            context_dict={'saved': 'ok', }
-        )  # вернёт http ответ с Content-Type: application/json
+class OrderUpdateMixin(CsrfExemptMixin, JsonRequestResponseMixin):
+    """
+        Общая логика смены порядка (order) для Module и Content.
+        Тело запроса - {"<pk>": <order>, ...}, весь порядок сохраняется
+        одним UPDATE в одной транзакции (courses/reorder.py)
+    """
 
+    model = None  # Module или Content - задаёт наследник
+    owner_lookup = None  # путь от модели до владельца курса
+    course_lookup = None  # путь от модели до id курса (для сброса кэша курса)
+    module_lookup = None  # путь до id модуля, если порядок меняется внутри модуля
+
+    def get_reorder_queryset(self, request, *args, **kwargs):
+        # менять порядок можно только в своих курсах
+        return self.model.objects.filter(**{self.owner_lookup: request.user})
 
-class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
     def post(self, request, *args, **kwargs):
-        for pk, order in self.request_json.items():
-            Content.objects.filter(
-                pk=pk,
-                module__course__owner=request.user).update(order=order)
+        try:
+            orders = parse_orders(self.request_json)
+        except (TypeError, ValueError) as error:
+            return self.render_bad_request_response(
+                error_dict={'error': str(error), }
+            )
+        queryset = self.get_reorder_queryset(request, *args, **kwargs)
+        if bulk_reorder(queryset, orders):
+            # update() не посылает сигналы post_save, поэтому версии меняем сами
+            self.bump_versions(queryset, orders)
         return self.render_json_response(
             context_dict={'saved': 'ok', }
         )  # вернёт http ответ с Content-Type: application/json
 
+    def bump_versions(self, queryset, pks):
+        lookups = [self.course_lookup, ]
+        if self.module_lookup:
+            lookups.append(self.module_lookup)
+        rows = list(
+            queryset.filter(pk__in=pks).order_by().values_list(*lookups).distinct()
+        )
+        bump_course_versions(row[0] for row in rows)
+        if self.module_lookup:
+            bump_module_versions(row[1] for row in rows)
 
-# это если я решу посылать url параметры по этому адресу
-# для этого обработчика нужно изменить url шаблоны и формирование url в js-коде
-class ModuleOrContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
 
-    @staticmethod
-    def get_model(model_name):
-        model_dict = {
-            'content': Content,
-            'module': Module,
-        }
-        return model_dict.get(model_name.lower())
+class ModuleOrderView(OrderUpdateMixin, View):
+    model = Module
+    owner_lookup = 'course__owner'
+    course_lookup = 'course_id'
 
-    @staticmethod
-    def get_params(pk, request, model_name):
-        lookup_dict = {
-            'content': 'course__owner',
-            'module': 'module__course__owner',
-        }
-
-        return {
-            'pk': pk,
-            lookup_dict[model_name]: request.user,
-        }
-
-    def post(self, request, model_name, *args, **kwargs):
-        model = self.get_model(model_name)
-        for pk, order in self.request_json.items():
-            params = self.get_params(
-                pk=pk,
-                request=request,
-                model_name=model_name
-            )
-            model.objects.filter(**params).update(order=order)
-        return self.render_json_response(
-            context_dict={'saved': 'ok', }
-        )  # вернёт http ответ с Content-Type: application/json
+
+class ContentOrderView(OrderUpdateMixin, View):
+    model = Content
+    owner_lookup = 'module__course__owner'
+    course_lookup = 'module__course_id'
+    module_lookup = 'module_id'
+
+
+# это если я решу посылать url параметры по этому адресу
+# для этого обработчика нужно изменить url шаблоны и формирование url в js-коде
+class ModuleOrContentOrderView(OrderUpdateMixin, View):
+    order_views = {
+        'content': ContentOrderView,
+        'module': ModuleOrderView,
+    }
+
+    def get_reorder_queryset(self, request, model_name, *args, **kwargs):
+        view_class = self.order_views.get(model_name.lower())
+        if view_class is None:
+            raise Http404
+        # настройки (model и lookup-и) берутся у представления для этой модели
+        for attr in ('model', 'owner_lookup', 'course_lookup', 'module_lookup'):
+            setattr(self, attr, getattr(view_class, attr))
+        return super().get_reorder_queryset(request, *args, **kwargs)
 
 
 class CourseListView(TemplateResponseMixin, View):
     template_name = 'courses/course/list.html'
 
     def get(self, request, subject_slug=None, *args, **kwargs):
-        subject_list = cache.get('all_subjects')
-        if not subject_list:
-            subject_list = Subject.objects.annotate(total_courses=Count('courses'))
-            cache.set('all_subjects', subject_list, TIME_FOR_CACHE)  # 600 * 720   --- 5 суток
-
-        all_courses = Course.objects.annotate(total_modules=Count('modules')).select_related('owner', 'subject')
+        # каталог уже собран и лежит в кэше (courses/catalog.py)
+        subject_list = catalog.get_subjects()
         subject = None
         if subject_slug:
-            subject = get_object_or_404(
-                klass=Subject,
-                slug=subject_slug
-            )
-            # course_list = cache.get(f'subject_{subject.pk}_courses')
-            course_list = None
-            if not course_list:
-                course_list = all_courses.filter(subject=subject)
-                # cache.set(f'subject_{subject.pk}_courses', course_list, TIME_FOR_CACHE)  # 600 * 720   --- 5 суток
+            subject = catalog.get_subject(subject_slug, subject_list)
+            if subject is None:
+                raise Http404
+            course_list = catalog.get_subject_courses(subject.id)
         else:
-            course_list = cache.get('all_courses')
-            course_list = None
-            if not course_list:
-                course_list = all_courses
-                # cache.set('all_courses', all_courses)
+            course_list = catalog.get_all_courses(subject_list)
         return self.render_to_response(
             context={
                 'subject': subject,
@@ -416,9 +430,10 @@ class CourseListView(TemplateResponseMixin, View):
         )
 
 
-class CourseDetailView(DetailView):
+class CourseDetailView(CourseConditionalMixin, DetailView):
     model = Course
     template_name = 'courses/course/detail.html'
+    conditional_csrf = True  # форма записи на курс
 
     def get_context_data(self, **kwargs):
         ctx = super(CourseDetailView, self).get_context_data(**kwargs)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -29,8 +30,15 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# middleware debug toolbar только синхронный: под ASGI из-за него django выполняет
+# весь запрос в потоке, как под WSGI. Для ASGI (бенчмарк bench_asgi) - DEBUG_TOOLBAR=0
+DEBUG_TOOLBAR = DEBUG and os.getenv('DEBUG_TOOLBAR', '1') == '1'
+
 ALLOWED_HOSTS = []
 
+# manage.py test - логи не пишутся в файлы log/ (см. LOGGING)
+TESTING = sys.argv[1:2] == ['test']
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -50,12 +58,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    *(['debug_toolbar.middleware.DebugToolbarMiddleware'] if DEBUG_TOOLBAR else []),
+    'common.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'common.routers.PrimaryPinMiddleware',
+    'common.replay.RequestRecordingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,8 +98,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # соединение живёт между запросами (секунды, 0 - закрывать после каждого запроса)
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        # проверять постоянное соединение в начале запроса (common/db.py)
+        'HEALTH_CHECKS': True,
+        # PRAGMA для каждого нового соединения, по умолчанию common.db.SQLITE_PRAGMAS
+        # 'PRAGMAS': {'journal_mode': 'WAL', 'busy_timeout': 5000, },
     }
 }
+# реплика только для чтения (common/routers.py). Локально её заменяет копия
+# файла базы: DB_REPLICA_NAME=/path/to/replica.sqlite3
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+}
+
+DATABASE_ROUTERS = ['common.routers.ReplicaRouter', ]
+# пусто - все запросы идут в default
+REPLICA_DATABASES = ['replica', ] if os.getenv('DB_REPLICA_NAME') else []
+# модели каких приложений читать с реплик
+REPLICA_APPS = ('courses', 'students', )
+# сколько секунд после записи пользователь читает из default (видит свои изменения)
+PRIMARY_PIN_SECONDS = 10
+
+# -------------------------------------------------------- запись запросов для replay
+# common/replay.py: какая доля запросов пишется в log/requests.jsonl (0 - не пишется)
+REQUEST_RECORDING = {
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_RECORDING_RATE', 0)),
+    'MAX_BODY': 16 * 1024,
+}
+
+# -------------------------------------------------------- профилирование запросов
+# common/profiling.py: доля замеряемых запросов, метрики - /metrics/
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0.05)),
+    # медленнее (мс) - сохранить cProfile выбранного запроса в PROFILE_DIR; None - не профилировать
+    'PROFILE_SLOW_MS': int(os.environ['PROFILING_SLOW_MS']) if os.environ.get('PROFILING_SLOW_MS') else None,
+    'PROFILE_DIR': os.path.join(BASE_DIR, 'log', 'profiles'),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -169,6 +217,13 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {  # одна запись - одна строка JSON (common/log.py)
+            '()': 'common.log.JSONFormatter',
+        },
+        'raw': {  # сообщение как есть (записанные запросы - уже JSON)
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'filters': {
         # 'special': {
@@ -178,6 +233,10 @@ LOGGING = {
         'require_debug_true': {  # require_debug_true - мы будем фиксировать логирование, когда DEBUG = True
             '()': 'django.utils.log.RequireDebugTrue',
         },
+        'slow_queries': {  # только SQL-запросы дольше threshold_ms (0 - все запросы)
+            '()': 'common.log.SlowQueryFilter',
+            'threshold_ms': int(os.environ.get('LOG_SLOW_QUERY_MS', 100)),
+        },
     },
     'handlers': {  # хэндлеры говорят о том, каким образом мы можем обрабатывать полученное сообщение
         # куда их выводить, в консоль, в файл, на почту?
@@ -187,11 +246,26 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple'
         },
-        'file': {  # вывести в файл
+        'file': {  # вывести в файл - из фонового потока, пачками (common/log.py)
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'common.log.AsyncBatchHandler',
             'filename': BASE_DIR.joinpath('log/application.log'),
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'max_bytes': 10 * 1024 * 1024,  # ротация по размеру
+            'rotate_seconds': 60 * 60 * 24,  # и по времени
+            'backup_count': 7,
+            'queue_size': 10000,  # при заполнении отбрасываются записи ниже WARNING
+            # на хэндлере, а не на логгере: фильтр логгера не видит записи дочерних
+            # логгеров (django.db.backends.schema и т.п.)
+            'filters': ['slow_queries'],
+        },
+        'replay_file': {  # выборка запросов для replay_requests (common/replay.py)
+            'level': 'INFO',
+            'class': 'common.log.AsyncBatchHandler',
+            'filename': BASE_DIR.joinpath('log/requests.jsonl'),
+            'formatter': 'raw',
+            'max_bytes': 50 * 1024 * 1024,
+            'backup_count': 3,
         },
         # 'mail_admins': {  # послать по почте
         #     'level': 'ERROR',
@@ -209,6 +283,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'common.replay': {
+            'handlers': ['replay_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         # 'django': {
         #     'handlers': ['console'],
         #     'propagate': True,
@@ -221,6 +300,11 @@ LOGGING = {
     }
 }
 
+if TESTING:
+    # тесты не пишут в log/ (и не вызывают его ротацию)
+    for name in ('file', 'replay_file'):
+        LOGGING['handlers'][name] = {'class': 'logging.NullHandler'}
+
 # -------------------------------------- LOGIN
 
 # куда django будет перенаправлять при успешной авторизации (если не указан GET параметр next)
@@ -233,22 +317,80 @@ LOGIN_URL = 'login'
 LOGOUT_URL = 'logout'
 
 # -------------------------------------- CACHES
+# L2 - кэш, общий для всех воркеров. Без memcached (локально, офлайн) можно
+# выставить CACHE_SHARED=file (общий для процессов) или CACHE_SHARED=locmem.
+# У файлового кэша incr не атомарный - журнал L1 на нём не работает, поэтому
+# с CACHE_SHARED=file он используется сам, без L1
+CACHE_SHARED = os.getenv('CACHE_SHARED', 'memcached')
+SHARED_CACHES = {
+    'memcached': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.getenv('MEMCACHED_LOCATION', '127.0.0.1:11211'),
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+}
+
 CACHES = {
+    # L1 в памяти процесса перед общим кэшем (common/cache_backends.py)
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
-        'LOCATION': '127.0.0.1:11211',
-    }
+        'BACKEND': 'common.cache_backends.TwoTierCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'MAX_SIZE': 4096,
+            'L1_TIMEOUT': 60,
+            'CHECK_INTERVAL': 1,  # через сколько секунд запись одного воркера видна остальным
+        },
+    },
+    'shared': SHARED_CACHES[CACHE_SHARED],
+}
+if CACHE_SHARED == 'file':
+    CACHES = {'default': SHARED_CACHES['file']}
+
+# кэш готового HTML для контента (courses/render_cache.py)
+# ENABLED = False - каждый render() будет заново рендерить шаблон (удобно при отладке шаблонов)
+ITEM_RENDER_CACHE = {
+    'ENABLED': os.getenv('ITEM_RENDER_CACHE_DISABLED') is None,
+    'BACKENDS': [
+        {
+            'BACKEND': 'courses.render_cache.LRUBackend',
+            'OPTIONS': {'max_size': 2048, },
+        },
+        {
+            'BACKEND': 'courses.render_cache.DjangoCacheBackend',
+            'OPTIONS': {'alias': 'default', 'timeout': 60 * 60 * 24, },
+        },
+    ],
 }
 
 # -------------------------------------- REST_FRAMEWORK
+# токены для API (courses/api/authentication.py)
+API_TOKEN = {
+    'LIFETIME': None,  # в секундах, None - токен бессрочный (до отзыва)
+    'CACHE_TIMEOUT': 60,  # сколько проверенный токен хранится в памяти процесса
+}
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'courses.api.authentication.HashedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',  # закомменть, если хочешь, чтобы отдавался чистый JSON
+        'courses.api.renderers.FastJSONRenderer',  # orjson, если установлен
+        # html-страница API нужна только при разработке, рендерится она в разы дольше JSON
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
     ]
 }
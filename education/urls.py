@@ -19,6 +19,8 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
+from common.profiling import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('courses/', include('courses.urls', namespace='courses')),
@@ -27,6 +29,7 @@ urlpatterns = [
     path('accounts/logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('api/', include('courses.api.urls', namespace='api')),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 if settings.DEBUG:
     urlpatterns += static(
@@ -0,0 +1,55 @@
+"""
+Кэш страниц студента.
+
+cache_page кэширует по одному url, поэтому страница одного студента
+отдавалась бы другому. Здесь в ключ входят id пользователя и версии данных,
+от которых зависит страница (записи пользователя на курсы, содержимое курса),
+поэтому кэш можно держать долго - любое изменение меняет ключ.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers, patch_cache_control
+
+from common.cache import get_versions
+from common.routers import primary_reads
+from courses.versions import user_courses_version_name
+
+
+class UserPageCacheMixin:
+    page_cache_timeout = 60 * 60 * 6
+    page_cache_prefix = 'student_page'
+
+    def get_page_cache_versions(self):
+        """имена версий (common/cache.py), от которых зависит страница"""
+        return [user_courses_version_name(self.request.user.pk), ]
+
+    def get_page_cache_key(self):
+        versions = get_versions(self.get_page_cache_versions())
+        raw_key = ':'.join([
+            self.request.get_full_path(),
+            *(f'{name}={version}' for name, version in sorted(versions.items())),
+        ])
+        digest = hashlib.md5(raw_key.encode()).hexdigest()
+        return f'{self.page_cache_prefix}:{self.request.user.pk}:{digest}'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key()
+        response = cache.get(key)
+        if response is None:
+            # страница ляжет в кэш под версиями - читаем не с реплики (common/routers.py),
+            # поэтому и рендерим здесь же (queryset'ы в шаблоне ленивые)
+            with primary_reads():
+                response = super().dispatch(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.render()
+            if response.status_code == 200:
+                cache.set(key, response, self.page_cache_timeout)
+        # страница у каждого пользователя своя - общим кэшам (прокси, браузер) её не отдаём
+        patch_vary_headers(response, ('Cookie',))
+        patch_cache_control(response, private=True)
+        return response
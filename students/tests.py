@@ -1,3 +1,225 @@
-from django.test import TestCase
+from django.urls import reverse
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from common.routers import PIN_COOKIE
+from courses.enrollment import is_enrolled
+from common.testing import QueryBudgetMixin, build_catalog
+from courses.models import Subject, Course, Module, Content, Text
+
+User = get_user_model()
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StudentPageCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.first = User.objects.create_user(username='first', password='password')
+        cls.second = User.objects.create_user(username='second', password='password')
+        subject = Subject.objects.create(title='Subject')
+        cls.course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Python course', description='description'
+        )
+        cls.other_course = Course.objects.create(
+            owner=cls.owner, subject=subject,
+            title='Django course', description='description'
+        )
+        cls.module = Module.objects.create(course=cls.course, title='Module')
+        cls.text = Text.objects.create(owner=cls.owner, title='Lesson', content='first version')
+        Content.objects.create(module=cls.module, item=cls.text)
+        cls.course.students.add(cls.first)
+        cls.other_course.students.add(cls.second)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_course_list_is_cached_per_user(self):
+        url = reverse('students:student_course_list')
+        self.client.force_login(self.first)
+        self.assertContains(self.client.get(url), 'Python course')
+        self.client.force_login(self.second)
+        response = self.client.get(url)
+        self.assertContains(response, 'Django course')
+        self.assertNotContains(response, 'Python course')
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_course_list_is_served_from_cache(self):
+        url = reverse('students:student_course_list')
+        self.client.force_login(self.first)
+        self.client.get(url)
+        # только сессия и пользователь
+        with self.assertNumQueries(2):
+            self.assertContains(self.client.get(url), 'Python course')
+
+    def test_course_list_is_invalidated_by_enrollment(self):
+        url = reverse('students:student_course_list')
+        self.client.force_login(self.first)
+        self.assertNotContains(self.client.get(url), 'Django course')
+        self.other_course.students.add(self.first)
+        self.assertContains(self.client.get(url), 'Django course')
+
+    def test_course_list_is_invalidated_by_course_edit(self):
+        url = reverse('students:student_course_list')
+        self.client.force_login(self.first)
+        self.client.get(url)
+        self.course.title = 'Renamed course'
+        self.course.save()
+        self.assertContains(self.client.get(url), 'Renamed course')
+
+    def test_course_detail_is_invalidated_by_course_edit(self):
+        url = reverse('students:student_course_detail', kwargs={'slug': self.course.slug})
+        self.client.force_login(self.first)
+        self.assertContains(self.client.get(url), 'Module')
+        self.module.title = 'Renamed module'
+        self.module.save()
+        self.assertContains(self.client.get(url), 'Renamed module')
+
+    def test_course_without_modules(self):
+        url = reverse('students:student_course_detail', kwargs={'slug': self.other_course.slug})
+        self.client.force_login(self.second)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['module'])
+
+    def test_module_content_fragment_is_invalidated_by_content_edit(self):
+        url = reverse('students:student_course_detail', kwargs={'slug': self.course.slug})
+        self.client.force_login(self.first)
+        self.assertContains(self.client.get(url), 'first version')
+        self.text.content = 'second version'
+        self.text.save()
+        self.assertContains(self.client.get(url), 'second version')
+
+    def test_module_content_fragment_is_invalidated_by_reorder(self):
+        second_text = Text.objects.create(owner=self.owner, title='Second lesson', content='second')
+        second_content = Content.objects.create(module=self.module, item=second_text)
+        first_content = self.module.contents.get(object_id=self.text.pk)
+        url = reverse('students:student_course_detail', kwargs={'slug': self.course.slug})
+        self.client.force_login(self.first)
+        content = self.client.get(url).content.decode()
+        self.assertLess(content.index('first version'), content.index('second'))
+
+        self.client.force_login(self.owner)
+        self.client.post(
+            reverse('courses:content_order_change'),
+            data={str(first_content.pk): 1, str(second_content.pk): 0},
+            content_type='application/json'
+        )
+        self.client.force_login(self.first)
+        content = self.client.get(url).content.decode()
+        self.assertGreater(content.index('first version'), content.index('<p>second'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, REPLICA_DATABASES=['replica'])
+class ReplicaRouterTestCase(TestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        # реплика - отдельная база, строки в неё копируем сами (как репликация)
+        for db in ('default', 'replica'):
+            User.objects.db_manager(db).create_user(id=1, username='owner', password='password')
+            User.objects.db_manager(db).create_user(id=2, username='student', password='password')
+            Subject.objects.using(db).create(id=1, title='Subject', slug='subject')
+            Course.objects.using(db).create(
+                id=1, owner_id=1, subject_id=1,
+                title='Python course', slug='python-course', description='description'
+            )
+        cls.student = User.objects.get(pk=2)
+        cls.course = Course.objects.get(pk=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_go_to_replica_in_request(self):
+        Course.objects.create(
+            owner_id=1, subject_id=1,
+            title='Django course', slug='django-course', description='description'
+        )
+        # вне запроса - из default
+        self.assertEqual(Course.objects.count(), 2)
+        response = self.client.get(reverse('api:course-list'))
+        self.assertEqual([course['title'] for course in response.json()['results']], ['Python course'])
+
+    def test_user_is_pinned_to_primary_after_write(self):
+        # курс есть только в default; список курсов API не кэшируется - читается с реплики
+        Course.objects.create(
+            id=2, owner_id=1, subject_id=1,
+            title='Django course', slug='django-course', description='description'
+        )
+        url = reverse('api:course-list')
+        self.client.force_login(self.student)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+        response = self.client.post(
+            reverse('students:student_enroll_course'), data={'course': self.course.pk}
+        )
+        self.assertEqual(response.status_code, 302)
+        # запись на курс есть только в default
+        self.assertTrue(self.course.students.filter(pk=self.student.pk).exists())
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+
+        # окно закончилось - снова реплика
+        cache.clear()
+        self.client.cookies.pop(PIN_COOKIE)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+    def test_cached_data_is_read_from_primary(self):
+        # реплика ещё не получила изменения, а версии (ключи кэша) уже новые
+        Course.objects.create(
+            id=2, owner_id=1, subject_id=1,
+            title='Django course', slug='django-course', description='description'
+        )
+        self.course.students.add(self.student)
+        self.assertContains(self.client.get(reverse('courses:course_list')), 'Django course')
+        self.assertEqual(len(self.client.get(reverse('api:course-list')).json()['results']), 1)
+        self.client.force_login(self.student)
+        self.assertContains(self.client.get(reverse('students:student_course_list')), 'Python course')
+        self.assertTrue(is_enrolled(self.student, self.course))
+
+    def test_pin_cookie(self):
+        self.client.cookies[PIN_COOKIE] = '1'
+        Course.objects.create(
+            owner_id=1, subject_id=1,
+            title='Django course', slug='django-course', description='description'
+        )
+        response = self.client.get(reverse('api:course-list'))
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StudentQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """Бюджет SQL-запросов для каждого url students/urls.py"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalog = build_catalog()
+        cls.student = cls.catalog.students[0]
+        cls.course = cls.catalog.courses[0]
+        cls.module = cls.course.modules.last()
+
+    def test_anonymous_pages(self):
+        self.assertQueryBudget(reverse('students:register'), 0)
+        self.assertQueryBudget(reverse('students:empty'), 0)
+
+    def test_student_pages(self):
+        self.client.force_login(self.student)
+        self.assertQueryBudget(reverse('students:student_course_list'), 4)
+        self.assertQueryBudget(reverse('students:student_course_detail', args=[self.course.slug]), 19)
+        self.assertQueryBudget(
+            reverse('students:student_course_detail_module', args=[self.course.slug, self.module.pk]), 17
+        )
+        self.assertQueryBudget(
+            reverse('students:student_enroll_course'), 5, method='post',
+            data={'course': self.catalog.courses[-1].pk}, status=302
+        )
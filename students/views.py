@@ -1,7 +1,7 @@
 from braces.views import AnonymousRequiredMixin
 
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.urls import reverse_lazy
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -10,6 +10,11 @@ from django.views.generic import (
 )
 
 from courses.models import Course
+from courses.enrollment import enroll, user_course_ids
+from courses.outline import get_outline, render_contents
+from courses.versions import course_version_name, user_courses_version_name
+from courses.conditional import CourseConditionalMixin
+from students.cache import UserPageCacheMixin
 from students.forms import RegistrationModelForm, CourseEnrollForm
 
 from common.analize.analizetools import (
@@ -57,13 +62,7 @@ class StudentEnrollCourseView(LoginRequiredMixin, FormView):
     def form_valid(self, form):
         cd = form.cleaned_data
         self.course = cd['course']
-
-        # --- console ---
-        console(cd)
-        console(self.request.POST)
-        # --- console ---
-
-        self.course.students.add(self.request.user)
+        enroll(self.request.user, self.course)
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -72,32 +71,59 @@ class StudentEnrollCourseView(LoginRequiredMixin, FormView):
         })
 
 
-class StudentCourseListView(LoginRequiredMixin, ListView):
+class StudentCourseListView(LoginRequiredMixin, UserPageCacheMixin, ListView):
     model = Course
     template_name = 'students/course/list.html'
 
+    def get_page_cache_versions(self):
+        # на странице названия и slug курсов - их изменение тоже меняет ключ
+        versions = super().get_page_cache_versions()
+        versions.extend(course_version_name(course_id) for course_id in user_course_ids(self.request.user))
+        return versions
+
     def get_queryset(self):
         return super().get_queryset().filter(students__in=[self.request.user, ])
 
 
-class StudentCourseDetailView(LoginRequiredMixin, DetailView):
+class StudentCourseDetailView(LoginRequiredMixin, CourseConditionalMixin, UserPageCacheMixin, DetailView):
     model = Course
     template_name = 'students/course/detail.html'
 
+    def get_conditional_versions(self):
+        # после отписки от курса страница должна стать 404, а не 304
+        return [user_courses_version_name(self.request.user.pk), ]
+
+    def get_page_cache_versions(self):
+        versions = super().get_page_cache_versions()
+        course_id = self.get_course_id()
+        if course_id is not None:
+            versions.append(course_version_name(course_id))
+        return versions
+
     def get_queryset(self):
         return super().get_queryset().filter(
             students__in=[self.request.user, ]
-        ).prefetch_related('modules')
+        )
 
     def get_context_data(self, **kwargs):
         ctx = super(StudentCourseDetailView, self).get_context_data(**kwargs)
         # course = self.get_object()
         course = ctx['object']  # так делает меньше SQL запросов
+        # модули и контент - из снимка курса (courses/outline.py)
+        modules = get_outline(course.pk)['modules']
         if 'module_id' in self.kwargs:
-            module = course.modules.get(pk=self.kwargs['module_id'])
+            module = next(
+                (m for m in modules if m['id'] == self.kwargs['module_id']),
+                None
+            )
+            if module is None:
+                raise Http404
         else:
-            module = course.modules.all()[0]
+            module = modules[0] if modules else None  # модулей пока нет
+        ctx['modules'] = modules
         ctx['module'] = module
+        # HTML - только контента открытого модуля, из кэша HTML
+        ctx['contents'] = render_contents(module['contents']) if module is not None else []
         return ctx
 
 